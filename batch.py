@@ -0,0 +1,225 @@
+#
+# Natural Language Interface to Databases
+#       Batch Translation
+#
+# Headless mode: questions are streamed from a JSONL, CSV or
+# plain text file (or stdin) through the translation pipeline
+# and the generated SQL and its bind variables are written out as
+# JSON lines, one per question, in input order.
+#
+# Work is spread across a process pool. Each worker opens its
+# own schema catalog (from the snapshot when one exists) and,
+# with --execute, its own database session. With --schema the
+# workers translate for that schema instead, using its catalog
+# and the compiled lexicon they all map from the lexicon store.
+#
+# Left over words cannot be asked about. Those the value index
+# cannot place are ignored and reported back in the "unresolved"
+# field of the output record.
+#
+# Usage:
+#   python batch.py questions.jsonl -o translated.jsonl
+#   python batch.py questions.csv --execute --sqlite
+#   cat questions.txt | python batch.py - --format text
+#   python batch.py questions.txt --schema SALES
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import implementation
+from lexiconstore import LexiconStore, SchemaRegistry
+from pool import SqliteBackend
+from translationcache import TranslationCache
+from valueindex import ValueIndex, ignoreWord
+
+worker = {}
+#
+#                   INPUT
+# Yields {'id', 'question'} records from the source.
+#
+# JSONL records need a "question" key and may carry an "id".
+# CSV files need a "question" column and may have an "id" column.
+# Text files hold one question per line.
+# Records without an id are numbered by their position.
+#
+# @param handle open file object
+# @param inputFormat STRING jsonl, csv or text
+#
+
+
+def readQuestions(handle, inputFormat):
+    if inputFormat == 'csv':
+        rows = csv.DictReader(handle)
+    elif inputFormat == 'jsonl':
+        rows = (json.loads(line) for line in handle if line.strip())
+    else:
+        rows = ({'question': line.strip()} for line in handle
+                if line.strip())
+    for lineNumber, row in enumerate(rows, 1):
+        yield {'id': row.get('id') or lineNumber,
+               'question': row['question']}
+
+
+def guessFormat(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.json', '.ndjson'):
+        return 'jsonl'
+    return 'text'
+#
+#                   WORKER
+# Per-process set up. Pipeline progress messages are silenced
+# so that only the JSON lines reach the output.
+#
+# @param useSqlite BOOLEAN run against the SQLite stand-in
+# @param execute BOOLEAN run the generated SQL as well
+# @param maxRows INT rows kept per result when executing
+# @param schema STRING schema to translate for, None for the
+#               session's own
+#
+
+
+def openWorker(useSqlite, execute, maxRows, schema=None):
+    sys.stdout = open(os.devnull, 'w')
+    backend = SqliteBackend() if useSqlite else None
+    pool, catalog = implementation.databaseConnection(backend)
+    lexicon = None
+    if schema:
+        catalog, lexicon = SchemaRegistry(pool, LexiconStore()).get(schema)
+    worker.update(pool=pool, catalog=catalog, lexicon=lexicon,
+                  cache=TranslationCache(),
+                  valueIndex=ValueIndex.fromPool(pool), execute=execute,
+                  maxRows=maxRows)
+
+
+def translateRecord(record):
+    unresolved = []
+
+    def ignoreLeftOver(word):
+        unresolved.append(word)
+        return ignoreWord
+
+    result = {'id': record['id'], 'question': record['question'],
+              'sql': None, 'binds': None, 'unresolved': unresolved}
+    try:
+        result['sql'], result['binds'] = implementation.translate(
+            record['question'], worker['catalog'],
+            worker['valueIndex'].resolver(ignoreLeftOver), worker['cache'],
+            worker['lexicon'], worker['valueIndex'])
+        if result['sql'] is None:
+            result['error'] = 'no query could be constructed'
+        elif worker['execute']:
+            with worker['pool'].statements() as statements:
+                curs = statements.execute(result['sql'], result['binds'])
+                result['columns'] = [column[0]
+                                     for column in curs.description]
+                result['rows'] = [list(row) for row
+                                  in curs.fetchmany(worker['maxRows'])]
+    except Exception as exception:
+        result['error'] = '%s: %s' % (type(exception).__name__, exception)
+    return result
+#
+#                   BATCH RUNNER
+# Feeds the workers in bounded windows so memory stays flat
+# however long the input is, and writes results in input order.
+#
+# @param records ITERABLE of question records
+# @param output open file object for the JSON lines
+# @param workers INT process count, 0 runs in this process
+# @param chunkSize INT records handed to a worker at a time
+# @param schema STRING schema to translate for, None for the
+#               session's own
+#
+# @return count INT number of questions translated
+#
+
+
+def runBatch(records, output, workers, chunkSize, useSqlite=False,
+             execute=False, maxRows=100, schema=None):
+    count = 0
+    for result in mapRecords(translateRecord, records, workers, chunkSize,
+                             (useSqlite, execute, maxRows, schema)):
+        writeResult(output, result)
+        count += 1
+    return count
+
+
+# Yields work(record) for every record, in input order
+def mapRecords(work, records, workers, chunkSize, initArgs):
+    records = iter(records)
+    if workers == 0:
+        openWorker(*initArgs)
+        for record in records:
+            yield work(record)
+        return
+
+    processPool = multiprocessing.Pool(workers, openWorker, initArgs)
+    try:
+        window = workers * chunkSize * 4
+        while True:
+            block = list(itertools.islice(records, window))
+            if not block:
+                break
+            for result in processPool.imap(work, block, chunkSize):
+                yield result
+    finally:
+        processPool.close()
+        processPool.join()
+
+
+def writeResult(output, result):
+    output.write(json.dumps(result, default=str))
+    output.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate a file of '
+                                     'questions to SQL without prompting')
+    parser.add_argument('source', help="questions file, or - for stdin")
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON lines output file, stdout by default')
+    parser.add_argument('--format', choices=('jsonl', 'csv', 'text'),
+                        help='input format, guessed from the extension')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='worker processes, 0 to run in-process')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--execute', action='store_true',
+                        help='run each query and include its rows')
+    parser.add_argument('--max-rows', type=int, default=100,
+                        help='rows kept per result with --execute')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='use the SQLite stand-in instead of Oracle')
+    parser.add_argument('--schema', help='translate for this schema, with '
+                        'its compiled lexicon')
+    args = parser.parse_args()
+    if args.schema and args.execute:
+        parser.error("--execute only runs queries on the session's own "
+                     "schema")
+
+    if args.source == '-':
+        source = sys.stdin
+    else:
+        source = open(args.source, newline='')
+    inputFormat = args.format or guessFormat(args.source)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    start = time.perf_counter()
+    count = runBatch(readQuestions(source, inputFormat), output,
+                     args.workers, args.chunk_size, args.sqlite,
+                     args.execute, args.max_rows, args.schema)
+    output.flush()
+    elapsed = time.perf_counter() - start
+    print("Translated %d questions in %.2fs (%.0f per minute)"
+          % (count, elapsed, count / elapsed * 60 if elapsed else 0),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
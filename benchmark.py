@@ -0,0 +1,306 @@
+#
+# Natural Language Interface to Databases
+#       Pipeline Benchmark
+#
+# Runs the golden corpus (golden_corpus.jsonl: question, expected
+# SQL with its literals written in, category) through the
+# translation pipeline against the SQLite stand-in and reports,
+# as one JSON document:
+#
+#   stages       latency percentiles per stage, in microseconds
+#                (tokenizer, classify, buildQuery, render, and
+#                execute with --execute)
+#   total        percentiles for a whole translation
+#   throughput   translations per second
+#   allocations  peak traced memory and the bytes and blocks still
+#                held per question, from a separate tracemalloc
+#                pass so it does not skew the timings
+#   accuracy     SQL text matches overall and per category, result
+#                set matches with --execute, and every mismatch
+#
+# classify is the single pass that replaced synonymModule,
+# stopWordModule and keyWordDetection; buildQuery is the body of
+# queryGeneration.
+#
+# Regression mode compares the run with a saved baseline and
+# exits 1 if latency or throughput moved by more than --tolerance
+# or accuracy dropped at all.
+#
+# Usage:
+#   python benchmark.py --repeat 50 -o baseline.json
+#   python benchmark.py --baseline baseline.json --tolerance 0.2
+import argparse
+import collections
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import implementation
+from lexicon import defaultLexicon
+from pool import SqliteBackend
+from statementcache import inlineBinds
+from valueindex import ValueIndex, ignoreWord
+
+defaultCorpusPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'golden_corpus.jsonl')
+stageNames = ('tokenizer', 'classify', 'buildQuery', 'render')
+spaceFind = re.compile(r'\s+')
+
+
+def readCorpus(path=defaultCorpusPath):
+    with open(path) as corpusFile:
+        return [json.loads(line) for line in corpusFile if line.strip()]
+
+
+def canonicalSql(sql):
+    return spaceFind.sub(' ', sql or '').strip().lower()
+#
+#                   TIMED TRANSLATION
+# The stages of implementation.translateQuery, one timer each.
+#
+# @param timings DICT stage -> LIST of seconds, appended to
+# @param valueIndex ValueIndex passed to classify, or None
+#
+# @return templateQuery STRING, or None
+# @return binds DICT
+#
+
+
+def translateTimed(question, catalog, resolveWord, timings,
+                   valueIndex=None):
+    clock = time.perf_counter
+    start = clock()
+    (tokenInput, detectedDates,
+     detectedOps) = implementation.tokenizer(question.lower(), question)
+    tokenized = clock()
+    (detectedAtts, detectedEnts, detectedAggs, detectedNums,
+     detectedOrder, leftOverWords, keyListAttribute,
+     tokenStop) = defaultLexicon().classify(tokenInput, detectedOps,
+                                            valueIndex=valueIndex)
+    leftOverWords = implementation.dropExtracted(leftOverWords, detectedOps,
+                                                 detectedDates)
+    classified = clock()
+    query = implementation.buildQuery(
+        detectedAtts, detectedEnts, detectedAggs, detectedNums,
+        detectedOrder, leftOverWords, detectedDates, detectedOps,
+        keyListAttribute, catalog, resolveWord)
+    built = clock()
+    templateQuery, binds = (None, None) if query is None else query.render()
+    rendered = clock()
+    timings['tokenizer'].append(tokenized - start)
+    timings['classify'].append(classified - tokenized)
+    timings['buildQuery'].append(built - classified)
+    timings['render'].append(rendered - built)
+    timings['total'].append(rendered - start)
+    return templateQuery, binds
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return dict((name, round(value * 1e6, 2)) for name, value in (
+        ('p50', at(0.50)), ('p90', at(0.90)), ('p99', at(0.99)),
+        ('mean', sum(ordered) / len(ordered)), ('max', ordered[-1])))
+#
+#                   ACCURACY
+# @return DICT correct/total overall and per category, failures
+#
+
+
+def checkAccuracy(corpus, translated, statements=None):
+    byCategory = collections.defaultdict(lambda: {'correct': 0, 'total': 0})
+    correct = 0
+    resultMatches = 0
+    failures = []
+    for record, (templateQuery, binds) in zip(corpus, translated):
+        actual = (inlineBinds(templateQuery, binds)
+                  if templateQuery else None)
+        category = byCategory[record.get('category', 'other')]
+        category['total'] += 1
+        if canonicalSql(actual) == canonicalSql(record['sql']):
+            correct += 1
+            category['correct'] += 1
+        else:
+            failures.append({'id': record.get('id'),
+                             'question': record['question'],
+                             'expected': record['sql'], 'actual': actual})
+        if statements is not None and templateQuery:
+            if sameRows(statements, templateQuery, binds, record['sql']):
+                resultMatches += 1
+    total = len(corpus)
+    accuracy = {'correct': correct, 'total': total,
+                'rate': correct / float(total) if total else 0.0,
+                'byCategory': dict(byCategory), 'failures': failures}
+    if statements is not None:
+        accuracy['resultMatches'] = resultMatches
+        accuracy['resultRate'] = (resultMatches / float(total)
+                                  if total else 0.0)
+    return accuracy
+
+
+def sameRows(statements, templateQuery, binds, expectedSql):
+    try:
+        actual = statements.execute(templateQuery, binds).fetchall()
+        expected = statements.execute(expectedSql).fetchall()
+    except Exception:
+        return False
+    return sorted(map(repr, actual)) == sorted(map(repr, expected))
+#
+#                   ALLOCATIONS
+# One untimed pass under tracemalloc.
+#
+
+
+def measureAllocations(corpus, catalog, resolveWord, valueIndex=None):
+    timings = collections.defaultdict(list)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for record in corpus:
+        translateTimed(record['question'], catalog, resolveWord, timings,
+                       valueIndex)
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = [stat for stat in after.compare_to(before, 'filename')
+                 if stat.size_diff > 0]
+    count = float(len(corpus) or 1)
+    return {'retainedBytesPerQuestion': round(
+                sum(stat.size_diff for stat in allocated) / count),
+            'retainedBlocksPerQuestion': round(
+                sum(stat.count_diff for stat in allocated) / count),
+            'peakBytes': peak}
+#
+#                   RUN
+# @param corpus LIST of golden records
+# @param repeat INT timed passes over the corpus
+# @param execute BOOLEAN time execution and compare result sets
+#
+# @return report DICT
+#
+
+
+def runBenchmark(corpus, repeat=20, execute=False):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        pool, catalog = implementation.databaseConnection(SqliteBackend())
+        valueIndex = ValueIndex.fromPool(pool, refreshInterval=None)
+        resolveWord = valueIndex.resolver(lambda word: ignoreWord)
+        try:
+            # Warm up the lexicon, fuzzy index and catalog
+            for record in corpus:
+                translateTimed(record['question'], catalog, resolveWord,
+                               collections.defaultdict(list), valueIndex)
+
+            timings = collections.defaultdict(list)
+            start = time.perf_counter()
+            for i in range(repeat):
+                translated = [translateTimed(record['question'], catalog,
+                                             resolveWord, timings,
+                                             valueIndex)
+                              for record in corpus]
+            elapsed = time.perf_counter() - start
+
+            allocations = measureAllocations(corpus, catalog, resolveWord,
+                                             valueIndex)
+            with pool.statements() as statements:
+                if execute:
+                    for templateQuery, binds in translated:
+                        if templateQuery:
+                            begin = time.perf_counter()
+                            statements.execute(templateQuery,
+                                               binds).fetchall()
+                            timings['execute'].append(
+                                time.perf_counter() - begin)
+                accuracy = checkAccuracy(corpus, translated,
+                                         statements if execute else None)
+        finally:
+            pool.close()
+    stages = list(stageNames) + (['execute'] if execute else [])
+    count = len(corpus) * repeat
+    return {'questions': len(corpus), 'repeat': repeat,
+            'python': sys.version.split()[0],
+            'stages': dict((stage, percentiles(timings[stage]))
+                           for stage in stages),
+            'total': percentiles(timings['total']),
+            'throughput': round(count / elapsed, 1) if elapsed else 0.0,
+            'allocations': allocations, 'accuracy': accuracy}
+#
+#                   REGRESSION CHECK
+# @param report DICT this run
+# @param baseline DICT saved run
+# @param tolerance FLOAT allowed relative slowdown, 0.2 is 20%
+#
+# @return LIST of regression messages, empty if none
+#
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    latencies = [('total', report['total'], baseline['total'])]
+    for stage, stats in report['stages'].items():
+        if stage in baseline.get('stages', {}):
+            latencies.append((stage, stats, baseline['stages'][stage]))
+    for name, current, previous in latencies:
+        for key in ('p50', 'p90'):
+            if previous.get(key) and \
+                    current[key] > previous[key] * (1 + tolerance):
+                found.append('%s %s %.2fus > %.2fus' % (
+                    name, key, current[key], previous[key]))
+    if report['throughput'] < baseline['throughput'] * (1 - tolerance):
+        found.append('throughput %.1f/s < %.1f/s' % (
+            report['throughput'], baseline['throughput']))
+    if report['accuracy']['rate'] < baseline['accuracy']['rate']:
+        found.append('accuracy %.3f < %.3f' % (
+            report['accuracy']['rate'], baseline['accuracy']['rate']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the '
+                                     'translation pipeline')
+    parser.add_argument('--corpus', default=defaultCorpusPath)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='timed passes over the corpus')
+    parser.add_argument('--execute', action='store_true',
+                        help='run the queries and compare result sets')
+    parser.add_argument('-o', '--output', help='write the report here')
+    parser.add_argument('--baseline', help='report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative regression')
+    parser.add_argument('--min-accuracy', type=float,
+                        help='fail below this accuracy rate')
+    args = parser.parse_args()
+
+    report = runBenchmark(readCorpus(args.corpus), args.repeat,
+                          args.execute)
+    failed = []
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            failed = regressions(report, json.load(baselineFile),
+                                 args.tolerance)
+    if args.min_accuracy is not None and \
+            report['accuracy']['rate'] < args.min_accuracy:
+        failed.append('accuracy %.3f below %.3f' % (
+            report['accuracy']['rate'], args.min_accuracy))
+    report['regressions'] = failed
+
+    text = json.dumps(report, indent=1, sort_keys=True, default=str)
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            outputFile.write(text + '\n')
+    else:
+        print(text)
+    for message in failed:
+        print("REGRESSION: %s" % message, file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
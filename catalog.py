@@ -0,0 +1,248 @@
+#
+# Natural Language Interface to Databases
+#       Schema Catalog
+#
+# In-memory copy of the data dictionary for the target schema.
+# Primary keys, foreign keys, column data types and nullability
+# are loaded in one bulk query and served from memory, so
+# queryGeneration no longer touches all_constraints or
+# all_tab_columns per request.
+#
+# A JSON snapshot is written to disk after every load so that a
+# warm restart can skip the dictionary queries completely.
+import json
+import os
+import time
+
+import instrumentation
+from joinplanner import JoinPlanner
+#
+#                   CATALOG QUERY
+# One pass over the dictionary views for a single owner.
+# Each row is a column, optionally joined to the PRIMARY KEY or
+# FOREIGN KEY constraint it takes part in (and the referenced
+# column for foreign keys).
+#
+oracleCatalogQuery = """
+SELECT col.table_name, col.column_name, col.data_type, col.nullable,
+       con.constraint_type, ref.table_name, ref.column_name
+FROM all_tab_columns col
+LEFT JOIN all_cons_columns cc
+       ON cc.owner = col.owner
+      AND cc.table_name = col.table_name
+      AND cc.column_name = col.column_name
+LEFT JOIN all_constraints con
+       ON con.owner = cc.owner
+      AND con.constraint_name = cc.constraint_name
+      AND con.constraint_type IN ('P', 'R')
+LEFT JOIN all_cons_columns ref
+       ON ref.owner = con.r_owner
+      AND ref.constraint_name = con.r_constraint_name
+      AND ref.position = cc.position
+WHERE col.owner = :owner
+ORDER BY col.table_name, col.column_id, cc.position"""
+
+defaultSnapshotPath = 'schema_catalog.json'
+snapshotVersion = 1
+#
+#                   ORACLE LOADER
+# Runs the bulk catalog query and folds the rows into the
+# table dictionary used by SchemaCatalog.
+#
+# @param curs cursor on the target database
+# @param owner STRING schema owner, e.g. SYSTEM
+#
+# @return tables DICT table -> columns, primaryKey, foreignKeys
+#
+
+
+def loadOracleCatalog(curs, owner):
+    curs.execute(oracleCatalogQuery, {'owner': owner.upper()})
+    tables = {}
+    for (tableName, columnName, dataType, nullable,
+         constraintType, refTable, refColumn) in curs.fetchall():
+        table = tables.setdefault(tableName, newTable())
+        table['columns'][columnName] = [dataType, nullable == 'Y']
+        if constraintType == 'P':
+            if columnName not in table['primaryKey']:
+                table['primaryKey'].append(columnName)
+        elif constraintType == 'R' and refTable:
+            foreignKey = [columnName, refTable, refColumn]
+            if foreignKey not in table['foreignKeys']:
+                table['foreignKeys'].append(foreignKey)
+    return tables
+
+
+#
+#                   SQLITE LOADER
+# Builds the same table dictionary from a SQLite stand-in using
+# its PRAGMA tables. Declared types such as number(10) are
+# reduced to the Oracle data_type names (NUMBER, VARCHAR2, DATE).
+#
+# @param curs cursor on the SQLite database
+#
+# @return tables DICT table -> columns, primaryKey, foreignKeys
+#
+
+
+def loadSqliteCatalog(curs):
+    curs.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                 "AND name NOT LIKE 'sqlite_%'")
+    tables = {}
+    for tableName, in curs.fetchall():
+        table = tables.setdefault(tableName.upper(), newTable())
+        curs.execute("PRAGMA table_info('%s')" % tableName)
+        primaryKey = []
+        for (cid, columnName, declType, notNull,
+             default, pkPosition) in curs.fetchall():
+            dataType = declType.split('(')[0].strip().upper()
+            table['columns'][columnName.upper()] = [dataType, not notNull]
+            if pkPosition:
+                primaryKey.append((pkPosition, columnName.upper()))
+        table['primaryKey'] = [column for position, column
+                               in sorted(primaryKey)]
+        curs.execute("PRAGMA foreign_key_list('%s')" % tableName)
+        for row in curs.fetchall():
+            refTable, columnName, refColumn = row[2], row[3], row[4]
+            table['foreignKeys'].append([columnName.upper(), refTable.upper(),
+                                         refColumn.upper()])
+    return tables
+
+
+def newTable():
+    return {'columns': {}, 'primaryKey': [], 'foreignKeys': []}
+#
+#                   SCHEMA CATALOG
+# Serves primary key, foreign key, data type and nullability
+# lookups from memory.
+#
+# The catalog is considered stale once ttl seconds have passed
+# since the data was loaded from the database; a stale catalog
+# reloads itself on the next lookup. ttl=None disables the
+# timeout, leaving refresh() and invalidate() as the only ways
+# to reload.
+#
+# @param loader CALLABLE returning the table dictionary
+# @param snapshotPath STRING JSON snapshot location, or None
+# @param ttl NUMBER seconds before the catalog goes stale
+#
+
+
+class SchemaCatalog(object):
+
+    def __init__(self, loader=None, snapshotPath=defaultSnapshotPath,
+                 ttl=None):
+        self.loader = loader
+        self.snapshotPath = snapshotPath
+        self.ttl = ttl
+        self.tables = None
+        self.loadedAt = None
+        self.planner = None
+
+    # Opens the catalog, preferring the on-disk snapshot.
+    # Falls back to the loader when no usable snapshot exists.
+    @classmethod
+    def open(cls, loader=None, snapshotPath=defaultSnapshotPath, ttl=None):
+        catalog = cls(loader, snapshotPath, ttl)
+        if not catalog.loadSnapshot():
+            catalog.refresh()
+        return catalog
+
+    # Reloads every table from the database and rewrites the snapshot
+    def refresh(self):
+        if self.loader is None:
+            raise RuntimeError("Schema catalog has no loader to refresh from")
+        with instrumentation.timer('db.catalogLoad'):
+            tables = self.loader()
+        self.tables = dict((name.upper(), table)
+                           for name, table in tables.items())
+        self.loadedAt = time.time()
+        self.saveSnapshot()
+        return self
+
+    # Forces a reload on the next lookup
+    def invalidate(self):
+        self.tables = None
+        self.loadedAt = None
+
+    def isStale(self):
+        if self.tables is None:
+            return True
+        if self.ttl is None:
+            return False
+        return time.time() - self.loadedAt > self.ttl
+
+    def loadSnapshot(self):
+        if not self.snapshotPath or not os.path.exists(self.snapshotPath):
+            return False
+        try:
+            with open(self.snapshotPath) as snapshotFile:
+                snapshot = json.load(snapshotFile)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('version') != snapshotVersion:
+            return False
+        self.tables = snapshot['tables']
+        self.loadedAt = snapshot['loadedAt']
+        return True
+
+    # Snapshot is written to a temporary file and renamed so a
+    # crash mid-write never leaves a truncated catalog behind.
+    def saveSnapshot(self):
+        if not self.snapshotPath:
+            return
+        snapshot = {'version': snapshotVersion, 'loadedAt': self.loadedAt,
+                    'tables': self.tables}
+        tempPath = self.snapshotPath + '.tmp'
+        with open(tempPath, 'w') as snapshotFile:
+            json.dump(snapshot, snapshotFile, indent=1, sort_keys=True)
+        os.replace(tempPath, self.snapshotPath)
+
+    def table(self, tableName):
+        if self.isStale() and self.loader is not None:
+            self.refresh()
+        return self.tables.get(tableName.upper())
+
+    def tableNames(self):
+        if self.isStale() and self.loader is not None:
+            self.refresh()
+        return sorted(self.tables)
+
+    # First primary key column, as the old per-query lookup returned
+    def primaryKey(self, tableName):
+        table = self.table(tableName)
+        if not table or not table['primaryKey']:
+            return None
+        return table['primaryKey'][0]
+
+    def primaryKeyColumns(self, tableName):
+        table = self.table(tableName)
+        return list(table['primaryKey']) if table else []
+
+    # @return LIST of (column, referenced table, referenced column)
+    def foreignKeys(self, tableName):
+        table = self.table(tableName)
+        if not table:
+            return []
+        return [tuple(foreignKey) for foreignKey in table['foreignKeys']]
+
+    # Foreign key join planner, rebuilt whenever the tables reload
+    def joinPlanner(self):
+        self.tableNames()
+        if self.planner is None or self.planner[0] != self.loadedAt:
+            self.planner = (self.loadedAt, JoinPlanner.fromCatalog(self))
+        return self.planner[1]
+
+    def dataType(self, tableName, columnName):
+        column = self.column(tableName, columnName)
+        return column[0] if column else None
+
+    def isNullable(self, tableName, columnName):
+        column = self.column(tableName, columnName)
+        return column[1] if column else None
+
+    def column(self, tableName, columnName):
+        table = self.table(tableName)
+        if not table:
+            return None
+        return table['columns'].get(columnName.upper())
@@ -0,0 +1,147 @@
+#
+# Natural Language Interface to Databases
+#       Fuzzy Index
+#
+# Typo-tolerant word lookup ("salry" -> salary, "departmnt" ->
+# departments) using a precomputed deletion index in the style
+# of SymSpell.
+#
+# Every vocabulary word is stored under each string reachable
+# from it by deleting up to maxDistance characters. A token is
+# looked up by generating its own deletions and collecting the
+# words stored under any of them; only those few candidates get
+# a full edit distance check, so a lookup costs a few dozen
+# dictionary probes whatever the size of the vocabulary. Only the
+# first prefixLength characters are used for the deletions, which
+# bounds the index size for long words.
+#
+# Each match carries a confidence between 0 and 1 derived from
+# the edit distance and the number of equally close candidates,
+# so callers can accept confident corrections and escalate the
+# rest.
+import collections
+#
+#                   FUZZY MATCH
+# @param word the vocabulary word's payload
+# @param distance INT edit distance from the token
+# @param confidence FLOAT 1.0 exact, lower for more edits or ties
+#
+FuzzyMatch = collections.namedtuple('FuzzyMatch',
+                                    ['word', 'distance', 'confidence'])
+#
+#                   EDIT DISTANCE
+# Optimal string alignment distance (insert, delete, substitute,
+# swap adjacent characters), abandoned as soon as it must exceed
+# limit.
+#
+# @return INT distance, or limit + 1 if greater than limit
+#
+
+
+def editDistance(left, right, limit):
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    previous = None
+    row = list(range(len(right) + 1))
+    for i in range(1, len(left) + 1):
+        current = [i] + [0] * len(right)
+        for j in range(1, len(right) + 1):
+            cost = 0 if left[i - 1] == right[j - 1] else 1
+            current[j] = min(row[j] + 1, current[j - 1] + 1,
+                             row[j - 1] + cost)
+            if (previous is not None and i > 1 and j > 1 and
+                    left[i - 1] == right[j - 2] and
+                    left[i - 2] == right[j - 1]):
+                current[j] = min(current[j], previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous, row = row, current
+    return row[-1] if row[-1] <= limit else limit + 1
+#
+#                   FUZZY INDEX
+# @param maxDistance INT most edits a correction may need
+# @param prefixLength INT characters used to build the deletions
+#
+
+
+class FuzzyIndex(object):
+
+    def __init__(self, maxDistance=2, prefixLength=7):
+        self.maxDistance = maxDistance
+        self.prefixLength = prefixLength
+        self.words = {}
+        self.deletes = collections.defaultdict(list)
+
+    # Words are matched case-insensitively; payload defaults to word
+    def add(self, word, payload=None):
+        key = word.lower()
+        if key in self.words:
+            return
+        self.words[key] = word if payload is None else payload
+        for variant in self.variants(key[:self.prefixLength]):
+            self.deletes[variant].append(key)
+
+    def __len__(self):
+        return len(self.words)
+
+    def variants(self, word):
+        found = set([word])
+        frontier = found
+        for distance in range(self.maxDistance):
+            shorter = set()
+            for variant in frontier:
+                if len(variant) > 1:
+                    for position in range(len(variant)):
+                        shorter.add(variant[:position] +
+                                    variant[position + 1:])
+            frontier = shorter - found
+            found |= frontier
+        return found
+
+    # Short tokens get fewer edits: one typo in a three letter word
+    # is usually a different word
+    def allowedDistance(self, token):
+        if len(token) <= 3:
+            return 0
+        if len(token) <= 5:
+            return min(1, self.maxDistance)
+        return self.maxDistance
+    #
+    #               LOOKUP
+    # @param token STRING word to correct
+    #
+    # @return LIST of FuzzyMatch at the smallest distance found,
+    #              empty if nothing is close enough
+    #
+
+    def lookup(self, token):
+        key = token.lower()
+        if key in self.words:
+            return [FuzzyMatch(self.words[key], 0, 1.0)]
+        limit = self.allowedDistance(key)
+        if not limit:
+            return []
+        candidates = set()
+        for variant in self.variants(key[:self.prefixLength]):
+            candidates.update(self.deletes.get(variant, ()))
+        best = limit + 1
+        closest = []
+        for candidate in candidates:
+            distance = editDistance(key, candidate, min(limit, best))
+            if distance < best:
+                best = distance
+                closest = [candidate]
+            elif distance == best:
+                closest.append(candidate)
+        if best > limit:
+            return []
+        return [FuzzyMatch(self.words[candidate], best,
+                           (1.0 - best / float(max(len(key),
+                                                   len(candidate)))) /
+                           len(closest))
+                for candidate in sorted(closest)]
+
+    # Single most likely correction, or None
+    def best(self, token):
+        matches = self.lookup(token)
+        return matches[0] if matches else None
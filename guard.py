@@ -0,0 +1,325 @@
+#
+# Natural Language Interface to Databases
+#       Cost Guard
+#
+# Checks a generated query before it reaches the database.
+#
+# The backend explains the query (EXPLAIN PLAN on Oracle,
+# EXPLAIN QUERY PLAN on SQLite) and the plan is checked for:
+#   cartesian joins   MERGE JOIN CARTESIAN in an Oracle plan, or a
+#                     NATURAL JOIN between tables with no column
+#                     in common, which is a cross product anywhere
+#   cost              the optimizer's cost on Oracle; on SQLite,
+#                     which reports none, the rows of the fully
+#                     scanned tables multiplied together
+#   full scans        of tables with more than fullScanRows rows
+#
+# A cartesian join, or a cost above rejectCost, stops the query.
+# A cost above maxCost or a large full scan lets it run with
+# limitedRows rows and limitedTimeout seconds; anything else runs
+# with maxRows rows and timeout seconds. Row limits are kept by
+# the fetch loop, which stops after maxRows rows; the SQL is not
+# wrapped, as Oracle refuses an inline view over a join whose
+# columns share a name (ORA-00918). Time limits are the driver's
+# call timeout on Oracle and a progress handler on SQLite.
+#
+# Every decision is counted, kept in memory for report() and,
+# with a log path, appended to a JSON lines file.
+import collections
+import contextlib
+import itertools
+import json
+import re
+import threading
+import time
+
+import instrumentation
+
+naturalFind = re.compile(r'\bNATURAL\s+JOIN\s+(\w+)', re.I)
+sourceFind = re.compile(r'\bFROM\s+(\w+)', re.I)
+scanFind = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\w+)(.*)$')
+statementIds = itertools.count()
+#
+#                   PLAN STEP
+# @param operation STRING as the database describes it
+# @param table STRING lowercase table read, or None
+# @param fullScan BOOLEAN reads every row of the table
+# @param cartesian BOOLEAN joins without a join condition
+# @param cost NUMBER optimizer cost, None if not reported
+# @param rows NUMBER estimated rows, None if not reported
+#
+PlanStep = collections.namedtuple('PlanStep', ['operation', 'table',
+                                               'fullScan', 'cartesian',
+                                               'cost', 'rows'])
+#
+#                   VERDICT
+# @param action STRING allow or limit
+# @param reasons LIST of what was flagged
+# @param cost NUMBER estimated cost
+# @param sql STRING query to run
+# @param maxRows INT row limit
+# @param timeout NUMBER seconds the query may take
+#
+Verdict = collections.namedtuple('Verdict', ['action', 'reasons', 'cost',
+                                             'sql', 'maxRows', 'timeout'])
+#
+#                   QUERY REJECTED
+# @param reasons LIST of what was flagged
+#
+
+
+class QueryRejected(Exception):
+
+    def __init__(self, reasons):
+        Exception.__init__(self, '; '.join(reasons))
+        self.reasons = reasons
+
+
+class QueryTimeout(QueryRejected):
+    pass
+#
+#                   PLANS
+# Called through the backends' explain().
+#
+
+
+def explainOracle(curs, sql, binds):
+    statementId = 'nli%d' % next(statementIds)
+    curs.execute("EXPLAIN PLAN SET STATEMENT_ID = '%s' FOR %s"
+                 % (statementId, sql))
+    curs.execute("SELECT operation, options, object_name, cost, cardinality "
+                 "FROM plan_table WHERE statement_id = :id ORDER BY id",
+                 id=statementId)
+    rows = curs.fetchall()
+    # Committed, so the session does not go back to the pool, or on
+    # to the user's query, with the cleanup open
+    curs.execute("DELETE FROM plan_table WHERE statement_id = :id",
+                 id=statementId)
+    curs.connection.commit()
+    return [PlanStep(' '.join(part for part in (operation, options) if part),
+                     objectName.lower() if objectName else None,
+                     operation == 'TABLE ACCESS' and options == 'FULL',
+                     'CARTESIAN' in (options or ''), cost, cardinality)
+            for operation, options, objectName, cost, cardinality in rows]
+
+
+def explainSqlite(curs, sql, binds):
+    curs.execute('EXPLAIN QUERY PLAN ' + sql, binds or {})
+    steps = []
+    for row in curs.fetchall():
+        detail = row[-1]
+        scan = scanFind.match(detail)
+        steps.append(PlanStep(detail, scan.group(2).lower() if scan else None,
+                              bool(scan) and scan.group(1) == 'SCAN', False,
+                              None, None))
+    return steps
+#
+#                   COST GUARD
+# @param backend OracleBackend or SqliteBackend of the pool
+# @param catalog SchemaCatalog, for the columns natural joins use
+# @param maxCost NUMBER cost above which the row and time limits
+#                are tightened
+# @param rejectCost NUMBER cost above which the query is refused,
+#                   None to never refuse on cost
+# @param fullScanRows INT largest table scanned without limits
+# @param maxRows INT row limit for every query
+# @param limitedRows INT row limit for flagged queries
+# @param timeout NUMBER seconds every query may take
+# @param limitedTimeout NUMBER seconds flagged queries may take
+# @param rejectCartesian BOOLEAN refuse cartesian joins
+# @param logPath STRING JSON lines file of decisions, or None
+#
+
+
+class CostGuard(object):
+
+    tableRowsTtl = 300
+
+    def __init__(self, backend, catalog, maxCost=100000, rejectCost=None,
+                 fullScanRows=100000, maxRows=10000, limitedRows=1000,
+                 timeout=30, limitedTimeout=5, rejectCartesian=True,
+                 logPath=None):
+        self.backend = backend
+        self.catalog = catalog
+        self.maxCost = maxCost
+        self.rejectCost = rejectCost
+        self.fullScanRows = fullScanRows
+        self.maxRows = maxRows
+        self.limitedRows = limitedRows
+        self.timeout = timeout
+        self.limitedTimeout = limitedTimeout
+        self.rejectCartesian = rejectCartesian
+        self.logPath = logPath
+        self.tableRowCounts = {}
+        self.decisions = collections.deque(maxlen=100)
+        self.lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0, 'rejected': 0,
+                      'timeouts': 0}
+
+    # Rows in a table, for plans that do not estimate them
+    def tableRows(self, curs, table):
+        cached = self.tableRowCounts.get(table)
+        if cached is not None and time.time() - cached[1] < self.tableRowsTtl:
+            return cached[0]
+        curs.execute('SELECT count(*) FROM %s' % table)
+        rows = curs.fetchone()[0]
+        self.tableRowCounts[table] = (rows, time.time())
+        return rows
+
+    # NATURAL JOINs with nothing to join on, checked on the SQL
+    def crossJoins(self, sql):
+        source = sourceFind.search(sql)
+        if not source:
+            return []
+        joined = [source.group(1)]
+        crossed = []
+        for table in naturalFind.findall(sql):
+            columns = self.columns(table)
+            if not any(columns & self.columns(other) for other in joined):
+                crossed.append(table.lower())
+            joined.append(table)
+        return crossed
+
+    def columns(self, table):
+        info = self.catalog.table(table)
+        return set(info['columns']) if info else set()
+    #
+    #               CHECK
+    # @param statements StatementCache the query will run on
+    # @param sql STRING generated query
+    # @param binds DICT its bind values
+    # @param question STRING the question, for the decision log
+    #
+    # @return Verdict
+    #
+    # @exception QueryRejected the query must not run
+    #
+
+    def check(self, statements, sql, binds, question=None):
+        curs = statements.connection.cursor()
+        try:
+            with instrumentation.timer('db.explain'):
+                steps = self.backend.explain(curs, sql, binds)
+            reasons = []
+            cost = steps[0].cost if steps and steps[0].cost is not None \
+                else None
+            scanned = 1
+            for step in steps:
+                if step.cartesian:
+                    reasons.append('cartesian join of %s'
+                                   % (step.table or step.operation))
+                # Aliases and views are not counted
+                if step.fullScan and step.table and \
+                        (step.rows is not None or
+                         self.catalog.table(step.table)):
+                    rows = step.rows
+                    if rows is None:
+                        rows = self.tableRows(curs, step.table)
+                    scanned *= max(rows, 1)
+                    if rows > self.fullScanRows:
+                        reasons.append('full scan of %s (%d rows)'
+                                       % (step.table, rows))
+        finally:
+            curs.close()
+        cartesian = [reason for reason in reasons
+                     if reason.startswith('cartesian')]
+        for table in self.crossJoins(sql):
+            reason = 'cartesian join of %s' % table
+            if reason not in reasons:
+                reasons.append(reason)
+                cartesian.append(reason)
+        if cost is None:
+            cost = scanned
+        if cost > self.maxCost:
+            reasons.append('cost %d over %d' % (cost, self.maxCost))
+
+        if (cartesian and self.rejectCartesian) or \
+                (self.rejectCost is not None and cost > self.rejectCost):
+            self.record('rejected', question, sql, reasons, cost)
+            raise QueryRejected(reasons)
+        if reasons:
+            action, maxRows, timeout = ('limit', self.limitedRows,
+                                        self.limitedTimeout)
+        else:
+            action, maxRows, timeout = 'allow', self.maxRows, self.timeout
+        self.record('limited' if reasons else 'allowed', question, sql,
+                    reasons, cost)
+        return Verdict(action, reasons, cost, sql, maxRows, timeout)
+    #
+    #               TIME LIMIT
+    # Runs the body under the verdict's timeout. A statement cut off
+    # on a session that is still alive raises QueryTimeout; on a dead
+    # one the driver's error goes on to the pool, which discards it.
+    # Time spent inside paused() (rows handed to a writer, a user at
+    # a page prompt) does not count.
+    #
+
+    def timeLimit(self, statements, verdict, question=None):
+        return TimeLimit(self, statements.connection, verdict, question)
+
+    def record(self, decision, question, sql, reasons, cost):
+        entry = {'time': time.time(), 'decision': decision,
+                 'question': question, 'sql': sql, 'reasons': reasons,
+                 'cost': cost}
+        with self.lock:
+            self.stats[decision] += 1
+            self.decisions.append(entry)
+            if self.logPath:
+                with open(self.logPath, 'a') as logFile:
+                    logFile.write(json.dumps(entry, default=str) + '\n')
+        instrumentation.count('guard.%s' % decision)
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['recent'] = [entry for entry in self.decisions
+                               if entry['decision'] != 'allowed'][-10:]
+        return stats
+#
+#                   TIME LIMIT
+# Context manager from CostGuard.timeLimit().
+#
+
+
+class TimeLimit(object):
+
+    def __init__(self, guard, connection, verdict, question):
+        self.guard = guard
+        self.connection = connection
+        self.verdict = verdict
+        self.question = question
+        self.limit = guard.backend.timeLimit(connection, verdict.timeout)
+        self.start = None
+        self.backendPause = None
+        self.waited = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        self.backendPause = self.limit.__enter__()
+        return self
+
+    @contextlib.contextmanager
+    def paused(self):
+        start = time.time()
+        try:
+            with self.backendPause():
+                yield
+        finally:
+            self.waited += time.time() - start
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.limit.__exit__(exceptionType, exception, traceback)
+        databaseError = self.guard.backend.databaseError
+        if exceptionType is None or \
+                not issubclass(exceptionType, databaseError):
+            return False
+        if time.time() - self.start - self.waited < self.verdict.timeout:
+            return False
+        try:
+            self.guard.backend.ping(self.connection)
+        except Exception:
+            return False
+        reasons = ['ran past %ss' % self.verdict.timeout]
+        self.guard.record('timeouts', self.question, self.verdict.sql,
+                          reasons, self.verdict.cost)
+        raise QueryTimeout(reasons)
@@ -3,14 +3,29 @@
 #       Written by Miles Schofield
 #
 # Written with PYTHON 3.6.0
-# Requires NLTK (3.0 used) and cx_Oracle modules installed
+# Requires cx_Oracle for Oracle; NLTK only for NLI_STOPWORDS=nltk
 # Operates with a local Oracle 11g Database
+import argparse
 import time
 import string
-import nltk
 import re
-from nltk.corpus import stopwords
-import cx_Oracle
+import incremental
+import instrumentation
+from catalog import SchemaCatalog
+from queryir import Join, Query
+from lexicon import (defaultLexicon, operatorsFind, ENTITY, ATTRIBUTE, AGG,
+                     ORDER)
+from pool import ConnectionPool, OracleBackend, SqliteBackend
+from translationcache import TranslationCache
+from valueindex import ValueIndex, ignoreWord
+from logwriter import LogWriter
+from statementcache import inlineBinds
+from resultcache import CachedCursor, RecordingWriter, ResultCache
+from replica import LocalReplica
+from rollups import RollupManager
+from guard import CostGuard, QueryRejected
+from resultstream import (PagedWriter, defaultFetchSize, streamResult,
+                          writerFor)
 #
 # @AUTHOR Miles Schofield macschofield@blueyonder.co.uk
 # @VERSION 6.1
@@ -19,28 +34,45 @@ import cx_Oracle
 # Code responsible for connecting to the Oracle db
 #
 # Username and password require changing per instance
-# Cursor used for querying is defined as global
+# Opens the connection pool once per process; every query checks
+# a cursor out of the pool instead of reconnecting.
+# The schema catalog is opened here as well, from its snapshot
+# when one exists, so metadata lookups never hit the dictionary
+# views during query generation.
 # Program exits if connection failed in order to prevent
 # an infinite loop.
 #
-# @exception cx_Oracle.DatabaseError
+# @see pool.ConnectionPool
+#
+# @param backend OracleBackend or SqliteBackend, Oracle if None
+# @param maxSessions INT session limit of the pool
+#
+# @return pool ConnectionPool
+# @return catalog SchemaCatalog
+#
+# @exception backend.databaseError
 # @throws exception Failed to Connect
 
 
-def databaseConnection():
+def databaseConnection(backend=None, maxSessions=4):
     username = 'SYSTEM'
     password = 'x'
-    print("Database Connection:", sep="", end="", flush=True)
+    if backend is None:
+        backend = OracleBackend(username, password)
     try:
-        connection = cx_Oracle.connect(username, password)
-        global curs
-        curs = connection.cursor()
-        print(" SUCCESS!")
-    except cx_Oracle.DatabaseError as exception:
+        with instrumentation.timer('db.connect'):
+            pool = ConnectionPool(backend, minSessions=1,
+                                  maxSessions=maxSessions)
+
+        def loadCatalog():
+            with pool.cursor() as curs:
+                return backend.loadCatalog(curs)
+        catalog = SchemaCatalog.open(loadCatalog, backend.snapshotPath)
+    except backend.databaseError as exception:
         print("Failed to connect")
         time.sleep(2)
         exit()
-    return None
+    return pool, catalog
 #
 #                   INPUT
 # Code responsible for taking the user input
@@ -81,25 +113,34 @@ def userInput():
 #
 
 
-def tokenizer(lowerInput, originalInput):
-    print("Tokenizer:", sep="", end="", flush=True)
+comparisonOps = re.compile('(>=|<=|<|>|=)')
+dateFind = re.compile('([1-3]?[0-9]\-\w{3}\-[0-9]{2})')
+translator = str.maketrans(dict.fromkeys(string.punctuation))
+
 
+@instrumentation.timed('stage.tokenizer')
+def tokenizer(lowerInput, originalInput):
     # Extract Operators
-    comparisonOps = re.compile('(>=|<=|<|>|=)')
     detectedOps = comparisonOps.findall(originalInput)
 
     # Extract Dates
-    dateFind = re.compile('([1-3]?[0-9]\-\w{3}\-[0-9]{2})')
     detectedDates = dateFind.findall(originalInput)
 
     # Remove Punctuation
-    translator = str.maketrans(dict.fromkeys(string.punctuation))
     noPunc = lowerInput.translate(translator)
     tokenInput = noPunc.split()
-    print(" SUCCESS!")
     del lowerInput
     return tokenInput, detectedDates, detectedOps
 
+
+# Operators and dates were already extracted by the tokenizer, so
+# they are not left over words
+def dropExtracted(leftOverWords, detectedOps, detectedDates):
+    extracted = set(detectedOps)
+    extracted.update(date.lower().translate(translator)
+                     for date in detectedDates)
+    return [word for word in leftOverWords if word not in extracted]
+
 #
 #                   SYNONYMS
 # Code responsible for replacing words with synonyms
@@ -107,6 +148,9 @@ def tokenizer(lowerInput, originalInput):
 # Detects appropriate words in input and replaces
 # with input that is better understood in the domain
 # or extra input that aids in query generation
+# Synonyms and phrases come from the compiled lexicon.
+#
+# @see lexicon.Lexicon
 #
 # @param tokenInput LIST Input separated into list of words
 #
@@ -114,39 +158,22 @@ def tokenizer(lowerInput, originalInput):
 #
 
 
+@instrumentation.timed('stage.synonymModule')
 def synonymModule(tokenInput, detectedOps):
-    print("Synonym Replacer:", sep="", end="", flush=True)
-    synonymDict = {'staff': ('employees', 'first_name', 'last_name'),
-                   'employee': 'employees', 'title': 'job_title',
-                   'position': 'job_title', 'job': 'job_title',
-                   'maximum': 'max', 'average': 'avg', 'minimum': 'min',
-                   'salaries': 'salary', 'role': 'job_title',
-                   'name': 'first_name', 'departmentid': 'dept_name',
-                   'deptid': 'dept_name', 'earn': 'salary', 'earns': 'salary',
-                   'hire': 'hire_date', 'hired': 'hire_date', 'over': '>',
-                   'under': '<', 'earner': ('salary', 'employees',
-                                            'first_name', 'last_name'),
-
-                   'site': 'locationID', 'highest': 'max', 'lowest': 'min',
-                   'most': 'max', 'least': 'min', 'largest': 'max',
-                   'lowest': 'min'}
-    operatorsFind = ['<', '>', '<=', '>=', '=']
+    lexicon = defaultLexicon()
 
     synonymReplacer = []
-    for i, words in enumerate(tokenInput):
-        if tokenInput[i] in synonymDict.keys():
-            if synonymDict[tokenInput[i]] in operatorsFind:
-                detectedOps.append(synonymDict[tokenInput[i]])
-            # unpacks Tuples, for multi-word replacements
-            if isinstance(synonymDict[tokenInput[i]], tuple):
-                for v in synonymDict[tokenInput[i]]:
-                    synonymReplacer.append(v)
-            else:
-                synonymReplacer.append(synonymDict[tokenInput[i]])
-        else:
-            synonymReplacer.append(tokenInput[i])
+    for word in lexicon.joinPhrases(tokenInput):
+        replacements = lexicon.expansions.get(word)
+        if replacements is None:
+            synonymReplacer.append(word)
+            continue
+        # unpacks Tuples, for multi-word replacements
+        for replacement in replacements:
+            synonymReplacer.append(replacement)
+        if len(replacements) == 1 and replacements[0] in operatorsFind:
+            detectedOps.append(replacements[0])
     del tokenInput
-    print(" SUCCESS!")
     return synonymReplacer, detectedOps
 #
 #                   STOP WORDS
@@ -156,7 +183,7 @@ def synonymModule(tokenInput, detectedOps):
 # generation component and removes them from the
 # list of words.
 #
-# @see nltk.corpus
+# @see lexicon.compileLexicon
 #
 # @param synonymReplacer LIST list of words with input replaced
 #
@@ -164,24 +191,12 @@ def synonymModule(tokenInput, detectedOps):
 #
 
 
+@instrumentation.timed('stage.stopWordModule')
 def stopWordModule(synonymReplacer):
-    print("Stop Word Remover:", sep="", end="", flush=True)
-    stopListOmit = set(('example'))
-    stopListContext = ['please', 'show', 'pull', 'records', 'named',
-                       'any', 'all', 'called', 'anyall', 'provide', 'current',
-                       'information', 'currently', 'us', 'work', 'working',
-                       'company', 'could', 'see', 'business', 'send',
-                       'details']
-    stopListNLTK = set(stopwords.words('english')) - stopListOmit
-    # populate as you go
-
-    tokenStop = []
-    for i, words in enumerate(synonymReplacer):
-        if (synonymReplacer[i] not in stopListNLTK and
-                synonymReplacer[i] not in stopListContext):
-            tokenStop.append(synonymReplacer[i])
-
-    print(" SUCCESS!")
+    stopWords = defaultLexicon().stopWords
+
+    tokenStop = [word for word in synonymReplacer if word not in stopWords]
+
     del synonymReplacer
     return tokenStop
 #
@@ -203,25 +218,11 @@ def stopWordModule(synonymReplacer):
 #
 
 
+@instrumentation.timed('stage.keyWordDetection')
 def keyWordDetection(tokenStop):
-    keyListEntity = ['employees', 'jobs', 'job_history',
-                     'departments', 'locations']
-    keyListAttribute = {'jobID': 'jobs', 'job_title': 'jobs',
-                        'min_salary': 'jobs', 'max_salary': 'jobs',
-                        'salary': 'employees', 'locationID': 'locations',
-                        'address': 'locations', 'postcode': 'locations',
-                        'city': 'locations', 'first_name': 'employees',
-                        'last_name': 'employees', 'email': 'employees',
-                        'phone': 'employees', 'hire_date': 'employees',
-                        'commissionPCT': 'employees', 'managerID': 'employees',
-                        'start_date': 'job_history', 'end_date': 'job_history',
-                        'departmentID': 'departments',
-                        'dept_name': 'departments'}
-    keyListAgg = ['avg', 'max', 'min', 'count']
-    # MOVE ME INTO SYNONYM REPLACER PLEASE....
-    keyListOrder = {'order': 'ASC', 'order_by': 'ASC',
-                    'ascending': 'ASC', 'descending': 'DSC',
-                    'asc': 'ASC', 'dsc': 'DSC'}
+    lexicon = defaultLexicon()
+    categories = lexicon.categories
+    keyListAttribute = lexicon.attributes
 
     # Create the empty lists
     detectedAtts = []
@@ -232,50 +233,83 @@ def keyWordDetection(tokenStop):
     leftOverWords = []
 
     # Iterate through words and assign a category
-    for i, words in enumerate(tokenStop):
-        if tokenStop[i] in keyListEntity:
-            detectedEnts.append(tokenStop[i])
-        elif (tokenStop[i] in keyListAttribute.keys()
-                and not tokenStop[i] in detectedAtts):
-            detectedAtts.append(tokenStop[i])
-        elif tokenStop[i] in keyListAgg:
-            detectedAggs.append(tokenStop[i])
-        elif tokenStop[i].isdigit():
-            detectedNums.append(tokenStop[i])
-        elif tokenStop[i] in keyListOrder.keys():
-            detectedOrder.append(keyListOrder[tokenStop[i]])
+    for word in tokenStop:
+        category, value = categories.get(word, (None, word))
+        if category is ENTITY:
+            detectedEnts.append(word)
+        elif category is ATTRIBUTE and word not in detectedAtts:
+            detectedAtts.append(word)
+        elif category is AGG:
+            detectedAggs.append(word)
+        elif word.isdigit():
+            detectedNums.append(word)
+        elif category is ORDER:
+            detectedOrder.append(value)
         else:
-            leftOverWords.append(tokenStop[i])
+            leftOverWords.append(word)
 
     # If the attribute's entity was not detected, then automatically add it
-    if detectedAtts:
-        for i, words in enumerate(detectedAtts):
-            if keyListAttribute[detectedAtts[i]] not in detectedEnts:
-                detectedEnts.append(keyListAttribute[detectedAtts[i]])
+    for attribute in detectedAtts:
+        if keyListAttribute[attribute] not in detectedEnts:
+            detectedEnts.append(keyListAttribute[attribute])
     return(detectedAtts, detectedEnts, detectedAggs, detectedNums,
            detectedOrder, leftOverWords, keyListAttribute)
 
 
+#
+#               LEFT OVER WORDS
+# Asks the user what an unmapped word refers to
+#
+# Default resolver used by queryGeneration. Non-interactive
+# callers pass their own function returning the same numbers.
+#
+# @param word STRING word that keyWordDetection could not map
+#
+# @return numInput INT 1 first name, 2 last name, 3 location,
+#                      4 department, 5 ignore the word
+#
+
+
+def leftOverPrompt(word):
+    print()
+    print('I\'ve found \'%s\' in your input. \
+            Please tell me what it is' % word)
+    print('Enter the following number for the\
+            appropriate attribute')
+    print('1. First name')
+    print('2. Last name')
+    print('3. Location')
+    print('4. Department')
+    print('5. Ignore the word')
+    return int(input('Enter a number: '))
+
+
 # Method to format parts of a string individually.
+# All placeholders are replaced in a single pass.
 def queryFormat(template, **queryArg):
-    for key, value in queryArg.items():
-        temp = '{%s}' % key
-        while True:
-            pos = template.find(temp)
-            if pos < 0:
-                break
-            template = template[:pos] + str(value) + \
-                template[pos+len(temp):]
-    return template
+    def value(match):
+        key = match.group(1)
+        return str(queryArg[key]) if key in queryArg else match.group(0)
+    return placeholderFind.sub(value, template)
+
+
+placeholderFind = re.compile(r'\{(\w+)\}')
 
 #
 #               QUERY GENERATION
 # Code responsible for construction of the query
 #
 # Using the categorised words to determine query
-# components that need to be used. Makes use of queryFormat
+# components that need to be used. The components are collected
+# in a Query IR and the SQL is rendered once at the end.
+# Literals (names, cities, numbers, dates) are never written into
+# the query text; they are returned as bind variables so every
+# question of the same shape produces the same statement.
+# Join paths and data types come from the schema catalog.
 #
-# @see queryFormat
+# @see queryir.Query
+# @see catalog.SchemaCatalog
+# @see joinplanner.JoinPlanner
 #
 # @param detectedAtts list of words detected as attributes in domain
 # @param detectedEnts list of words detected as entities in domain
@@ -284,294 +318,458 @@ def queryFormat(template, **queryArg):
 # @param detectedOrder list of order words detected in input (ASC, DSC)
 # @param leftOverWords list of words that were not mapped
 # @param keyListAttribute key-value pair mapping attributes to entities
+# @param catalog SchemaCatalog in-memory dictionary of the schema
+# @param resolveWord function mapping a left over word to a menu
+#                    number, or to (number, stored value), see
+#                    leftOverPrompt and valueindex.ValueIndex
 #
-# @return templateQuery STRING Query generated as a string
+# @return query Query IR, or None if no query could be constructed
 #
 
 
-def queryGeneration(detectedAtts, detectedEnts, detectedAggs,
-                    detectedNums, detectedOrder, leftOverWords, detectedDates,
-                    detectedOps, keyListAttribute):
-    # Boolean to tell the query to stop if it is not going to succeed
-    #   Failure cases e.g.: No entities exist (no FROM)
+@instrumentation.timed('stage.buildQuery')
+def buildQuery(detectedAtts, detectedEnts, detectedAggs, detectedNums,
+               detectedOrder, leftOverWords, detectedDates, detectedOps,
+               keyListAttribute, catalog, resolveWord=leftOverPrompt):
+    # ENTITIES
+    # No SELECT is possible without FROM
+    if not detectedEnts:
+        return None
 
-    successfulQuery = True
-    templateQuery = "SELECT"
+    query = Query()
 
-    # AGG/FUNCTION WORDS:
+    # AGG/FUNCTION WORDS and ATTRIBUTES
     if detectedAggs:
-        templateQuery += " {agg}"
-        templateQuery = queryFormat(templateQuery,
-                                    agg=detectedAggs[0])
-    else:
-        templateQuery = queryFormat(templateQuery, agg=' ')
-
-    # ATTRIBUTES
-    for i, words in enumerate(detectedAtts):
-        if i == 0:
-            templateQuery += "{att}"
-            templateQuery = queryFormat(templateQuery,
-                                        att='('+detectedAtts[0]+')')
-        else:
-            templateQuery += ", {att}"
-            templateQuery = queryFormat(templateQuery,
-                                        att=detectedAtts[i])
-
-    if not detectedAtts:
-        templateQuery += ' *'
-
-    # ENTITIES
-    templateQuery += " FROM {ent}"
-    if not detectedEnts:
-        # Query Generation stops here if FALSE.
-        # No SELECT is possible without FROM
-        successfulQuery = False
+        query.aggregate = detectedAggs[0]
+    query.columns = list(detectedAtts)
 
     # TABLE JOINS
-    # Requires correct ordering of entities in input
-    if successfulQuery:
-        primaryKeyQuery = "SELECT columns.column_name \
-                            FROM all_constraints constraint, \
-                            all_cons_columns columns \
-                            WHERE columns.table_name = '{TABLENAME}' \
-                            AND constraint.constraint_type = 'P' \
-                            AND constraint.constraint_name = \
-                            columns.constraint_name \
-                            AND constraint.owner != 'HR' \
-                            ORDER BY columns.table_name, columns.position"
-
-        for i, words in enumerate(detectedEnts):
-            if i == 0:
-                entQuery = (detectedEnts[i].upper())
-                curs.execute(primaryKeyQuery.format(TABLENAME=entQuery))
-                OrigPK = curs.fetchone()[0]
-                templateQuery = queryFormat(templateQuery, ent=detectedEnts[0])
-            else:
-                entQuery = (detectedEnts[i].upper())
-                curs.execute(primaryKeyQuery.format(TABLENAME=entQuery))
-                PK = curs.fetchone()[0]
-                templateQuery += " JOIN {entjoin} ON {entity}.{origpk} \
-                                    = {entjoin}.{pk}"
-                templateQuery = queryFormat(templateQuery,
-                                            entjoin=detectedEnts[i],
-                                            entity=detectedEnts[0],
-                                            origpk=PK, pk=PK)
+    # The first entity is the FROM table; the others are joined
+    # along the foreign key graph, through any tables in between
+    query.source = detectedEnts[0]
+    planner = catalog.joinPlanner()
+    steps = planner.plan(detectedEnts)
+    if steps is None:
+        # No foreign key path, join on primary keys as before
+        for entity in detectedEnts[1:]:
+            PK = catalog.primaryKey(entity)
+            query.addJoin(Join(entity, detectedEnts[0], PK, PK))
+    else:
+        for step in steps:
+            query.addJoin(Join(*step))
 
     # WHERE
+    # Left over words are resolved to a column, adding the joins
+    # that column's table needs
+    for word in leftOverWords:
+        numInput = resolveWord(word)
+        if isinstance(numInput, tuple):
+            # Resolver also knows the value as stored in the column
+            numInput, word = numInput
+        if numInput == 1:
+            joinTable(query, planner, 'employees')
+            query.addPredicate('first_name', '=', word)
+        elif numInput == 2:
+            joinTable(query, planner, 'employees')
+            query.addPredicate('last_name', '=', word)
+        elif numInput == 3:
+            joinTable(query, planner, 'locations')
+            query.addPredicate('locations.city', '=', word)
+        elif numInput == 4:
+            joinTable(query, planner, 'departments')
+            query.addPredicate('dept_name', '=', word)
+
     # Determines DATA TYPE of column in order to generate query
     # Only works for NUMBERS and DATES
-    if leftOverWords:
-        for i, words in enumerate(leftOverWords):
-            print()
-            print('I\'ve found \'%s\' in your input. \
-                    Please tell me what it is' % leftOverWords[i])
-            print('Enter the following number for the\
-                    appropriate attribute')
-            print('1. First name')
-            print('2. Last name')
-            print('3. Location')
-            print('4. Department')
-            print('5. Ignore the word')
-            numInput = int(input('Enter a number: '))
-            if numInput == 1:
-                if 'employees' not in detectedEnts:
-                    templateQuery += " NATURAL JOIN Employees" 
-                templateQuery += " WHERE {att} = '{val}'"
-                templateQuery = queryFormat(templateQuery,
-                                            att="first_name",
-                                            val=leftOverWords[i])
-            elif numInput == 2:
-                templateQuery += " WHERE {att} = '{val}'"
-                templateQuery = queryFormat(templateQuery,
-                                            att="last_name",
-                                            val=leftOverWords[i])
-            elif numInput == 3:
-                if 'locations' not in detectedEnts:
-                    if 'departments' not in detectedEnts:
-                        templateQuery += " JOIN Departments ON \
-                        Employees.DepartmentID = Departments.DepartmentID"
-                    templateQuery += " JOIN Locations ON departments.locationID \
-                    = locations.locationID"
-                storeQuery = templateQuery
-                templateQuery += " WHERE {att} = '{val}'"
-                storeQuery += " WHERE {att} = ''{val}''"
-                templateQuery = queryFormat(templateQuery,
-                                            att="locations.city",
-                                            val=leftOverWords[i])
-                storeQuery = queryFormat(templateQuery,
-                                         att="locations.city",
-                                         val=leftOverWords[i])
-            elif numInput == 4:
-                if 'departments' not in detectedEnts:
-                    templateQuery += " JOIN Departments ON \
-                    Employees.DepartmentID = Departments.DepartmentID"
-                    templateQuery += " WHERE {att} = '{val}'"
-                    templateQuery = queryFormat(templateQuery,
-                                                att="dept_name",
-                                                val=leftOverWords[i])
-            elif numInput == 5:
-                pass
-
     if detectedOps and detectedNums:
-        typeQuery = "SELECT data_type FROM all_tab_columns \
-                    WHERE table_name = '{TABLENAME}' \
-                    AND column_name = '{COLUMN}'"
-        for i, words in enumerate(detectedAtts):
-            curs.execute(queryFormat(typeQuery,
-                                     TABLENAME=((keyListAttribute[detectedAtts[i]])
-                                                .upper()),
-                                     COLUMN=detectedAtts[i].upper()))
-            dataType = curs.fetchone()[0]
+        for attribute in detectedAtts:
+            dataType = catalog.dataType(keyListAttribute[attribute],
+                                        attribute)
             if dataType == 'NUMBER':
-                templateQuery += " WHERE {att} {ops} {val}"
-                templateQuery = queryFormat(templateQuery, att=detectedAtts[i],
-                                            ops=detectedOps[0],
-                                            val=detectedNums[0])
+                query.addPredicate(attribute, detectedOps[0],
+                                   detectedNums[0])
     elif detectedDates and detectedAtts:
-        typeQuery = "SELECT data_type FROM all_tab_columns WHERE table_name = '{TABLENAME}' \
-                    AND column_name = '{COLUMN}'"
-        for i, words in enumerate(detectedAtts):
-            curs.execute(queryFormat(typeQuery,
-                                     TABLENAME=((keyListAttribute[detectedAtts[i]])
-                                                .upper()),
-                                     COLUMN=detectedAtts[i].upper()))
-            dataType = curs.fetchone()[0]
+        for attribute in detectedAtts:
+            dataType = catalog.dataType(keyListAttribute[attribute],
+                                        attribute)
             if dataType == 'DATE':
                 if len(detectedDates) >= 2:
-                    templateQuery += " WHERE {att} BETWEEN \
-                                     '{val1}' AND '{val2}'"
-                    templateQuery = queryFormat(templateQuery,
-                                                att=detectedAtts[i],
-                                                val1=detectedDates[0],
-                                                val2=detectedDates[1])
+                    query.addPredicate(attribute, 'BETWEEN',
+                                       detectedDates[0], detectedDates[1])
                 else:
-                    templateQuery += " WHERE {att} {ops} '{val}'"
-                    if detectedOps:
-                        templateQuery = queryFormat(templateQuery,
-                                                    ops=detectedOps[0])
-                    else:
-                        templateQuery = queryFormat(templateQuery,
-                                                    att=detectedAtts[i],
-                                                    val=detectedDates[0])
+                    query.addPredicate(attribute, (detectedOps[0]
+                                                   if detectedOps else '='),
+                                       detectedDates[0])
 
     # GROUP BY
-    # Part two of Agg/Function words - some require grouping.
-    if detectedAggs and successfulQuery and len(detectedAtts) >= 2:
-        templateQuery += " GROUP BY {attgroup}"
-        templateQuery = queryFormat(templateQuery,
-                                    attgroup=detectedAtts[1])
+    # Part two of Agg/Function words - every other selected
+    # attribute has to be grouped.
+    if detectedAggs and len(detectedAtts) >= 2:
+        query.groupBy = list(detectedAtts[1:])
 
     # ORDER BY
-    if detectedOrder and successfulQuery:
-        templateQuery += " ORDER BY {orderatt} {order}"
-        templateQuery = queryFormat(templateQuery,
-                                    orderatt=detectedAtts[0],
-                                    order=detectedOrder[0])
-
-    # Failure case
-    if not successfulQuery:
+    if detectedOrder and detectedAtts:
+        query.orderBy = [(detectedAtts[0], detectedOrder[0])]
+    return query
+#
+#               JOIN TABLE
+# Brings a table into the query along the shortest foreign key
+# path from the tables already joined. A table the planner cannot
+# reach is joined naturally.
+#
+# @param query Query IR being built
+# @param planner joinplanner.JoinPlanner
+# @param table STRING table a predicate column belongs to
+#
+
+
+def joinTable(query, planner, table):
+    steps = planner.extend(query.tables(), table)
+    if steps is None:
+        query.addJoin(Join(table, natural=True))
+        return
+    for step in steps:
+        query.addJoin(Join(*step))
+#
+#               QUERY GENERATION (SQL)
+# Builds the Query IR and renders it.
+#
+# @see buildQuery
+#
+# @return templateQuery STRING Query generated as a string, or None
+#                       if no query could be constructed
+# @return binds DICT bind variable name -> literal value
+#
+
+
+@instrumentation.timed('stage.queryGeneration')
+def queryGeneration(detectedAtts, detectedEnts, detectedAggs,
+                    detectedNums, detectedOrder, leftOverWords, detectedDates,
+                    detectedOps, keyListAttribute, catalog,
+                    resolveWord=leftOverPrompt):
+    query = buildQuery(detectedAtts, detectedEnts, detectedAggs,
+                       detectedNums, detectedOrder, leftOverWords,
+                       detectedDates, detectedOps, keyListAttribute, catalog,
+                       resolveWord)
+    return renderQuery(query)
+
+
+@instrumentation.timed('stage.render')
+def renderQuery(query):
+    templateQuery, binds = (None, None) if query is None else query.render()
+    if templateQuery is None:
         print()
         print("A successful query could not be constructed from your input.")
-        print("Exiting in 5")
-        time.sleep(5)
-        main()
-
-    print(templateQuery)
-    return templateQuery
+        return None, None
+    print(inlineBinds(templateQuery, binds))
+    return templateQuery, binds
 #
 #               QUERY EXECUTION
 # Code to execute the query
 #
+# Rows are streamed with fetchmany, either to the terminal a page
+# at a time or to an export writer.
+# With a result cache, a result still valid there is streamed from
+# memory; otherwise the rows are recorded on their way to the
+# writer and a complete result is cached. Aggregates a rollup
+# covers are answered from it. A query that does go to the
+# database is checked by the cost guard first, and runs under the
+# row and time limits it sets.
+#
+# @see resultstream.streamResult
+# @see resultcache.ResultCache
+# @see rollups.RollupManager
+# @see guard.CostGuard
+#
+# @param statements StatementCache of a pooled session
 # @param templateQuery STRING Query generated as a string
+# @param binds DICT bind variables for the query
+# @param writer result writer, paged terminal output if None
+# @param fetchSize INT rows per fetch
+# @param maxRows INT only return the first N rows, None for all
+# @param resultCache ResultCache, or None to always run the query
+# @param rollups RollupManager, or None
+# @param guard CostGuard, or None to run every query unchecked
+#
+# @return stats DICT rows, bytes, seconds, rowsPerSecond, cached,
+#               and the reasons if the guard stopped the query
 #
 
 
-def queryExec(templateQuery):
+def queryExec(statements, templateQuery, binds, writer=None,
+              fetchSize=defaultFetchSize, maxRows=None, resultCache=None,
+              rollups=None, guard=None):
     print()
-    print("Query to run: %s" % templateQuery)
+    print("Query to run: %s" % inlineBinds(templateQuery, binds))
     print()
     print()
-    curs.execute(templateQuery)
+    if writer is None:
+        writer = PagedWriter()
+    answer = None
+    if resultCache is not None:
+        cached = resultCache.get(templateQuery, binds)
+        if cached is not None:
+            answer = cached.columns, cached.rows
+    if answer is None and rollups is not None:
+        answer = rollups.answer(templateQuery, binds)
+    if answer is not None:
+        stats = streamResult(CachedCursor(*answer), writer, fetchSize,
+                             maxRows)
+    else:
+        recording = None
+        if resultCache is not None:
+            stamps = resultCache.snapshot(templateQuery)
+            writer = recording = RecordingWriter(writer, resultCache.maxRows)
+        try:
+            if guard is None:
+                stats = fetchQuery(statements, templateQuery, binds, writer,
+                                   fetchSize, maxRows)
+            else:
+                verdict = guard.check(statements, templateQuery, binds)
+                if verdict.reasons:
+                    print("Limited to %d rows and %ss: %s"
+                          % (verdict.maxRows, verdict.timeout,
+                             '; '.join(verdict.reasons)))
+                if maxRows is None or verdict.maxRows < maxRows:
+                    maxRows = verdict.maxRows
+                # The page prompt waits outside the time limit
+                with guard.timeLimit(statements, verdict) as limit:
+                    stats = fetchQuery(statements, verdict.sql, binds,
+                                       writer, fetchSize, maxRows,
+                                       limit.paused)
+        except QueryRejected as rejected:
+            print()
+            print("Query not run: %s" % rejected)
+            return {'rows': 0, 'bytes': 0, 'seconds': 0.0,
+                    'rowsPerSecond': 0.0, 'cached': False,
+                    'rejected': rejected.reasons}
+        if recording is not None and not recording.overflowed and \
+                not recording.stopped and \
+                (maxRows is None or stats['rows'] < maxRows):
+            resultCache.put(templateQuery, binds, recording.columns,
+                            recording.rows, stamps)
+    stats['cached'] = answer is not None
+    print()
+    print("%d rows in %.3fs (%.0f rows/s, %d bytes%s)"
+          % (stats['rows'], stats['seconds'], stats['rowsPerSecond'],
+             stats['bytes'], ', cached' if stats['cached'] else ''))
+    return stats
 
-    # Print column headings
-    for i in curs.description:
-        print(i[0], sep="", end="    ", flush=True)
 
-    print()
-    # Print rows individually
-    for row in curs:
-        print(row)
-    return None
+def fetchQuery(statements, sql, binds, writer, fetchSize, maxRows,
+               paused=None):
+    curs = statements.execute(sql, binds)
+    with instrumentation.timer('db.fetch'):
+        return streamResult(curs, writer, fetchSize, maxRows, paused)
 #
 #               QUERY LOGGING
 # Code to log the scenario
 #
 # Saves the input, the query generated, and a user confirmation
+# The record is handed to the write-behind LogWriter, which does
+# the duplicate check and insert off the request path.
+#
+# @see logwriter.LogWriter
 #
+# @param logWriter LogWriter background writer for the Log table
 # @param originalInput STRING Original user input
 # @param templateQuery STRING Query generated as a string
+# @param binds DICT bind variables, written into the logged query
 #
 
 
-def queryLog(originalInput, templateQuery):
+def queryLog(logWriter, originalInput, templateQuery, binds):
     print()
     print()
     print("Is this the output you expected?")
     userConf = input("Please enter only Y or N:  ")
     userConf = userConf.lower()
 
-    # Check if it exists already in the log
-    validQuery = "SELECT OrigInput FROM Log"
-    curs.execute(validQuery)
-    origInputArray = []
-    origInputArray = [word for word, in curs.fetchall()]
-
-    for i, words in enumerate(origInputArray):
-        origInputArray[i] = origInputArray[i].lower()
-
-    if originalInput.lower() not in origInputArray:
-        print("Thank you for the new query!")
-        countQuery = "SELECT max(LogID) FROM Log"
-        curs.execute(countQuery)
-        maxCount = curs.fetchone()[0]
-        maxCount = maxCount+1
-        print(maxCount)
-        confQuery = "INSERT INTO Log (LogID, OrigInput, QueryRan, UserConf) \
-                    VALUES (%s, '%s', '%s', '%s')" % (maxCount, \
-                                                      originalInput, \
-                                                      templateQuery, \
-                                                      userConf)
-        print(confQuery)
-        curs.execute(confQuery)
-        curs.execute("commit")
-        time.sleep(1)
-    else:
-        print("Thank you, this input has been logged.")
+    logWriter.submit(originalInput, inlineBinds(templateQuery, binds),
+                     userConf)
+    print("Thank you, this input has been logged.")
     del originalInput
     return None
 #
-#                   MAIN
-# Controls the data flow throughout the application
+#                   TRANSLATE
+# Runs one question through the whole translation pipeline
+#
+# tokenizer -> synonymModule -> stopWordModule ->
+# keyWordDetection -> queryGeneration
+#
+# The middle three stages run as a single pass over the tokens
+# using the compiled lexicon.
+#
+# @see lexicon.Lexicon.classify
+# @see translationcache.TranslationCache
+#
+# @param originalInput STRING question as typed
+# @param catalog SchemaCatalog in-memory dictionary of the schema
+# @param resolveWord function mapping a left over word to a menu
+#                    number, see leftOverPrompt
+# @param cache TranslationCache consulted before queryGeneration
+# @param lexicon Lexicon of the catalog's schema, the HR lexicon
+#                if None
+# @param valueIndex ValueIndex whose values are never corrected to
+#                   lexicon words, or None
+#
+# @return templateQuery STRING Query generated, or None on failure
+# @return binds DICT bind variables for the query
 #
 
 
-def main():
-    databaseConnection()
-    lowerInput, originalInput = userInput()
+def translate(originalInput, catalog, resolveWord=leftOverPrompt,
+              cache=None, lexicon=None, valueIndex=None):
+    return renderQuery(translateQuery(originalInput, catalog, resolveWord,
+                                      cache, lexicon=lexicon,
+                                      valueIndex=valueIndex))
+
+
+# Same pipeline, returning the Query IR (or None) unrendered.
+# corrections, if given, receives the typo corrections considered.
+def translateQuery(originalInput, catalog, resolveWord=leftOverPrompt,
+                   cache=None, corrections=None, lexicon=None,
+                   valueIndex=None):
+    lowerInput = originalInput.lower()
     (tokenInput, detectedDates,
      detectedOps) = tokenizer(lowerInput, originalInput)
-    synonymReplacer, detectedOps = synonymModule(tokenInput, detectedOps)
-    tokenStop = stopWordModule(synonymReplacer)
     (detectedAtts, detectedEnts, detectedAggs, detectedNums,
-     detectedOrder, leftOverWords,
-     keyListAttribute) = keyWordDetection(tokenStop)
-    templateQuery = queryGeneration(detectedAtts, detectedEnts,
-                                    detectedAggs, detectedNums, detectedOrder,
-                                    leftOverWords, detectedDates, detectedOps,
-                                    keyListAttribute)
-    queryExec(templateQuery)
-    queryLog(originalInput, templateQuery)
+     detectedOrder, leftOverWords, keyListAttribute,
+     tokenStop) = classify(tokenInput, detectedOps, corrections, lexicon,
+                           valueIndex)
+    leftOverWords = dropExtracted(leftOverWords, detectedOps, detectedDates)
+
+    def generate(detectedNums, detectedDates):
+        return buildQuery(detectedAtts, detectedEnts, detectedAggs,
+                          detectedNums, detectedOrder, leftOverWords,
+                          detectedDates, detectedOps, keyListAttribute,
+                          catalog, resolveWord)
+    if cache is None:
+        query = generate(detectedNums, detectedDates)
+    else:
+        query = cache.generate(generate, tokenStop, detectedAtts,
+                               detectedEnts, detectedAggs, detectedNums,
+                               detectedOrder, leftOverWords, detectedDates,
+                               detectedOps)
+    instrumentation.count('translate.failed' if query is None
+                          else 'translate.ok')
+    return query
+
+
+# Synonyms, stop words and key words in one pass
+@instrumentation.timed('stage.classify')
+def classify(tokenInput, detectedOps, corrections=None, lexicon=None,
+             valueIndex=None):
+    if lexicon is None:
+        lexicon = defaultLexicon()
+    return lexicon.classify(tokenInput, detectedOps, corrections,
+                            valueIndex)
+#
+#                   MAIN
+# Controls the data flow throughout the application
+#
+# Connects once and then loops over user queries, reusing the
+# pooled sessions. A failed translation asks for a new query.
+# Left over words are looked up in the value index and only
+# asked about when the index cannot place them.
+#
+# @param backend OracleBackend or SqliteBackend, Oracle if None
+# @param exportPath STRING CSV or JSONL file results are written
+#                   to instead of the terminal, or None
+# @param fetchSize INT rows per fetch
+# @param maxRows INT only return the first N rows, None for all
+# @param pageSize INT terminal rows per page, None for no paging
+# @param useReplica BOOLEAN answer SELECTs from a local replica
+# @param useRollups BOOLEAN answer hot aggregates from rollups
+# @param guardLog STRING file the cost guard's decisions are
+#                 appended to, or None
+#
+# @see instrumentation
+# @see replica.LocalReplica
+# @see rollups.RollupManager
+# @see guard.CostGuard
+# @see incremental.Completer
+#
+
+
+def main(backend=None, exportPath=None, fetchSize=defaultFetchSize,
+         maxRows=None, pageSize=20, useReplica=False, useRollups=False,
+         guardLog=None):
+    pool, catalog = databaseConnection(backend)
+    # Tab completion at the prompt, loaded while the rest starts up
+    incremental.installCompletion(incremental.Completer.loading(pool,
+                                                                catalog))
+    cache = TranslationCache(path='translation_cache.json')
+    logWriter = LogWriter(pool)
+    valueIndex = ValueIndex.fromPool(pool)
+    resolveWord = valueIndex.resolver(leftOverPrompt)
+    resultCache = ResultCache().watch(pool)
+    replica = LocalReplica.fromPool(pool).watch() if useReplica else None
+    rollups = None
+    if useRollups:
+        rollups = RollupManager.fromPool(pool, catalog).watch()
+    guard = CostGuard(pool.backend, catalog, logPath=guardLog)
+    handle = None
+    try:
+        if exportPath:
+            writer, handle = writerFor(exportPath)
+        while True:
+            lowerInput, originalInput = userInput()
+            templateQuery, binds = translate(originalInput, catalog,
+                                             resolveWord, cache,
+                                             valueIndex=valueIndex)
+            if templateQuery is None:
+                continue
+            if handle is None:
+                writer = PagedWriter(pageSize)
+            source, sourceGuard = pool, guard
+            if replica is not None and replica.accepts(templateQuery):
+                source, sourceGuard = replica, None
+            with source.statements() as statements:
+                queryExec(statements, templateQuery, binds, writer,
+                          fetchSize, maxRows, resultCache, rollups,
+                          sourceGuard)
+            queryLog(logWriter, originalInput, templateQuery, binds)
+            if rollups is not None:
+                rollups.maintain()
+            instrumentation.export()
+    finally:
+        if handle is not None:
+            handle.close()
+        logWriter.close()
+        cache.save()
+        if replica is not None:
+            replica.close()
+        pool.close()
+        instrumentation.export()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sqlite', action='store_true',
+                        help='run against a local SQLite stand-in '
+                             'loaded from ORACLE SCRIPT.SQL')
+    parser.add_argument('--export', metavar='FILE',
+                        help='write results to a .csv or .jsonl file')
+    parser.add_argument('--fetch-size', type=int, default=defaultFetchSize,
+                        help='rows fetched per round trip')
+    parser.add_argument('--max-rows', type=int,
+                        help='only return the first N rows')
+    parser.add_argument('--page-size', type=int, default=20,
+                        help='rows per terminal page, 0 to disable paging')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='export timings and counters to a .prom '
+                             'or JSON lines file')
+    parser.add_argument('--replica', action='store_true',
+                        help='run queries on a local in-memory copy of '
+                             'the HR tables')
+    parser.add_argument('--rollups', action='store_true',
+                        help='precompute the aggregates asked most often')
+    parser.add_argument('--guard-log', metavar='FILE',
+                        help='append the cost guard\'s decisions to a '
+                             'JSON lines file')
+    args = parser.parse_args()
+    instrumentation.configure(args.metrics)
+    main(SqliteBackend() if args.sqlite else None, args.export,
+         args.fetch_size, args.max_rows, args.page_size or None,
+         args.replica, args.rollups, args.guard_log)
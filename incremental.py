@@ -0,0 +1,344 @@
+#
+# Natural Language Interface to Databases
+#       Incremental Translation
+#
+# As-you-type front end of the pipeline. One translator is kept
+# per typing session and updated on every keystroke:
+#
+#   tokenizer   only the text from the first changed word on is
+#               split again; earlier tokens keep their spans
+#   classify    the phrase, synonym, stop word and keyword lookup
+#               of every unit (Lexicon.resolveUnit) is kept when
+#               the unit ends before the first changed token and
+#               cannot grow into a longer phrase; only the units
+#               after it are looked up again
+#   fold        the units are folded into keyword lists
+#               (Lexicon.fold), one pass over a few words
+#
+# Operators and dates are found with the tokenizer's expressions
+# over the whole text, a few microseconds on a question. The
+# draft says at once whether a FROM clause is possible, and
+# preview() gives the query buildQuery would make of the text so
+# far, left over words ignored.
+#
+# Completions come from prefix tries over the lexicon's words and
+# the questions in the Log table. Each trie node holds its best
+# completions, worked out when the trie is built, so a keystroke
+# costs a walk down the prefix and no search.
+#
+# Completer.loading() reads the Log and warms the join planner
+# and the fuzzy index on a background thread, started before the
+# first question is typed; until it is done, or if it fails,
+# there are simply no completions.
+import bisect
+import collections
+import os
+import re
+import sys
+import threading
+
+import implementation
+import instrumentation
+from lexicon import defaultLexicon
+
+chunkFind = re.compile(r'\S+')
+logQuestions = ("SELECT OrigInput, SUM(Hits) FROM Log "
+                "WHERE UserConf IS NULL OR lower(UserConf) NOT LIKE 'n%' "
+                "GROUP BY OrigInput")
+#
+#                   COMPLETION TRIE
+# Character trie whose nodes are [children, best], best being the
+# limit heaviest (-weight, text) pairs below the node, in order.
+#
+# @param limit INT completions kept per node
+#
+
+
+class CompletionTrie(object):
+
+    def __init__(self, limit=5):
+        self.limit = limit
+        self.root = [{}, []]
+
+    def add(self, text, weight=1):
+        entry = (-weight, text)
+        node = self.root
+        self.keep(node[1], entry)
+        for char in text:
+            child = node[0].get(char)
+            if child is None:
+                child = node[0][char] = [{}, []]
+            node = child
+            self.keep(node[1], entry)
+
+    def keep(self, best, entry):
+        if len(best) < self.limit or entry < best[-1]:
+            bisect.insort(best, entry)
+            del best[self.limit:]
+
+    # @return LIST of texts starting with prefix, heaviest first
+    def complete(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        return [text for weight, text in node[1]]
+#
+#                   COMPLETER
+# Words are offered as typed, so underscored lexicon words and
+# phrases ("first_name") are offered with spaces ("first name").
+# Each is weighted by how often logged questions use it.
+#
+# @param lexicon Lexicon whose words are completed
+# @param questions ITERABLE of (question, times asked)
+# @param limit INT completions returned
+#
+
+
+class Completer(object):
+
+    def __init__(self, lexicon, questions=(), limit=5):
+        self.limit = limit
+        self.words = CompletionTrie(limit)
+        self.questions = CompletionTrie(limit)
+        self.ready = threading.Event()
+        if lexicon is not None:
+            self.load(lexicon, questions)
+
+    def load(self, lexicon, questions):
+        words = CompletionTrie(self.limit)
+        questionTrie = CompletionTrie(self.limit)
+        usage = collections.Counter()
+        for question, count in questions:
+            question = ' '.join((question or '').lower().split())
+            if question:
+                questionTrie.add(question, count)
+                usage.update(dict.fromkeys(
+                    implementation.tokenizer(question, question)[0], count))
+        offered = set()
+        for word in lexicon.entries:
+            if word in lexicon.stopWords:
+                continue
+            typed = word.replace('_', ' ')
+            if typed.replace(' ', '').isalpha() and typed not in offered:
+                offered.add(typed)
+                words.add(typed, 1 + min(usage[part]
+                                         for part in typed.split()))
+        self.words, self.questions = words, questionTrie
+        self.ready.set()
+
+    #
+    #               LOADING
+    # Completer filled in on a background thread, which also builds
+    # the catalog's join planner and the lexicon's fuzzy index so the
+    # first translation does not pay for them.
+    #
+    # @param pool ConnectionPool the Log table is read through
+    # @param catalog SchemaCatalog
+    # @param lexicon Lexicon, the HR lexicon if None
+    #
+
+    @classmethod
+    def loading(cls, pool, catalog, lexicon=None, limit=5):
+        completer = cls(None, limit=limit)
+        lexicon = lexicon or defaultLexicon()
+
+        # ready is set even on failure, so nothing waits forever
+        def load():
+            try:
+                with instrumentation.timer('db.completerLoad'):
+                    catalog.joinPlanner()
+                    lexicon.correct('warm')
+                    with pool.cursor() as curs:
+                        curs.execute(logQuestions)
+                        questions = curs.fetchall()
+                    completer.load(lexicon, questions)
+            except Exception as exception:
+                print("Completer load failed: %s" % exception,
+                      file=sys.stderr)
+            finally:
+                completer.ready.set()
+        thread = threading.Thread(target=load, name='nli-completer')
+        thread.daemon = True
+        thread.start()
+        return completer
+    #
+    #               COMPLETE
+    # @param text STRING question typed so far
+    #
+    # @return LIST of up to limit completed texts: the word being
+    #         typed completed (two word phrases first), then logged
+    #         questions starting with the text
+    #
+
+    def complete(self, text):
+        lower = text.lower()
+        completions = []
+        chunks = lower.split()
+        if chunks and not lower[-1].isspace():
+            head = text[:len(text) - len(chunks[-1])]
+            if len(chunks) > 1:
+                pairHead = head.rstrip()[:-len(chunks[-2])]
+                for phrase in self.words.complete(' '.join(chunks[-2:])):
+                    if ' ' in phrase:
+                        completions.append(pairHead + phrase)
+            for word in self.words.complete(chunks[-1]):
+                if word != chunks[-1]:
+                    completions.append(head + word)
+        typed = ' '.join(chunks)
+        for question in self.questions.complete(typed):
+            if question != typed:
+                completions.append(question)
+        seen = set()
+        unique = []
+        for completion in completions:
+            if completion not in seen:
+                seen.add(completion)
+                unique.append(completion)
+        return unique[:self.limit]
+#
+#                   UNIT
+# @param start INT first token
+# @param end INT token after the unit
+# @param reach INT token after the last one its lookup depended on
+# @param token STRING phrase or word, corrected if it was unknown
+# @param entry compiled lexicon entry, None for numbers and left
+#              over words
+# @param corrections LIST of (token, FuzzyMatch) considered
+#
+Unit = collections.namedtuple('Unit', ['start', 'end', 'reach', 'token',
+                                       'entry', 'corrections'])
+#
+#                   DRAFT
+# Translation state of the text typed so far.
+#
+Draft = collections.namedtuple('Draft', ['tokens', 'attributes', 'entities',
+                                         'aggregates', 'numbers', 'dates',
+                                         'operators', 'order', 'leftOver',
+                                         'corrections', 'hasSource',
+                                         'resolved', 'completions'])
+#
+#                   INCREMENTAL TRANSLATOR
+# @param catalog SchemaCatalog of the schema
+# @param lexicon Lexicon of the schema, the HR lexicon if None
+# @param completer Completer, or None for no completions
+# @param valueIndex ValueIndex whose values are never corrected to
+#                   lexicon words, or None
+#
+
+
+class IncrementalTranslator(object):
+
+    def __init__(self, catalog, lexicon=None, completer=None,
+                 valueIndex=None):
+        self.catalog = catalog
+        self.lexicon = lexicon or defaultLexicon()
+        self.completer = completer
+        self.valueIndex = valueIndex
+        self.text = ''
+        self.spans = []
+        self.tokens = []
+        self.units = []
+        self.draft = None
+        self.attributes = None
+    #
+    #               UPDATE
+    # @param text STRING whole question as typed so far
+    #
+    # @return Draft
+    #
+
+    @instrumentation.timed('stage.incremental')
+    def update(self, text):
+        same = len(os.path.commonprefix((self.text, text)))
+
+        # A token touching the change may have grown, so it is
+        # split again with everything after it
+        kept = 0
+        while kept < len(self.spans) and self.spans[kept][1] < same:
+            kept += 1
+        del self.spans[kept:]
+        del self.tokens[kept:]
+        position = self.spans[-1][1] if self.spans else 0
+        for chunk in chunkFind.finditer(text, position):
+            token = chunk.group().lower().translate(implementation.translator)
+            if token:
+                self.spans.append(chunk.span())
+                self.tokens.append(token)
+        self.text = text
+
+        units = self.units
+        stale = 0
+        while stale < len(units) and units[stale].reach <= kept:
+            stale += 1
+        del units[stale:]
+        position = units[-1].end if units else 0
+        resolved = 0
+        while position < len(self.tokens):
+            corrections = []
+            token, entry, end = self.lexicon.resolveUnit(
+                self.tokens, position, corrections, self.valueIndex)
+            reach = max(end, position +
+                        self.lexicon.phraseLength(self.tokens[position]))
+            units.append(Unit(position, end, reach, token, entry,
+                              corrections))
+            position = end
+            resolved += 1
+
+        detectedOps = implementation.comparisonOps.findall(text)
+        detectedDates = implementation.dateFind.findall(text)
+        (detectedAtts, detectedEnts, detectedAggs, detectedNums,
+         detectedOrder, leftOverWords, self.attributes,
+         tokenStop) = self.lexicon.fold(
+            [(unit.token, unit.entry) for unit in units], detectedOps)
+        leftOverWords = implementation.dropExtracted(
+            leftOverWords, detectedOps, detectedDates)
+        completions = (self.completer.complete(text)
+                       if self.completer is not None else [])
+        self.draft = Draft(list(self.tokens), detectedAtts, detectedEnts,
+                           detectedAggs, detectedNums, detectedDates,
+                           detectedOps, detectedOrder, leftOverWords,
+                           [correction for unit in units
+                            for correction in unit.corrections],
+                           bool(detectedEnts), resolved, completions)
+        return self.draft
+
+    # @return templateQuery, binds of the text so far, left over words
+    #         ignored, or (None, None) without a FROM clause
+    def preview(self):
+        draft = self.draft
+        if draft is None or not draft.hasSource:
+            return None, None
+        query = implementation.buildQuery(
+            list(draft.attributes), list(draft.entities),
+            list(draft.aggregates), list(draft.numbers), list(draft.order),
+            list(draft.leftOver), list(draft.dates), list(draft.operators),
+            self.attributes, self.catalog,
+            lambda word: implementation.ignoreWord)
+        return (None, None) if query is None else query.render()
+#
+#                   TERMINAL COMPLETION
+# Tab completion at the interactive prompt, where readline exists.
+#
+
+
+def installCompletion(completer):
+    try:
+        import readline
+    except ImportError:
+        return False
+
+    def complete(word, state):
+        line = readline.get_line_buffer()
+        if state == 0:
+            complete.matches = [word + completion[len(line):]
+                                for completion in completer.complete(line)
+                                if completion.startswith(line)]
+        if state < len(complete.matches):
+            return complete.matches[state]
+        return None
+    complete.matches = []
+    readline.set_completer(complete)
+    readline.parse_and_bind('tab: complete')
+    return True
@@ -0,0 +1,256 @@
+#
+# Natural Language Interface to Databases
+#       Instrumentation
+#
+# Timers, counters and latency histograms for the pipeline
+# stages and database calls.
+#
+# Instrumentation is off until configure() is given an export
+# path (or finds NLI_METRICS set). While off, timer() hands back
+# one shared do-nothing context manager, timed() functions call
+# straight through and count() returns at once, so instrumented
+# code pays for a function call and nothing else.
+#
+# Exports:
+#   *.prom / *.txt   Prometheus text exposition format, rewritten
+#                    in place on every export
+#   anything else    JSON lines, one snapshot appended per export
+#
+# Timer names in use:
+#   stage.tokenizer, stage.synonymModule, stage.stopWordModule,
+#   stage.keyWordDetection, stage.classify, stage.buildQuery,
+#   stage.render, stage.queryGeneration, stage.incremental
+#   db.connect, db.catalogLoad, db.valueIndexLoad, db.execute,
+#   db.fetch, db.logWrite, db.replicaRefresh, db.rollupRefresh,
+#   db.explain, db.completerLoad
+# Counters in use:
+#   translate.ok, translate.failed, translationCache.exactHit,
+#   translationCache.shapeHit, translationCache.miss,
+#   translationCache.bypass, valueIndex.hit, valueIndex.corrected,
+#   valueIndex.ambiguous, valueIndex.miss, resultCache.hit,
+#   resultCache.miss, replica.local, replica.declined, rollups.hit,
+#   rollups.miss, guard.allowed, guard.limited, guard.rejected,
+#   guard.timeouts
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+defaultBuckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                  0.5, 1.0, 2.5, 5.0)
+#
+#                   DISABLED
+#
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+class NullRecorder(object):
+
+    enabled = False
+    timerInstance = NullTimer()
+
+    def timer(self, name):
+        return self.timerInstance
+
+    def observe(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def snapshot(self):
+        return {'counters': {}, 'histograms': {}}
+#
+#                   HISTOGRAM
+# Cumulative-bucket latency histogram, as Prometheus expects.
+#
+# @param bounds TUPLE upper bounds in seconds
+#
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=defaultBuckets):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        running = 0
+        counts = []
+        for bucket in self.buckets:
+            running += bucket
+            counts.append(running)
+        return counts
+
+    # Estimated from the buckets, upper bound of the bucket
+    def quantile(self, fraction):
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        for bound, running in zip(self.bounds, self.cumulative()):
+            if running >= target:
+                return bound
+        return float('inf')
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.bounds] +
+                                    ['+Inf'], self.cumulative()))}
+#
+#                   TIMER
+#
+
+
+class Timer(object):
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.recorder.observe(self.name, time.perf_counter() - self.start)
+        return False
+#
+#                   RECORDER
+# Thread-safe store of counters and histograms.
+#
+# @param path STRING export file, or None to only keep in memory
+# @param buckets TUPLE histogram bounds in seconds
+#
+
+
+class Recorder(object):
+
+    enabled = True
+
+    def __init__(self, path=None, buckets=defaultBuckets):
+        self.path = path
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {'time': time.time(), 'counters': dict(self.counters),
+                    'histograms': dict((name, histogram.toDict())
+                                       for name, histogram
+                                       in self.histograms.items())}
+
+    def export(self):
+        if not self.path:
+            return
+        if self.path.endswith(('.prom', '.txt')):
+            self.writePrometheus(self.path)
+        else:
+            with open(self.path, 'a') as metricsFile:
+                metricsFile.write(json.dumps(self.snapshot(),
+                                             sort_keys=True) + '\n')
+
+    # Written to a temporary file and renamed, so a scraper never
+    # reads half a file
+    def writePrometheus(self, path):
+        snapshot = self.snapshot()
+        lines = ['# TYPE nli_events_total counter']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('nli_events_total{event="%s"} %d' % (name, value))
+        lines.append('# TYPE nli_duration_seconds histogram')
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            for bound in [str(bound) for bound in self.buckets] + ['+Inf']:
+                lines.append('nli_duration_seconds_bucket{timer="%s",'
+                             'le="%s"} %d' % (name, bound,
+                                              histogram['buckets'][bound]))
+            lines.append('nli_duration_seconds_sum{timer="%s"} %.9f'
+                         % (name, histogram['sum']))
+            lines.append('nli_duration_seconds_count{timer="%s"} %d'
+                         % (name, histogram['count']))
+        tempPath = path + '.tmp'
+        with open(tempPath, 'w') as metricsFile:
+            metricsFile.write('\n'.join(lines) + '\n')
+        os.replace(tempPath, path)
+#
+#                   MODULE INTERFACE
+# The instrumented modules only call timer(), timed(), count()
+# and export(); configure() swaps the recorder behind them.
+#
+
+
+recorder = NullRecorder()
+
+
+# @param path STRING export file, NLI_METRICS if None
+# @param enabled BOOLEAN defaults to whether there is a path;
+#                True without a path records in memory only
+def configure(path=None, enabled=None):
+    global recorder
+    if path is None:
+        path = os.environ.get('NLI_METRICS') or None
+    if enabled is None:
+        enabled = path is not None
+    recorder = Recorder(path) if enabled else NullRecorder()
+    return recorder
+
+
+def timer(name):
+    return recorder.timer(name)
+
+
+# Decorator form of timer(), for whole pipeline stages
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            with recorder.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, amount=1):
+    recorder.count(name, amount)
+
+
+def export():
+    if recorder.enabled:
+        recorder.export()
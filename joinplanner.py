@@ -0,0 +1,173 @@
+#
+# Natural Language Interface to Databases
+#       Join Planner
+#
+# Joins detected entities along the schema's foreign keys instead
+# of joining every entity back to the first one on its primary key.
+#
+# The foreign key graph (employees -> departments -> locations,
+# job_history -> jobs, ...) is built once, self references are
+# dropped, and the shortest join path between every pair of
+# tables is precomputed with a breadth-first search from each
+# table. A join tree for a set of entities is grown from the
+# first entity by repeatedly attaching the closest missing table
+# along its precomputed path, and memoised, so planning is a
+# dictionary lookup after the first call.
+#
+# When two tables are linked by more than one foreign key, the
+# key whose column has the same name on both sides wins
+# (Employees.DepartmentID = Departments.DepartmentID over
+# Departments.ManagerID = Employees.EmpID).
+import collections
+import re
+
+import standin
+
+foreignKeyFind = re.compile(r'FOREIGN\s+KEY\s*\((\w+)\)\s*REFERENCES\s+'
+                            r'(\w+)\s*\((\w+)\)', re.I)
+tableFind = re.compile(r'^(?:CREATE|ALTER)\s+TABLE\s+(\w+)', re.I)
+#
+#                   JOIN STEP
+# One join in a plan: table is joined to leftTable, which is
+# already part of the tree, on leftColumn = rightColumn.
+#
+JoinStep = collections.namedtuple('JoinStep', ['table', 'leftTable',
+                                               'leftColumn', 'rightColumn'])
+#
+#                   JOIN PLANNER
+# @param foreignKeys LIST of (table, column, refTable, refColumn)
+#
+
+
+class JoinPlanner(object):
+
+    def __init__(self, foreignKeys):
+        self.edges = {}
+        self.neighbours = collections.defaultdict(set)
+        for table, column, refTable, refColumn in foreignKeys:
+            table, refTable = table.lower(), refTable.lower()
+            column, refColumn = column.lower(), refColumn.lower()
+            if table == refTable:
+                continue
+            pair = frozenset((table, refTable))
+            current = self.edges.get(pair)
+            if current is None or (column == refColumn and
+                                   current[1] != current[3]):
+                self.edges[pair] = (table, column, refTable, refColumn)
+            self.neighbours[table].add(refTable)
+            self.neighbours[refTable].add(table)
+        self.paths = {}
+        for table in sorted(self.neighbours):
+            self.paths[table] = self.shortestPaths(table)
+        self.plans = {}
+
+    @classmethod
+    def fromCatalog(cls, catalog):
+        foreignKeys = []
+        for table in catalog.tableNames():
+            for column, refTable, refColumn in catalog.foreignKeys(table):
+                foreignKeys.append((table, column, refTable, refColumn))
+        return cls(foreignKeys)
+
+    # Reads the foreign keys straight from the schema script
+    @classmethod
+    def fromScript(cls, scriptPath=standin.defaultScriptPath):
+        foreignKeys = []
+        for statement in standin.readScript(scriptPath):
+            table = tableFind.match(statement)
+            if not table:
+                continue
+            for column, refTable, refColumn in \
+                    foreignKeyFind.findall(statement):
+                foreignKeys.append((table.group(1), column, refTable,
+                                    refColumn))
+        return cls(foreignKeys)
+
+    # Breadth-first search, recording the path to every table
+    def shortestPaths(self, start):
+        paths = {start: []}
+        frontier = collections.deque([start])
+        while frontier:
+            table = frontier.popleft()
+            for neighbour in sorted(self.neighbours[table]):
+                if neighbour not in paths:
+                    paths[neighbour] = paths[table] + [neighbour]
+                    frontier.append(neighbour)
+        return paths
+
+    def step(self, fromTable, toTable):
+        table, column, refTable, refColumn = self.edges[
+            frozenset((fromTable, toTable))]
+        if table == fromTable:
+            return JoinStep(toTable, fromTable, column, refColumn)
+        return JoinStep(toTable, fromTable, refColumn, column)
+
+    def distance(self, fromTable, toTable):
+        path = self.paths.get(fromTable, {}).get(toTable)
+        return None if path is None else len(path)
+    #
+    #               EXTEND
+    # Joins needed to bring table into an existing join tree.
+    #
+    # @param joined LIST tables already in the FROM clause
+    # @param table STRING table to add
+    #
+    # @return LIST of JoinStep, empty if already joined, None if
+    #              table cannot be reached through foreign keys
+    #
+
+    def extend(self, joined, table):
+        joined = [name.lower() for name in joined]
+        table = table.lower()
+        if table in joined:
+            return []
+        best = None
+        for start in joined:
+            path = self.paths.get(start, {}).get(table)
+            if path is not None and (best is None or
+                                     len(path) < len(best[1])):
+                best = (start, path)
+        if best is None:
+            return None
+        steps = []
+        previous = best[0]
+        for nextTable in best[1]:
+            if nextTable not in joined:
+                steps.append(self.step(previous, nextTable))
+                joined.append(nextTable)
+            previous = nextTable
+        return steps
+    #
+    #               PLAN
+    # Minimal join tree for a list of entities, rooted at the first.
+    # Entities are attached closest first.
+    #
+    # @param entities LIST table names, first one is the FROM table
+    #
+    # @return LIST of JoinStep, or None if an entity is unreachable
+    #
+
+    def plan(self, entities):
+        key = tuple(entity.lower() for entity in entities)
+        if key in self.plans:
+            return self.plans[key]
+        joined = [key[0]]
+        missing = [entity for entity in key[1:] if entity != key[0]]
+        steps = []
+        while missing:
+            distances = []
+            for entity in missing:
+                nearest = [self.distance(table, entity) for table in joined]
+                nearest = [value for value in nearest if value is not None]
+                if nearest:
+                    distances.append((min(nearest), entity))
+            if not distances:
+                steps = None
+                break
+            entity = min(distances)[1]
+            newSteps = self.extend(joined, entity)
+            steps.extend(newSteps)
+            joined.extend(step.table for step in newSteps)
+            missing = [name for name in missing if name not in joined]
+        self.plans[key] = steps
+        return steps
@@ -0,0 +1,348 @@
+#
+# Natural Language Interface to Databases
+#       Compiled Lexicon
+#
+# Vocabulary of the HR domain and the compiled lookup built from
+# it. Every surface token is resolved once, at compile time,
+# through the same rules as synonymModule, stopWordModule and
+# keyWordDetection, so at query time each token costs a single
+# dictionary lookup and the three stages run as one pass.
+#
+# Multi-word phrases ("order by", "first name") are matched with
+# a token trie before the per-token lookup.
+#
+# A token with no entry is looked up in a fuzzy index over the
+# vocabulary, so typos ("salry", "departmnt") still classify.
+# Corrections below fuzzyThreshold confidence are left as left
+# over words for the caller to resolve. A token the value index
+# holds ("rose", a first name one edit from "role") is never
+# corrected, and tokens of shortToken characters or fewer, where
+# one edit is a quarter of the word, need a confidence above the
+# threshold.
+import os
+import threading
+
+import stopwordlist
+from fuzzy import FuzzyIndex
+
+synonymDict = {'staff': ('employees', 'first_name', 'last_name'),
+               'employee': 'employees', 'title': 'job_title',
+               'position': 'job_title', 'job': 'job_title',
+               'maximum': 'max', 'average': 'avg', 'minimum': 'min',
+               'salaries': 'salary', 'role': 'job_title',
+               'name': 'first_name', 'departmentid': 'dept_name',
+               'deptid': 'dept_name', 'earn': 'salary', 'earns': 'salary',
+               'hire': 'hire_date', 'hired': 'hire_date', 'over': '>',
+               'under': '<', 'earner': ('salary', 'employees',
+                                        'first_name', 'last_name'),
+
+               'site': 'locationID', 'highest': 'max', 'lowest': 'min',
+               'most': 'max', 'least': 'min', 'largest': 'max'}
+operatorsFind = ['<', '>', '<=', '>=', '=']
+
+# Phrases are replaced by a single surface token, which is then
+# looked up like any other word.
+phraseDict = {('order', 'by'): 'order_by',
+              ('first', 'name'): 'first_name',
+              ('last', 'name'): 'last_name',
+              ('job', 'title'): 'job_title',
+              ('hire', 'date'): 'hire_date',
+              ('start', 'date'): 'start_date',
+              ('end', 'date'): 'end_date',
+              ('department', 'name'): 'dept_name'}
+
+stopListOmit = set(('example'))
+stopListContext = ['please', 'show', 'pull', 'records', 'named',
+                   'any', 'all', 'called', 'anyall', 'provide', 'current',
+                   'information', 'currently', 'us', 'work', 'working',
+                   'company', 'could', 'see', 'business', 'send',
+                   'details']
+
+keyListEntity = ['employees', 'jobs', 'job_history',
+                 'departments', 'locations']
+keyListAttribute = {'jobID': 'jobs', 'job_title': 'jobs',
+                    'min_salary': 'jobs', 'max_salary': 'jobs',
+                    'salary': 'employees', 'locationID': 'locations',
+                    'address': 'locations', 'postcode': 'locations',
+                    'city': 'locations', 'first_name': 'employees',
+                    'last_name': 'employees', 'email': 'employees',
+                    'phone': 'employees', 'hire_date': 'employees',
+                    'commissionPCT': 'employees', 'managerID': 'employees',
+                    'start_date': 'job_history', 'end_date': 'job_history',
+                    'departmentID': 'departments',
+                    'dept_name': 'departments'}
+keyListAgg = ['avg', 'max', 'min', 'count']
+keyListOrder = {'order': 'ASC', 'order_by': 'ASC',
+                'ascending': 'ASC', 'descending': 'DSC',
+                'asc': 'ASC', 'dsc': 'DSC'}
+
+# Categories a word can compile to
+STOP = 'stop'
+ENTITY = 'entity'
+ATTRIBUTE = 'attribute'
+AGG = 'agg'
+ORDER = 'order'
+LEFTOVER = 'leftover'
+#
+#                   LEXICON
+# Compiled form of the vocabulary.
+#
+#   expansions  surface token -> tuple of synonym replacements
+#   stopWords   frozenset of words removed by stopWordModule
+#   categories  word -> (category, value) for keyWordDetection
+#   entries     surface token -> (operators,
+#                                 ((category, word, value), ..))
+#               i.e. all three stages folded together
+#   phrases     token trie, a None key marks the end of a phrase
+#   fuzzy       FuzzyIndex over every word with an entry except
+#               stop words, built on the first unknown token
+#
+# Words absent from entries are numbers or left over words.
+#
+
+
+class Lexicon(object):
+
+    fuzzyThreshold = 0.75
+    shortToken = 4
+
+    def __init__(self, synonyms, stopWords, entities, attributes,
+                 aggregates, orders, phrases):
+        self.attributes = dict(attributes)
+        self.expansions = {}
+        for word, replacement in synonyms.items():
+            if not isinstance(replacement, tuple):
+                replacement = (replacement,)
+            self.expansions[word] = replacement
+        self.stopWords = frozenset(stopWords)
+
+        self.categories = {}
+        for word, value in orders.items():
+            self.categories[word] = (ORDER, value)
+        for word in aggregates:
+            self.categories[word] = (AGG, word)
+        for word in attributes:
+            self.categories[word] = (ATTRIBUTE, word)
+        for word in entities:
+            self.categories[word] = (ENTITY, word)
+
+        self.phrases = {}
+        self.phraseLengths = {}
+        for words, surface in phrases.items():
+            self.phraseLengths[words[0]] = max(
+                len(words), self.phraseLengths.get(words[0], 0))
+            node = self.phrases
+            for word in words:
+                node = node.setdefault(word, {})
+            node[None] = surface
+
+        self.entries = {}
+        vocabulary = (set(self.expansions) | self.stopWords |
+                      set(self.categories) | set(phrases.values()))
+        for word in vocabulary:
+            self.entries[word] = self.compileEntry(word)
+        self.fuzzy = None
+
+    # Runs one word through the synonym, stop word and category
+    # rules, in that order, exactly as the separate stages would.
+    def compileEntry(self, word):
+        replacements = self.expansions.get(word, (word,))
+        operators = tuple(replacement for replacement in replacements
+                          if replacement in operatorsFind
+                          and word in self.expansions)
+        items = []
+        for replacement in replacements:
+            if replacement in self.stopWords:
+                category, value = STOP, replacement
+            else:
+                category, value = self.categories.get(
+                    replacement, (LEFTOVER, replacement))
+            items.append((category, replacement, value))
+        return operators, tuple(items)
+
+    # Longest phrase starting at tokens[start]
+    # @return (surface token, tokens consumed)
+    def matchPhrase(self, tokens, start):
+        node = self.phrases.get(tokens[start])
+        match = (tokens[start], 1)
+        position = start + 1
+        while node is not None:
+            if None in node:
+                match = (node[None], position - start)
+            if position >= len(tokens):
+                break
+            node = node.get(tokens[position])
+            position += 1
+        return match
+
+    # Most tokens a phrase starting with word can take, 0 if none
+    def phraseLength(self, word):
+        return self.phraseLengths.get(word, 0)
+
+    #
+    #               CORRECT
+    # @param token STRING word with no entry
+    #
+    # @return FuzzyMatch whose word has an entry, or None
+    #
+
+    def correct(self, token):
+        fuzzy = self.fuzzy
+        if fuzzy is None:
+            fuzzy = FuzzyIndex()
+            for word in sorted(self.entries):
+                if word not in self.stopWords:
+                    fuzzy.add(word)
+            self.fuzzy = fuzzy
+        return fuzzy.best(token)
+
+    def joinPhrases(self, tokens):
+        joined = []
+        position = 0
+        while position < len(tokens):
+            surface, used = self.matchPhrase(tokens, position)
+            joined.append(surface)
+            position += used
+        return joined
+    #
+    #               SINGLE PASS CLASSIFIER
+    # Phrase join, synonym replacement, stop word removal and
+    # keyword categorisation in one pass over the tokens.
+    #
+    # @param tokens LIST output of the tokenizer
+    # @param detectedOps LIST operators found so far, extended in place
+    # @param corrections LIST, if given, receives (token, FuzzyMatch)
+    #                    for every unknown token with a close match
+    # @param valueIndex ValueIndex whose values are left uncorrected,
+    #                   or None
+    #
+    # @return same tuple as keyWordDetection, plus tokenStop
+    #
+
+    def classify(self, tokens, detectedOps, corrections=None,
+                 valueIndex=None):
+        units = []
+        position = 0
+        while position < len(tokens):
+            token, entry, position = self.resolveUnit(tokens, position,
+                                                      corrections,
+                                                      valueIndex)
+            units.append((token, entry))
+        return self.fold(units, detectedOps)
+
+    # Phrase or word at tokens[position], corrected if it is unknown
+    # and not a value in valueIndex
+    # @return token, its entry (None for numbers and left over words)
+    #         and the position after it
+    def resolveUnit(self, tokens, position, corrections=None,
+                    valueIndex=None):
+        token = tokens[position]
+        used = 1
+        if token in self.phrases:
+            token, used = self.matchPhrase(tokens, position)
+        entry = self.entries.get(token)
+        if entry is None and not token.isdigit() and \
+                not (valueIndex is not None and valueIndex.lookup(token)):
+            match = self.correct(token)
+            if match is not None:
+                if corrections is not None:
+                    corrections.append((token, match))
+                if self.confident(token, match):
+                    token = match.word
+                    entry = self.entries[token]
+        return token, entry, position + used
+
+    def confident(self, token, match):
+        if len(token) <= self.shortToken:
+            return match.confidence > self.fuzzyThreshold
+        return match.confidence >= self.fuzzyThreshold
+
+    # Folds resolved (token, entry) units into keyword lists
+    def fold(self, units, detectedOps):
+        detectedAtts = []
+        detectedEnts = []
+        detectedAggs = []
+        detectedNums = []
+        detectedOrder = []
+        leftOverWords = []
+        tokenStop = []
+
+        for token, entry in units:
+            if entry is None:
+                tokenStop.append(token)
+                if token.isdigit():
+                    detectedNums.append(token)
+                else:
+                    leftOverWords.append(token)
+                continue
+            operators, items = entry
+            detectedOps.extend(operators)
+            for category, word, value in items:
+                if category is STOP:
+                    continue
+                tokenStop.append(word)
+                if category is ENTITY:
+                    detectedEnts.append(value)
+                elif category is ATTRIBUTE:
+                    # A repeated attribute falls through to the left
+                    # over words, as it does in keyWordDetection
+                    if value in detectedAtts:
+                        leftOverWords.append(value)
+                    else:
+                        detectedAtts.append(value)
+                elif category is AGG:
+                    detectedAggs.append(value)
+                elif category is ORDER:
+                    detectedOrder.append(value)
+                else:
+                    leftOverWords.append(value)
+
+        # If the attribute's entity was not detected, add it
+        for attribute in detectedAtts:
+            if self.attributes[attribute] not in detectedEnts:
+                detectedEnts.append(self.attributes[attribute])
+        return (detectedAtts, detectedEnts, detectedAggs, detectedNums,
+                detectedOrder, leftOverWords, self.attributes, tokenStop)
+#
+#                   DEFAULT LEXICON
+# Compiled once per process, on first use.
+#
+# Stop words come from the bundled snapshot in stopwordlist.py.
+# Setting NLI_STOPWORDS=nltk reads the live NLTK corpus instead;
+# only then is NLTK imported.
+#
+
+
+compiledLexicon = None
+compileLock = threading.Lock()
+
+
+def nltkStopWords():
+    from nltk.corpus import stopwords
+    return stopwords.words('english')
+
+
+def defaultStopWords():
+    if os.environ.get('NLI_STOPWORDS') == 'nltk':
+        return nltkStopWords()
+    return stopwordlist.stopWordList
+
+
+def stopWordSet(stopWordList=None):
+    if stopWordList is None:
+        stopWordList = defaultStopWords()
+    return (set(stopWordList) - stopListOmit) | set(stopListContext)
+
+
+def compileLexicon(stopWordList=None):
+    return Lexicon(synonymDict, stopWordSet(stopWordList), keyListEntity,
+                   keyListAttribute, keyListAgg, keyListOrder, phraseDict)
+
+
+def defaultLexicon():
+    global compiledLexicon
+    if compiledLexicon is None:
+        with compileLock:
+            if compiledLexicon is None:
+                compiledLexicon = compileLexicon()
+    return compiledLexicon
@@ -0,0 +1,572 @@
+#
+# Natural Language Interface to Databases
+#       Lexicon Store
+#
+# Lexicons for any schema, generated from its catalog and
+# compiled into a binary file that every worker memory-maps.
+#
+# Generation makes each table an entity and each column an
+# attribute (a column found in several tables belongs to the one
+# it is the primary key of), turns underscored names into phrases
+# ("hire date" -> hire_date) and adds the singular of each table
+# name as a synonym. Aggregates, orders, stop words and their
+# synonyms ("average", "highest", "over") are the same for every
+# schema and come from lexicon.py. The override file,
+# <directory>/<SCHEMA>.json, then changes what was generated:
+#
+#   exclude      words dropped, with the columns of excluded tables
+#   synonyms     word -> replacement, or list of replacements
+#   entities     extra table words
+#   attributes   word -> table it belongs to
+#   phrases      "two words" -> surface token, null to drop one
+#   stopWords    extra stop words
+#   keepWords    stop words that are kept
+#
+# The compiled file, <directory>/<SCHEMA>.lex, holds one sorted
+# table per lookup (entries, expansions, stop words, categories,
+# attributes, phrases) over a shared string pool, searched in
+# place by bisection. Nothing is unpacked when it is opened, so
+# all the processes and threads mapping a file share one copy of
+# it in the page cache, however many schemas are served.
+#
+# A recompiled file replaces the old one atomically. Stores see
+# the change on the next lookup and map the new file; queries
+# already running finish on the old mapping.
+#
+# Usage: python lexiconstore.py [--sqlite] [--directory DIR] SCHEMA ..
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+import implementation
+from catalog import SchemaCatalog
+from lexicon import (Lexicon, synonymDict, operatorsFind, keyListAgg,
+                     keyListOrder, stopWordSet, STOP, ENTITY, ATTRIBUTE, AGG,
+                     ORDER, LEFTOVER)
+from pool import SqliteBackend
+
+defaultLexiconDirectory = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'lexicons')
+schemaFind = re.compile(r'^\w+$')
+
+# Synonyms that mean the same in every schema
+commonSynonyms = dict((word, replacement)
+                      for word, replacement in synonymDict.items()
+                      if replacement in keyListAgg or
+                      replacement in operatorsFind)
+#
+#                   GENERATE
+# @param catalog SchemaCatalog of the schema
+# @param overrides DICT contents of the override file, or None
+# @param stopWordList LIST stop words, lexicon.defaultStopWords if None
+#
+# @return Lexicon
+#
+
+
+def generateLexicon(catalog, overrides=None, stopWordList=None):
+    overrides = overrides or {}
+    exclude = set(word.lower() for word in overrides.get('exclude', ()))
+
+    entities = []
+    owners = {}
+    for tableName in catalog.tableNames():
+        entity = tableName.lower()
+        if entity in exclude:
+            continue
+        entities.append(entity)
+        table = catalog.table(tableName)
+        foreignKeys = set(foreignKey[0]
+                          for foreignKey in table['foreignKeys'])
+        for column in table['columns']:
+            if table['primaryKey'] == [column]:
+                rank = 0
+            elif column in foreignKeys:
+                rank = 2
+            else:
+                rank = 1
+            word = column.lower()
+            if word not in owners or rank < owners[word][0]:
+                owners[word] = (rank, entity)
+    attributes = dict((word, entity) for word, (rank, entity)
+                      in owners.items() if word not in exclude)
+
+    # "max salary" reads as an aggregate, not as the max_salary column
+    phrases = {}
+    for word in entities + sorted(attributes) + sorted(keyListOrder):
+        words = tuple(word.split('_'))
+        if len(words) > 1 and all(words) and words[0] not in keyListAgg:
+            phrases[words] = word
+
+    synonyms = dict(commonSynonyms)
+    for entity in entities:
+        singular = entity[:-1]
+        if entity.endswith('s') and singular not in attributes and \
+                singular not in exclude:
+            synonyms[singular] = entity
+
+    for word, replacement in overrides.get('synonyms', {}).items():
+        synonyms[word] = (tuple(replacement)
+                          if isinstance(replacement, list) else replacement)
+    entities.extend(word for word in overrides.get('entities', ())
+                    if word not in entities)
+    attributes.update(overrides.get('attributes', {}))
+    for words, surface in overrides.get('phrases', {}).items():
+        if surface is None:
+            phrases.pop(tuple(words.split()), None)
+        else:
+            phrases[tuple(words.split())] = surface
+    stopWords = ((stopWordSet(stopWordList) |
+                  set(overrides.get('stopWords', ()))) -
+                 set(overrides.get('keepWords', ())))
+    return Lexicon(synonyms, stopWords, entities, attributes, keyListAgg,
+                   keyListOrder, phrases)
+#
+#                   FILE FORMAT
+#   header      magic, format version, table count, string pool
+#               offset
+#   directory   (records offset, record count) per table, in
+#               tableNames order
+#   records     (key offset, key length, value offset, value
+#               length) into the string pool, sorted by key bytes
+#   pool        UTF-8 strings, each stored once
+#
+# Values are strings; lists in them are split on unitSeparator and
+# the items of an entry on recordSeparator.
+#
+fileMagic = b'NLXC'
+formatVersion = 1
+tableNames = ('meta', 'entries', 'expansions', 'stopWords', 'categories',
+              'attributes', 'phrases', 'phraseStarts')
+headerStruct = struct.Struct('<4sHHI')
+directoryStruct = struct.Struct('<II')
+recordStruct = struct.Struct('<IIII')
+unitSeparator = '\x1f'
+recordSeparator = '\x1e'
+categoryCodes = {STOP: 's', ENTITY: 'e', ATTRIBUTE: 'a', AGG: 'g',
+                 ORDER: 'o', LEFTOVER: 'l'}
+# Decoding gives back the lexicon's own constants, which classify
+# compares by identity
+codeCategories = dict((code, category)
+                      for category, code in categoryCodes.items())
+
+
+def encodeEntry(entry):
+    operators, items = entry
+    return recordSeparator.join(
+        [unitSeparator.join(operators)] +
+        [unitSeparator.join((categoryCodes[category], word, value))
+         for category, word, value in items])
+
+
+def decodeEntry(text):
+    parts = text.split(recordSeparator)
+    operators = tuple(parts[0].split(unitSeparator)) if parts[0] else ()
+    items = []
+    for part in parts[1:]:
+        code, word, value = part.split(unitSeparator)
+        items.append((codeCategories[code], word, value))
+    return operators, tuple(items)
+
+
+def decodeCategory(text):
+    code, value = text.split(unitSeparator)
+    return codeCategories[code], value
+
+
+def decodeList(text):
+    return tuple(text.split(unitSeparator))
+
+
+def decodeText(text):
+    return text
+
+
+decoders = {'meta': decodeText, 'entries': decodeEntry,
+            'expansions': decodeList, 'stopWords': decodeText,
+            'categories': decodeCategory, 'attributes': decodeText,
+            'phrases': decodeText, 'phraseStarts': int}
+
+
+def phraseItems(node, words=()):
+    for word, child in node.items():
+        if word is None:
+            yield words, child
+        else:
+            for item in phraseItems(child, words + (word,)):
+                yield item
+#
+#                   WRITE LEXICON
+# Written to a temporary file and renamed, so a reader never maps
+# a half written file.
+#
+# @param lexicon Lexicon to compile
+# @param path STRING file written
+# @param meta DICT of strings stored with it
+#
+
+
+def writeLexicon(lexicon, path, meta):
+    phrases = dict(phraseItems(lexicon.phrases))
+    phraseStarts = {}
+    for words in phrases:
+        phraseStarts[words[0]] = str(max(len(words),
+                                         int(phraseStarts.get(words[0], 0))))
+    tables = {
+        'meta': meta,
+        'entries': dict((word, encodeEntry(entry))
+                        for word, entry in lexicon.entries.items()),
+        'expansions': dict((word, unitSeparator.join(replacements))
+                           for word, replacements
+                           in lexicon.expansions.items()),
+        'stopWords': dict.fromkeys(lexicon.stopWords, ''),
+        'categories': dict((word, categoryCodes[category] + unitSeparator +
+                            value)
+                           for word, (category, value)
+                           in lexicon.categories.items()),
+        'attributes': lexicon.attributes,
+        'phrases': dict((' '.join(words), surface)
+                        for words, surface in phrases.items()),
+        'phraseStarts': phraseStarts}
+
+    pool = bytearray()
+    pooled = {}
+
+    def intern(text):
+        data = text.encode('utf-8')
+        if data not in pooled:
+            pooled[data] = len(pool)
+            pool.extend(data)
+        return pooled[data], len(data)
+
+    recordCount = sum(len(tables[name]) for name in tableNames)
+    offset = headerStruct.size + directoryStruct.size * len(tableNames)
+    poolOffset = offset + recordStruct.size * recordCount
+    directory = bytearray()
+    records = bytearray()
+    for name in tableNames:
+        rows = sorted((key.encode('utf-8'), key, value)
+                      for key, value in tables[name].items())
+        directory += directoryStruct.pack(offset + len(records), len(rows))
+        for data, key, value in rows:
+            records += recordStruct.pack(*(intern(key) + intern(value)))
+
+    tempPath = '%s.%d.tmp' % (path, os.getpid())
+    with open(tempPath, 'wb') as lexiconFile:
+        lexiconFile.write(headerStruct.pack(fileMagic, formatVersion,
+                                            len(tableNames), poolOffset))
+        lexiconFile.write(directory)
+        lexiconFile.write(records)
+        lexiconFile.write(pool)
+    os.replace(tempPath, path)
+#
+#                   MAPPED TABLE
+# Read-only dictionary over one table of a mapped file.
+#
+
+
+class MappedTable(object):
+
+    def __init__(self, buffer, offset, count, poolOffset, decode):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.poolOffset = poolOffset
+        self.decode = decode
+
+    def record(self, index):
+        return recordStruct.unpack_from(self.buffer, self.offset +
+                                        recordStruct.size * index)
+
+    def text(self, offset, length):
+        start = self.poolOffset + offset
+        return self.buffer[start:start + length]
+
+    # @return BYTES the value stored under key, or None
+    def find(self, key):
+        key = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            keyOffset, keyLength, valueOffset, valueLength = \
+                self.record(middle)
+            probe = self.text(keyOffset, keyLength)
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return self.text(valueOffset, valueLength)
+        return None
+
+    def get(self, key, default=None):
+        value = self.find(key)
+        if value is None:
+            return default
+        return self.decode(value.decode('utf-8'))
+
+    def __getitem__(self, key):
+        value = self.find(key)
+        if value is None:
+            raise KeyError(key)
+        return self.decode(value.decode('utf-8'))
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            keyOffset, keyLength = self.record(index)[:2]
+            yield self.text(keyOffset, keyLength).decode('utf-8')
+
+    def items(self):
+        for index in range(self.count):
+            keyOffset, keyLength, valueOffset, valueLength = \
+                self.record(index)
+            yield (self.text(keyOffset, keyLength).decode('utf-8'),
+                   self.decode(self.text(valueOffset,
+                                         valueLength).decode('utf-8')))
+#
+#                   MAPPED LEXICON
+# Lexicon whose lookups read a compiled file in place. Phrases are
+# matched by looking the joined words up, longest first; the fuzzy
+# index is still built per process, on the first unknown token.
+#
+# @param path STRING compiled lexicon file
+#
+# @exception ValueError the file is not a compiled lexicon
+#
+
+
+class MappedLexicon(Lexicon):
+
+    def __init__(self, path):
+        with open(path, 'rb') as lexiconFile:
+            self.buffer = mmap.mmap(lexiconFile.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        magic, version, count, poolOffset = headerStruct.unpack_from(
+            self.buffer, 0)
+        if magic != fileMagic or version != formatVersion or \
+                count != len(tableNames):
+            self.buffer.close()
+            raise ValueError('%s is not a compiled lexicon' % path)
+        tables = {}
+        for index, name in enumerate(tableNames):
+            offset, rows = directoryStruct.unpack_from(
+                self.buffer, headerStruct.size + directoryStruct.size * index)
+            tables[name] = MappedTable(self.buffer, offset, rows, poolOffset,
+                                       decoders[name])
+        self.path = path
+        self.meta = dict(tables['meta'].items())
+        self.entries = tables['entries']
+        self.expansions = tables['expansions']
+        self.stopWords = tables['stopWords']
+        self.categories = tables['categories']
+        self.attributes = tables['attributes']
+        self.phraseTable = tables['phrases']
+        self.phrases = tables['phraseStarts']
+        self.fuzzy = None
+
+    def phraseLength(self, word):
+        return self.phrases.get(word, 0)
+
+    def matchPhrase(self, tokens, start):
+        longest = self.phrases.get(tokens[start], 0)
+        for length in range(min(longest, len(tokens) - start), 1, -1):
+            surface = self.phraseTable.get(
+                ' '.join(tokens[start:start + length]))
+            if surface is not None:
+                return surface, length
+        return tokens[start], 1
+#
+#                   LEXICON STORE
+# Compiled lexicons of a directory, one per schema, mapped on
+# first use and mapped again whenever the file is replaced.
+#
+# @param directory STRING where override and compiled files live
+# @param checkInterval NUMBER seconds between checks of a file for
+#                      a newer version
+#
+
+
+class LexiconStore(object):
+
+    def __init__(self, directory=defaultLexiconDirectory, checkInterval=1.0):
+        self.directory = directory
+        self.checkInterval = checkInterval
+        self.mapped = {}
+        self.lock = threading.Lock()
+
+    def path(self, schema):
+        return os.path.join(self.directory, schemaName(schema) + '.lex')
+
+    def overridePath(self, schema):
+        return os.path.join(self.directory, schemaName(schema) + '.json')
+
+    def overrides(self, schema):
+        path = self.overridePath(schema)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as overrideFile:
+            return json.load(overrideFile)
+    #
+    #               COMPILE
+    # @param schema STRING schema name
+    # @param catalog SchemaCatalog of the schema
+    #
+    # @return STRING path of the compiled file
+    #
+
+    def compile(self, schema, catalog, stopWordList=None):
+        lexicon = generateLexicon(catalog, self.overrides(schema),
+                                  stopWordList)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(schema)
+        writeLexicon(lexicon, path, {'schema': schemaName(schema),
+                                     'compiledAt': repr(time.time()),
+                                     'catalogLoadedAt':
+                                         repr(catalog.loadedAt)})
+        with self.lock:
+            self.mapped.pop(path, None)
+        return path
+
+    # @return MappedLexicon, or None if the schema was never compiled
+    def lexicon(self, schema):
+        path = self.path(schema)
+        now = time.time()
+        with self.lock:
+            mapped = self.mapped.get(path)
+            if mapped is not None and now - mapped[2] < self.checkInterval:
+                return mapped[0]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.mapped.pop(path, None)
+                return None
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if mapped is None or mapped[1] != version:
+                mapped = (MappedLexicon(path), version, now)
+            else:
+                mapped = (mapped[0], version, now)
+            self.mapped[path] = mapped
+            return mapped[0]
+
+    def schemas(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory)
+                      if name.endswith('.lex'))
+#
+#                   UNKNOWN SCHEMA
+# Raised for a schema that is not served, or has no tables.
+#
+
+
+class UnknownSchema(Exception):
+    pass
+#
+#                   SCHEMA REGISTRY
+# Catalog and lexicon of every schema a deployment serves,
+# loaded on first use. The catalog of a schema is kept in a
+# snapshot next to its lexicon; refresh() reloads it from the
+# database and compiles the lexicon again, and every worker
+# mapping the store picks the new lexicon up without a restart.
+#
+# @param pool ConnectionPool the catalogs are loaded through
+# @param store LexiconStore
+# @param schemas LIST names that may be served, None for any
+#
+
+
+class SchemaRegistry(object):
+
+    def __init__(self, pool, store, schemas=None):
+        self.pool = pool
+        self.store = store
+        self.allowed = (None if schemas is None
+                        else set(schemaName(schema) for schema in schemas))
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    def catalog(self, schema):
+        schema = schemaName(schema)
+        if self.allowed is not None and schema not in self.allowed:
+            raise UnknownSchema('schema %s is not served' % schema)
+        with self.lock:
+            catalog = self.catalogs.get(schema)
+            if catalog is None:
+                def loadCatalog():
+                    with self.pool.cursor() as curs:
+                        return self.pool.backend.loadCatalog(curs, schema)
+                snapshotPath = None
+                if self.pool.backend.snapshotPath:
+                    snapshotPath = os.path.join(self.store.directory,
+                                                schema + '.catalog.json')
+                catalog = SchemaCatalog.open(loadCatalog, snapshotPath)
+                if not catalog.tableNames():
+                    raise UnknownSchema('schema %s has no tables' % schema)
+                self.catalogs[schema] = catalog
+            return catalog
+
+    # A lexicon compiled from a newer catalog, by another process,
+    # brings the catalog's snapshot along with it
+    # @return catalog SchemaCatalog, lexicon MappedLexicon
+    def get(self, schema):
+        catalog = self.catalog(schema)
+        lexicon = self.store.lexicon(schema)
+        if lexicon is None:
+            self.store.compile(schema, catalog)
+            lexicon = self.store.lexicon(schema)
+        elif catalog.snapshotPath and \
+                float(lexicon.meta['catalogLoadedAt']) > catalog.loadedAt:
+            catalog.loadSnapshot()
+        return catalog, lexicon
+
+    def refresh(self, schema):
+        catalog = self.catalog(schema)
+        catalog.refresh()
+        self.store.compile(schema, catalog)
+        return self.get(schema)
+
+
+# Schema names become file names, so only word characters pass
+def schemaName(schema):
+    if not schemaFind.match(schema or ''):
+        raise UnknownSchema('bad schema name %r' % schema)
+    return schema.upper()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the lexicons of '
+                                     'one or more schemas')
+    parser.add_argument('schemas', nargs='+', metavar='SCHEMA')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='use the SQLite stand-in instead of Oracle')
+    parser.add_argument('--directory', default=defaultLexiconDirectory,
+                        help='where override files are read and compiled '
+                             'lexicons written')
+    args = parser.parse_args()
+    backend = SqliteBackend() if args.sqlite else None
+    pool = implementation.databaseConnection(backend)[0]
+    registry = SchemaRegistry(pool, LexiconStore(args.directory))
+    try:
+        for schema in args.schemas:
+            catalog, lexicon = registry.refresh(schema)
+            print('%s: %d tables, %d words -> %s'
+                  % (schemaName(schema), len(catalog.tableNames()),
+                     len(lexicon.entries), lexicon.path))
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
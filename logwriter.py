@@ -0,0 +1,186 @@
+#
+# Natural Language Interface to Databases
+#       Log Writer
+#
+# Write-behind logging for the Log table.
+#
+# queryLog only puts a record on a bounded queue; a background
+# thread drains it in batches. For each batch the writer looks
+# the normalised input hashes up through the unique index on
+# Log.InputHash, adds the repeats of inputs already logged to
+# their Hits column, and inserts the rest with one executemany.
+# LogIDs come from the Log_Seq sequence, so there is no
+# max(LogID) round trip.
+#
+# When the queue is full new records are dropped and counted
+# rather than blocking the user's query. Records the database
+# rejects for any reason other than a duplicate input are counted
+# as failed and reported on stderr. close() drains and flushes
+# everything still queued.
+import hashlib
+import queue
+import sys
+import threading
+import time
+
+import instrumentation
+
+insertLog = ("INSERT INTO Log (LogID, OrigInput, QueryRan, UserConf, "
+             "InputHash, Hits) VALUES (%s, :origInput, :queryRan, "
+             ":userConf, :inputHash, :hits)")
+updateHits = "UPDATE Log SET Hits = Hits + :hits WHERE InputHash = :inputHash"
+#
+#                   INPUT HASH
+# Case and whitespace differences do not make a new log entry.
+#
+# @param originalInput STRING question as typed
+#
+# @return STRING hex SHA-256 of the normalised input
+#
+
+
+def inputHash(originalInput):
+    normalised = ' '.join(originalInput.lower().split())
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+#
+#                   LOG WRITER
+# @param pool ConnectionPool sessions used for the inserts
+# @param maxQueued INT records held in memory before dropping
+# @param batchSize INT records inserted per executemany
+# @param flushInterval NUMBER seconds a partial batch may wait
+#
+
+
+class LogWriter(object):
+
+    stopSignal = object()
+
+    def __init__(self, pool, maxQueued=10000, batchSize=200,
+                 flushInterval=1.0):
+        self.pool = pool
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.queue = queue.Queue(maxQueued)
+        self.stats = {'queued': 0, 'dropped': 0, 'written': 0,
+                      'duplicates': 0, 'failed': 0, 'batches': 0}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='LogWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Never blocks: a full queue drops the record
+    def submit(self, originalInput, templateQuery, userConf):
+        record = {'origInput': originalInput, 'queryRan': templateQuery,
+                  'userConf': userConf, 'inputHash': inputHash(originalInput)}
+        try:
+            self.queue.put_nowait(record)
+            self.count('queued')
+            return True
+        except queue.Full:
+            self.count('dropped')
+            return False
+
+    # submit() and the writer thread both update the stats
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.time() + self.flushInterval
+            while len(batch) < self.batchSize:
+                try:
+                    record = self.queue.get(
+                        timeout=max(deadline - time.time(), 0.01))
+                except queue.Empty:
+                    break
+                if record is self.stopSignal:
+                    stopping = True
+                    break
+                batch.append(record)
+            if batch:
+                self.write(batch)
+
+    # Repeats within the batch are folded into one record whose
+    # hits is the number of times the input was submitted
+    def write(self, batch):
+        unique = {}
+        for record in batch:
+            first = unique.setdefault(record['inputHash'],
+                                      dict(record, hits=0))
+            first['hits'] += 1
+        self.count('duplicates', len(batch) - len(unique))
+        try:
+            with self.pool.cursor() as curs, \
+                    instrumentation.timer('db.logWrite'):
+                existing = self.loggedHashes(curs, list(unique))
+                records = [record for hashValue, record in unique.items()
+                           if hashValue not in existing]
+                self.count('duplicates', len(unique) - len(records))
+                repeats = [record for hashValue, record in unique.items()
+                           if hashValue in existing]
+                repeats += self.insert(curs, records)
+                self.addHits(curs, repeats)
+        except Exception as exception:
+            self.count('failed', len(unique))
+            print("Log write failed: %s" % exception, file=sys.stderr)
+        self.count('batches')
+
+    # Indexed lookup of the hashes already present in Log
+    def loggedHashes(self, curs, hashes):
+        binds = dict(('h%d' % i, hashValue)
+                     for i, hashValue in enumerate(hashes))
+        curs.execute("SELECT InputHash FROM Log WHERE InputHash IN (%s)"
+                     % ', '.join(':%s' % name for name in binds), binds)
+        return set(hashValue for hashValue, in curs.fetchall())
+
+    # A concurrent writer can log the same input between the
+    # lookup and the insert; the unique index rejects the batch,
+    # so it is retried row by row, skipping the duplicates. Rows
+    # failing otherwise (an input too long for its column) are
+    # dropped and counted as failed.
+    #
+    # @return LIST of the records found logged after all
+    def insert(self, curs, records):
+        if not records:
+            return []
+        statement = insertLog % self.pool.backend.nextLogId
+        try:
+            curs.executemany(statement, records)
+            curs.connection.commit()
+            self.count('written', len(records))
+            return []
+        except self.pool.backend.databaseError:
+            curs.connection.rollback()
+        repeats = []
+        for record in records:
+            try:
+                curs.execute(statement, record)
+                curs.connection.commit()
+                self.count('written')
+            except self.pool.backend.databaseError as exception:
+                curs.connection.rollback()
+                if self.pool.backend.isDuplicate(exception):
+                    self.count('duplicates')
+                    repeats.append(record)
+                else:
+                    self.count('failed')
+                    print("Log insert failed: %s" % exception,
+                          file=sys.stderr)
+        return repeats
+
+    # Counts the submits of inputs already logged against their row
+    def addHits(self, curs, records):
+        if not records:
+            return
+        curs.executemany(updateHits, [{'hits': record['hits'],
+                                       'inputHash': record['inputHash']}
+                                      for record in records])
+        curs.connection.commit()
+
+    # Flushes everything queued, then stops the writer thread
+    def close(self):
+        self.queue.put(self.stopSignal)
+        self.thread.join()
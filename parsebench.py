@@ -0,0 +1,117 @@
+#
+# Natural Language Interface to Databases
+#       Parse Count Benchmark
+#
+# Runs the same workload of questions twice: once with literals
+# written into the SQL text and a fresh cursor per query (the
+# old behaviour), and once with bind variables through the pooled
+# StatementCache.
+#
+# On Oracle the session's 'parse count (total)' and 'parse count
+# (hard)' statistics are read from v$mystat before and after each
+# run. On the SQLite stand-in, which has no such statistics, the
+# bind run reports the statements StatementCache prepared and both
+# runs the number of distinct statement texts they produced. The
+# literal run's fresh cursors are not counted by anything, so its
+# figure is the assumption of one parse per execution and is
+# reported as parsesAssumed.
+#
+# Usage: python parsebench.py [--repeat N]
+#        python parsebench.py --oracle --user U --password P [--dsn D]
+import argparse
+import contextlib
+import io
+import time
+
+import implementation
+from pool import OracleBackend, SqliteBackend
+from statementcache import inlineBinds
+
+workload = ['show salary over {n}', 'show salary under {n}',
+            'employees with salary over {n} order by salary',
+            'show the average salary', 'highest salary of staff']
+
+parseStatQuery = """
+SELECT name.name, stat.value FROM v$mystat stat
+JOIN v$statname name ON name.statistic# = stat.statistic#
+WHERE name.name IN ('parse count (total)', 'parse count (hard)')"""
+
+
+def questions(repeat):
+    for i in range(repeat):
+        for question in workload:
+            yield question.format(n=15000 + i * 7)
+
+
+def parseCounts(connection):
+    curs = connection.cursor()
+    curs.execute(parseStatQuery)
+    counts = dict(curs.fetchall())
+    curs.close()
+    return counts
+
+
+def runLiterals(connection, translated):
+    texts = set()
+    for templateQuery, binds in translated:
+        sql = inlineBinds(templateQuery, binds)
+        texts.add(sql)
+        curs = connection.cursor()
+        curs.execute(sql)
+        curs.fetchall()
+        curs.close()
+    return {'parsesAssumed': len(translated), 'distinctTexts': len(texts)}
+
+
+def runBinds(statements, translated):
+    texts = set()
+    before = statements.stats['prepares']
+    for templateQuery, binds in translated:
+        texts.add(templateQuery)
+        statements.execute(templateQuery, binds).fetchall()
+    prepares = statements.stats['prepares'] - before
+    return {'parses': prepares, 'distinctTexts': len(texts)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--oracle', action='store_true')
+    parser.add_argument('--user', default='SYSTEM')
+    parser.add_argument('--password', default='x')
+    parser.add_argument('--dsn', help='Oracle connect string, local '
+                        'instance if omitted')
+    args = parser.parse_args()
+
+    if args.oracle:
+        backend = OracleBackend(args.user, args.password, args.dsn)
+    else:
+        backend = SqliteBackend()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pool, catalog = implementation.databaseConnection(backend)
+        translated = [implementation.translate(question, catalog,
+                                               lambda word: 5)
+                      for question in questions(args.repeat)]
+    translated = [pair for pair in translated if pair[0] is not None]
+
+    for label in ('literals', 'binds'):
+        with pool.statements() as statements:
+            connection = statements.connection
+            before = parseCounts(connection) if args.oracle else None
+            start = time.perf_counter()
+            if label == 'literals':
+                counts = runLiterals(connection, translated)
+            else:
+                counts = runBinds(statements, translated)
+            elapsed = time.perf_counter() - start
+            if args.oracle:
+                after = parseCounts(connection)
+                counts = dict((name, after[name] - before[name])
+                              for name in after)
+        print("%-8s %6d queries  %.3fs  %s"
+              % (label, len(translated), elapsed, counts))
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
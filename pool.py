@@ -0,0 +1,382 @@
+#
+# Natural Language Interface to Databases
+#       Connection Pool
+#
+# Keeps database sessions open between queries instead of
+# reconnecting on every run of main().
+#
+# A backend is any object with the small DB-API facing interface
+# used below:
+#   connect()             open a new DB-API connection
+#   ping(connection)      raise databaseError if the session is dead
+#   loadCatalog(curs, owner)
+#                         table dictionary for catalog.SchemaCatalog,
+#                         of the session's own schema if owner is None
+#   databaseError         exception class raised by the driver
+#   isDuplicate(exception)
+#                         true if a databaseError is a unique
+#                         constraint violation
+#   snapshotPath          schema catalog snapshot location, or None
+#   nextLogId             SQL expression giving the next Log.LogID
+#   rowVersion            pseudo column that grows when a row is
+#                         written, or None
+#   explain(curs, sql, binds)
+#                         execution plan as guard.PlanStep list
+#   timeLimit(connection, seconds)
+#                         context manager cutting statements off;
+#                         yields a function returning a context
+#                         manager whose time does not count
+#
+# OracleBackend talks to the real database through cx_Oracle.
+# SqliteBackend is a local stand-in loaded from "ORACLE SCRIPT.SQL"
+# so the pool (and everything above it) can be exercised and
+# benchmarked without Oracle.
+import collections
+import contextlib
+import itertools
+import sqlite3
+import threading
+import time
+
+import catalog
+import guard
+import standin
+from statementcache import StatementCache
+
+
+# Oracle's call timeout is per round trip, so time between calls
+# never counts against it
+@contextlib.contextmanager
+def untimed():
+    yield
+#
+#                   ORACLE BACKEND
+# cx_Oracle is imported on first connect so that the SQLite
+# stand-in works on hosts without the Oracle client.
+#
+# @param username STRING
+# @param password STRING
+# @param dsn STRING optional connect string, local instance if None
+#
+
+
+class OracleBackend(object):
+
+    snapshotPath = catalog.defaultSnapshotPath
+    nextLogId = 'Log_Seq.NEXTVAL'
+    rowVersion = 'ORA_ROWSCN'
+
+    def __init__(self, username, password, dsn=None):
+        self.username = username
+        self.password = password
+        self.dsn = dsn
+
+    @property
+    def driver(self):
+        import cx_Oracle
+        return cx_Oracle
+
+    @property
+    def databaseError(self):
+        return self.driver.DatabaseError
+
+    def connect(self):
+        if self.dsn:
+            connection = self.driver.connect(self.username, self.password,
+                                             self.dsn)
+        else:
+            connection = self.driver.connect(self.username, self.password)
+        # Session-level OCI statement cache, on top of StatementCache
+        connection.stmtcachesize = 50
+        return connection
+
+    def ping(self, connection):
+        connection.ping()
+
+    def loadCatalog(self, curs, owner=None):
+        return catalog.loadOracleCatalog(curs, owner or self.username)
+
+    # ORA-00001: unique constraint violated
+    def isDuplicate(self, exception):
+        error = exception.args[0] if exception.args else None
+        return getattr(error, 'code', None) == 1
+
+    def explain(self, curs, sql, binds):
+        return guard.explainOracle(curs, sql, binds)
+
+    # Call timeout of the session, in milliseconds (cx_Oracle 7.2)
+    @contextlib.contextmanager
+    def timeLimit(self, connection, seconds):
+        connection.callTimeout = int(seconds * 1000)
+        try:
+            yield untimed
+        finally:
+            connection.callTimeout = 0
+#
+#                   SQLITE BACKEND
+# Every connection shares one named in-memory database, which is
+# created from the Oracle script by the first connection and
+# kept alive by it for the lifetime of the backend.
+#
+# @param name STRING name of the shared in-memory database
+# @param scriptPath STRING Oracle script used to build the schema
+#
+
+
+class SqliteBackend(object):
+
+    databaseError = sqlite3.DatabaseError
+    snapshotPath = None
+    # No sequences in SQLite; writes are serialised so max + 1 is safe
+    nextLogId = '(SELECT coalesce(max(LogID), 0) + 1 FROM Log)'
+    rowVersion = None
+    instanceCounter = itertools.count()
+
+    def __init__(self, name=None, scriptPath=standin.defaultScriptPath):
+        if name is None:
+            name = 'nli_standin_%d' % next(self.instanceCounter)
+        self.uri = 'file:%s?mode=memory&cache=shared' % name
+        self.scriptPath = scriptPath
+        self.anchor = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        with self.lock:
+            if self.anchor is None:
+                self.anchor = self.openConnection()
+                standin.loadOracleScript(self.anchor, self.scriptPath)
+        return self.openConnection()
+
+    def openConnection(self):
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def ping(self, connection):
+        connection.execute('SELECT 1').fetchone()
+
+    # The stand-in holds a single schema, whatever the owner
+    def loadCatalog(self, curs, owner=None):
+        return catalog.loadSqliteCatalog(curs)
+
+    def isDuplicate(self, exception):
+        return isinstance(exception, sqlite3.IntegrityError) and \
+            str(exception).startswith('UNIQUE constraint failed')
+
+    def explain(self, curs, sql, binds):
+        return guard.explainSqlite(curs, sql, binds)
+
+    # The progress handler interrupts the statement once it returns
+    # true, which raises OperationalError. The deadline moves on by
+    # the time spent paused.
+    @contextlib.contextmanager
+    def timeLimit(self, connection, seconds):
+        deadline = [time.time() + seconds]
+
+        @contextlib.contextmanager
+        def paused():
+            start = time.time()
+            try:
+                yield
+            finally:
+                deadline[0] += time.time() - start
+        connection.set_progress_handler(lambda: time.time() > deadline[0],
+                                        10000)
+        try:
+            yield paused
+        finally:
+            connection.set_progress_handler(None, 10000)
+
+    def close(self):
+        with self.lock:
+            if self.anchor is not None:
+                self.anchor.close()
+                self.anchor = None
+#
+#                   CONNECTION POOL
+# Thread-safe pool of backend connections.
+#
+# minSessions connections are opened up front. Up to maxSessions
+# are opened on demand; beyond that acquire() waits for a release.
+# A connection idle for longer than healthCheckInterval seconds
+# is pinged before being handed out and replaced if it is dead.
+# Functions in writeListeners are called with the name of every
+# table written through statements().
+#
+# @param backend OracleBackend or SqliteBackend
+# @param minSessions INT sessions opened at start-up
+# @param maxSessions INT hard limit on open sessions
+# @param healthCheckInterval NUMBER idle seconds before a ping
+# @param acquireTimeout NUMBER seconds to wait for a session, or None
+# @param statementCacheSize INT prepared cursors kept per session
+#
+# @exception PoolExhausted no session freed up within acquireTimeout
+#
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool(object):
+
+    def __init__(self, backend, minSessions=1, maxSessions=4,
+                 healthCheckInterval=30, acquireTimeout=None,
+                 statementCacheSize=50):
+        if minSessions > maxSessions:
+            raise ValueError("minSessions cannot exceed maxSessions")
+        self.backend = backend
+        self.minSessions = minSessions
+        self.maxSessions = maxSessions
+        self.healthCheckInterval = healthCheckInterval
+        self.acquireTimeout = acquireTimeout
+        self.statementCacheSize = statementCacheSize
+        self.statementCaches = {}
+        self.writeListeners = []
+        self.idle = collections.deque()
+        self.opened = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'waits': 0}
+        for i in range(minSessions):
+            self.idle.append((backend.connect(), time.time()))
+            self.opened += 1
+            self.stats['created'] += 1
+
+    def acquire(self):
+        deadline = None
+        if self.acquireTimeout is not None:
+            deadline = time.time() + self.acquireTimeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise PoolExhausted("Connection pool is closed")
+                if self.idle:
+                    connection, lastUsed = self.idle.pop()
+                    break
+                if self.opened < self.maxSessions:
+                    self.opened += 1
+                    connection, lastUsed = None, None
+                    break
+                self.stats['waits'] += 1
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhausted("No database session available")
+                self.condition.wait(remaining)
+
+        # Connecting and pinging happen outside the lock
+        try:
+            if connection is None:
+                connection = self.backend.connect()
+                self.stats['created'] += 1
+            elif time.time() - lastUsed > self.healthCheckInterval:
+                connection = self.checkHealth(connection)
+            else:
+                self.stats['reused'] += 1
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+        return connection
+
+    def checkHealth(self, connection):
+        try:
+            self.backend.ping(connection)
+            self.stats['reused'] += 1
+            return connection
+        except self.backend.databaseError:
+            self.stats['discarded'] += 1
+            self.dropStatements(connection)
+            self.closeQuietly(connection)
+            connection = self.backend.connect()
+            self.stats['created'] += 1
+            return connection
+
+    # Broken connections are closed rather than returned to the pool
+    def release(self, connection, broken=False):
+        with self.condition:
+            if broken or self.closed:
+                self.opened -= 1
+                self.stats['discarded'] += 1
+                self.dropStatements(connection)
+                self.closeQuietly(connection)
+            else:
+                self.idle.append((connection, time.time()))
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def session(self):
+        connection = self.acquire()
+        broken = False
+        try:
+            yield connection
+        except self.backend.databaseError:
+            broken = not self.isAlive(connection)
+            raise
+        finally:
+            self.release(connection, broken)
+
+    # Cursor checkout for a single request
+    @contextlib.contextmanager
+    def cursor(self):
+        with self.session() as connection:
+            curs = connection.cursor()
+            try:
+                yield curs
+            finally:
+                curs.close()
+
+    # Checkout of a session's prepared statement cache
+    @contextlib.contextmanager
+    def statements(self):
+        with self.session() as connection:
+            with self.condition:
+                cache = self.statementCaches.get(id(connection))
+                if cache is None:
+                    cache = StatementCache(connection,
+                                           self.statementCacheSize,
+                                           self.tableWritten)
+                    self.statementCaches[id(connection)] = cache
+            yield cache
+
+    def tableWritten(self, table):
+        for listener in self.writeListeners:
+            listener(table)
+
+    def dropStatements(self, connection):
+        cache = self.statementCaches.pop(id(connection), None)
+        if cache is not None:
+            cache.close()
+
+    def statementStats(self):
+        with self.condition:
+            caches = list(self.statementCaches.values())
+        totals = {'executions': 0, 'prepares': 0, 'evictions': 0}
+        for cache in caches:
+            for key in totals:
+                totals[key] += cache.stats[key]
+        return totals
+
+    def isAlive(self, connection):
+        try:
+            self.backend.ping(connection)
+            return True
+        except Exception:
+            return False
+
+    def closeQuietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                connection, lastUsed = self.idle.pop()
+                self.opened -= 1
+                self.dropStatements(connection)
+                self.closeQuietly(connection)
+            self.condition.notify_all()
@@ -0,0 +1,74 @@
+#
+# Natural Language Interface to Databases
+#       Connection Pool Benchmark
+#
+# Compares opening a connection per query (the old main() flow)
+# against checking cursors out of the pool. Runs on the SQLite
+# stand-in by default so no Oracle instance is needed.
+#
+# Usage: python poolbench.py [--queries N] [--threads N] [--oracle]
+import argparse
+import threading
+import time
+
+from pool import ConnectionPool, OracleBackend, SqliteBackend
+
+benchQuery = "SELECT max(salary) FROM employees"
+
+
+def reconnectEachTime(backend, queries):
+    for i in range(queries):
+        connection = backend.connect()
+        curs = connection.cursor()
+        curs.execute(benchQuery)
+        curs.fetchall()
+        curs.close()
+        connection.close()
+
+
+def pooled(pool, queries):
+    for i in range(queries):
+        with pool.cursor() as curs:
+            curs.execute(benchQuery)
+            curs.fetchall()
+
+
+def runThreads(target, threads, *args):
+    workers = [threading.Thread(target=target, args=args)
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=2000,
+                        help='queries per thread')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--oracle', action='store_true',
+                        help='benchmark the Oracle backend instead')
+    args = parser.parse_args()
+
+    if args.oracle:
+        backend = OracleBackend('SYSTEM', 'x')
+    else:
+        backend = SqliteBackend()
+    pool = ConnectionPool(backend, minSessions=args.threads,
+                          maxSessions=args.threads)
+    total = args.queries * args.threads
+
+    elapsed = runThreads(reconnectEachTime, args.threads, backend,
+                         args.queries)
+    print("reconnect per query: %8.0f queries/s" % (total / elapsed))
+    elapsed = runThreads(pooled, args.threads, pool, args.queries)
+    print("pooled sessions:     %8.0f queries/s" % (total / elapsed))
+    print("pool stats: %s" % pool.stats)
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#
+# Natural Language Interface to Databases
+#       Query IR
+#
+# Intermediate representation of a generated SELECT. Query
+# generation fills in the parts (select list, FROM and joins,
+# predicates, grouping and ordering) and the SQL text is rendered
+# once, in a single join, at the end.
+#
+# The IR can be reduced to a canonical tuple:
+#   shapeKey()  structure only, bind values left out
+#   key()       structure plus bind values
+# Both are hashable, so caches can be keyed on the query itself
+# rather than on its text.
+orderDirections = {'ASC': 'ASC', 'DSC': 'DESC', 'DESC': 'DESC'}
+#
+#                   JOIN
+# @param table STRING table being joined
+# @param leftTable STRING table already in the FROM clause
+# @param leftColumn STRING join column on leftTable
+# @param rightColumn STRING join column on table
+# @param natural BOOLEAN NATURAL JOIN, no ON clause
+#
+
+
+class Join(object):
+
+    def __init__(self, table, leftTable=None, leftColumn=None,
+                 rightColumn=None, natural=False):
+        self.table = table
+        self.leftTable = leftTable
+        self.leftColumn = leftColumn
+        self.rightColumn = rightColumn
+        self.natural = natural
+
+    def render(self):
+        if self.natural:
+            return 'NATURAL JOIN %s' % self.table
+        return 'JOIN %s ON %s.%s = %s.%s' % (
+            self.table, self.leftTable, self.leftColumn, self.table,
+            self.rightColumn)
+
+    def canonical(self):
+        return (self.table.lower(), (self.leftTable or '').lower(),
+                (self.leftColumn or '').lower(),
+                (self.rightColumn or '').lower(), self.natural)
+#
+#                   PREDICATE
+# column operator :bind, or column BETWEEN :low AND :high
+#
+# @param column STRING
+# @param operator STRING =, <, >, <=, >= or BETWEEN
+# @param bindNames LIST one bind name, two for BETWEEN
+#
+
+
+class Predicate(object):
+
+    def __init__(self, column, operator, bindNames):
+        self.column = column
+        self.operator = operator
+        self.bindNames = list(bindNames)
+
+    def render(self):
+        if self.operator == 'BETWEEN':
+            return '%s BETWEEN :%s AND :%s' % (self.column, self.bindNames[0],
+                                               self.bindNames[1])
+        return '%s %s :%s' % (self.column, self.operator, self.bindNames[0])
+
+    def canonical(self):
+        return (self.column.lower(), self.operator, tuple(self.bindNames))
+#
+#                   QUERY
+#
+
+
+class Query(object):
+
+    def __init__(self):
+        self.aggregate = None
+        self.columns = []
+        self.source = None
+        self.joins = []
+        self.predicates = []
+        self.groupBy = []
+        self.orderBy = []
+        self.binds = {}
+
+    # Adds a literal as a bind variable, returning its name
+    def bind(self, value):
+        name = 'v%d' % len(self.binds)
+        if isinstance(value, str) and value.isdigit():
+            value = int(value)
+        self.binds[name] = value
+        return name
+
+    def hasTable(self, table):
+        return table.lower() in self.tables()
+
+    def tables(self):
+        tables = []
+        if self.source:
+            tables.append(self.source.lower())
+        tables.extend(join.table.lower() for join in self.joins)
+        return tables
+
+    def addJoin(self, join):
+        self.joins.append(join)
+
+    def addPredicate(self, column, operator, *values):
+        self.predicates.append(Predicate(
+            column, operator, [self.bind(value) for value in values]))
+    #
+    #               RENDER
+    # Only count can be applied to * when no column was found for
+    # the aggregate; any other aggregate makes no query.
+    #
+    # @return sql STRING, or None
+    # @return binds DICT bind name -> value, or None
+    #
+
+    def render(self):
+        selectList = list(self.columns)
+        if self.aggregate:
+            if selectList:
+                selectList[0] = '%s(%s)' % (self.aggregate, selectList[0])
+            elif self.aggregate.lower() == 'count':
+                selectList = ['%s(*)' % self.aggregate]
+            else:
+                return None, None
+        parts = ['SELECT ', ', '.join(selectList) or '*',
+                 ' FROM ', self.source]
+        for join in self.joins:
+            parts.append(' ')
+            parts.append(join.render())
+        if self.predicates:
+            parts.append(' WHERE ')
+            parts.append(' AND '.join(predicate.render()
+                                      for predicate in self.predicates))
+        if self.groupBy:
+            parts.append(' GROUP BY ')
+            parts.append(', '.join(self.groupBy))
+        if self.orderBy:
+            parts.append(' ORDER BY ')
+            parts.append(', '.join('%s %s' % (column, orderDirections.get(
+                direction.upper(), direction)) for column, direction
+                in self.orderBy))
+        return ''.join(parts), dict(self.binds)
+    #
+    #               CANONICAL FORM
+    # Names are lower-cased and predicates sorted, so queries that
+    # differ only in case or predicate order compare equal.
+    #
+
+    def shapeKey(self):
+        return ((self.aggregate or '').lower(),
+                tuple(column.lower() for column in self.columns),
+                (self.source or '').lower(),
+                tuple(join.canonical() for join in self.joins),
+                tuple(sorted(predicate.canonical()
+                             for predicate in self.predicates)),
+                tuple(column.lower() for column in self.groupBy),
+                tuple((column.lower(), orderDirections.get(
+                    direction.upper(), direction))
+                    for column, direction in self.orderBy))
+
+    def key(self):
+        return (self.shapeKey(),
+                tuple(sorted((name, repr(value))
+                             for name, value in self.binds.items())))
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    # Same query with different bind values
+    def withBinds(self, binds):
+        query = Query.fromDict(self.toDict())
+        query.binds = dict(binds)
+        return query
+    #
+    #               SERIALISATION
+    # Plain dict form for JSON persistence.
+    #
+
+    def toDict(self):
+        return {'aggregate': self.aggregate, 'columns': list(self.columns),
+                'source': self.source,
+                'joins': [[join.table, join.leftTable, join.leftColumn,
+                           join.rightColumn, join.natural]
+                          for join in self.joins],
+                'predicates': [[predicate.column, predicate.operator,
+                                predicate.bindNames]
+                               for predicate in self.predicates],
+                'groupBy': list(self.groupBy),
+                'orderBy': [list(order) for order in self.orderBy],
+                'binds': dict(self.binds)}
+
+    @classmethod
+    def fromDict(cls, data):
+        query = cls()
+        query.aggregate = data['aggregate']
+        query.columns = list(data['columns'])
+        query.source = data['source']
+        query.joins = [Join(*join) for join in data['joins']]
+        query.predicates = [Predicate(*predicate)
+                            for predicate in data['predicates']]
+        query.groupBy = list(data['groupBy'])
+        query.orderBy = [tuple(order) for order in data['orderBy']]
+        query.binds = dict(data['binds'])
+        return query
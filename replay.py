@@ -0,0 +1,193 @@
+#
+# Natural Language Interface to Databases
+#       Log Replay
+#
+# Replays the Log table as a regression and throughput test. Log
+# rows are streamed out of the database in fetchmany chunks, each
+# OrigInput is translated again on the batch process pool, and
+# the new SQL (with its literals written in, as it is logged) is
+# compared with QueryRan. With --execute both queries are run and
+# their result sets compared as well.
+#
+# Results are reported per UserConf value: for questions users
+# confirmed ("y") a mismatch is a likely regression; for rejected
+# ones ("n") it may be a fix.
+#
+# Usage:
+#   python replay.py --sqlite --source log.jsonl --execute
+#   python replay.py --workers 8 --diffs mismatches.jsonl
+import argparse
+import collections
+import json
+import multiprocessing
+import re
+import sys
+import time
+
+import batch
+import implementation
+from pool import SqliteBackend
+from resultstream import streamRows
+from statementcache import inlineBinds
+
+logQuery = ("SELECT LogID, OrigInput, QueryRan, UserConf FROM Log "
+            "ORDER BY LogID")
+spaceFind = re.compile(r'\s+')
+
+
+def canonicalSql(sql):
+    return spaceFind.sub(' ', sql or '').strip().lower()
+#
+#                   SOURCES
+# Log rows as {'id', 'question', 'queryRan', 'userConf'} records,
+# from the database or from a JSON lines export of the table.
+#
+
+
+def readLog(pool, fetchSize=500):
+    with pool.cursor() as curs:
+        curs.execute(logQuery)
+        for logId, origInput, queryRan, userConf in streamRows(curs,
+                                                               fetchSize):
+            yield {'id': logId, 'question': origInput, 'queryRan': queryRan,
+                   'userConf': (userConf or '').strip().lower()}
+
+
+def readLogFile(path):
+    with open(path) as handle:
+        for line in handle:
+            if line.strip():
+                row = dict((key.lower(), value)
+                           for key, value in json.loads(line).items())
+                yield {'id': row.get('logid'), 'question': row['originput'],
+                       'queryRan': row['queryran'],
+                       'userConf': (row.get('userconf') or
+                                    '').strip().lower()}
+#
+#                   REPLAY RECORD
+# Runs in the batch workers.
+#
+# @param record DICT Log row
+#
+# @return DICT translation result with the comparison added
+#
+
+
+def replayRecord(record):
+    result = batch.translateRecord(record)
+    result['userConf'] = record['userConf']
+    result['queryRan'] = record['queryRan']
+    replayed = (inlineBinds(result['sql'], result['binds'])
+                if result['sql'] else None)
+    result['replayed'] = replayed
+    result['sqlMatch'] = (canonicalSql(replayed) ==
+                          canonicalSql(record['queryRan']))
+    # translateRecord has already run the replayed query
+    if 'rows' in result:
+        result['resultMatch'] = sameRows(result.pop('rows'),
+                                         record['queryRan'],
+                                         batch.worker['maxRows'])
+    result.pop('rows', None)
+    result.pop('columns', None)
+    return result
+
+
+def sameRows(rows, queryRan, maxRows):
+    try:
+        with batch.worker['pool'].statements() as statements:
+            expected = statements.execute(queryRan).fetchmany(maxRows)
+    except Exception:
+        return False
+    return (sorted(repr(tuple(row)) for row in rows) ==
+            sorted(repr(tuple(row)) for row in expected))
+#
+#                   REPORT
+# @return DICT totals overall and per UserConf
+#
+
+
+class ReplayReport(object):
+
+    def __init__(self):
+        self.groups = collections.defaultdict(collections.Counter)
+        self.start = time.perf_counter()
+
+    def add(self, result):
+        for group in ('all', result['userConf'] or '?'):
+            counts = self.groups[group]
+            counts['total'] += 1
+            counts['sqlMatch'] += bool(result['sqlMatch'])
+            counts['failed'] += result['sql'] is None
+            counts['unresolved'] += bool(result['unresolved'])
+            if 'resultMatch' in result:
+                counts['executed'] += 1
+                counts['resultMatch'] += bool(result['resultMatch'])
+
+    def toDict(self):
+        seconds = time.perf_counter() - self.start
+        groups = {}
+        for group, counts in self.groups.items():
+            summary = dict(counts)
+            summary['sqlMatchRate'] = counts['sqlMatch'] / float(
+                counts['total'])
+            if counts['executed']:
+                summary['resultMatchRate'] = counts['resultMatch'] / float(
+                    counts['executed'])
+            groups[group] = summary
+        total = self.groups['all']['total']
+        return {'replayed': total, 'seconds': round(seconds, 3),
+                'perSecond': round(total / seconds, 1) if seconds else 0.0,
+                'byUserConf': groups}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the Log table '
+                                     'through the current pipeline')
+    parser.add_argument('--source', help='JSON lines export of the Log '
+                        'table instead of reading it from the database')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='use the SQLite stand-in instead of Oracle')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='worker processes, 0 to run in-process')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--fetch-size', type=int, default=500,
+                        help='Log rows fetched per round trip')
+    parser.add_argument('--execute', action='store_true',
+                        help='run both queries and compare result sets')
+    parser.add_argument('--max-rows', type=int, default=1000,
+                        help='rows compared per query with --execute')
+    parser.add_argument('--diffs', help='write mismatches to this '
+                        'JSON lines file')
+    args = parser.parse_args()
+
+    pool = None
+    if args.source:
+        records = readLogFile(args.source)
+    else:
+        backend = SqliteBackend() if args.sqlite else None
+        pool, catalog = implementation.databaseConnection(backend)
+        records = readLog(pool, args.fetch_size)
+
+    report = ReplayReport()
+    diffs = open(args.diffs, 'w') if args.diffs else None
+    try:
+        for result in batch.mapRecords(replayRecord, records, args.workers,
+                                       args.chunk_size,
+                                       (args.sqlite, args.execute,
+                                        args.max_rows)):
+            report.add(result)
+            if diffs and not (result['sqlMatch'] and
+                              result.get('resultMatch', True)):
+                batch.writeResult(diffs, result)
+    finally:
+        if diffs:
+            diffs.close()
+        if pool is not None:
+            pool.close()
+    print(json.dumps(report.toDict(), indent=1, sort_keys=True),
+          file=sys.__stdout__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#
+# Natural Language Interface to Databases
+#       Local Replica
+#
+# In-process read replica of the HR tables. The schema is built
+# in an in-memory SQLite database from the CREATE TABLE
+# statements of "ORACLE SCRIPT.SQL" (through the stand-in's
+# translation), and the rows are copied from the primary
+# database through the pool, so generated SELECTs, aggregates and
+# GROUP BYs included, run in process without a round trip.
+#
+# Refresh is incremental:
+#   Oracle        rows whose ORA_ROWSCN moved past the highest one
+#                 copied (inserts and updates), written over the
+#                 local row with the same primary key
+#   other         rows whose primary key is above the highest one
+#                 copied (inserts only)
+#   no key        (Job_History) the whole table is copied again
+# Deletes, and updates on backends without row versions, are only
+# picked up by copying the whole table, which happens on reload()
+# and for any table written through a watched pool.
+#
+# The replica declines queries it should not answer: anything but
+# a SELECT, queries on tables it does not hold (the Log table is
+# never replicated, it changes with every question), and queries
+# on DATE columns, which SQLite compares as text.
+#
+# @see standin
+import contextlib
+import re
+import sqlite3
+import threading
+import time
+
+import instrumentation
+import standin
+from catalog import loadSqliteCatalog
+from resultcache import tablesRead
+from statementcache import StatementCache
+
+replicatedTables = ('Jobs', 'Locations', 'Employees', 'Job_History',
+                    'Departments')
+wordFind = re.compile(r'\w+')
+plainTypes = (int, float, str, bytes, type(None))
+
+
+# Driver values SQLite cannot bind (dates, decimals) are stored as text
+def localValue(value):
+    return value if isinstance(value, plainTypes) else str(value)
+#
+#                   LOCAL REPLICA
+# @param pool ConnectionPool of the primary database
+# @param tables TUPLE of table names to replicate
+# @param refreshInterval NUMBER seconds between incremental
+#                        refreshes, None to only refresh on demand
+# @param scriptPath STRING Oracle script the schema is built from
+#
+
+
+class LocalReplica(object):
+
+    def __init__(self, pool, tables=replicatedTables, refreshInterval=30,
+                 scriptPath=standin.defaultScriptPath):
+        self.pool = pool
+        self.refreshInterval = refreshInterval
+        self.rowVersion = getattr(pool.backend, 'rowVersion', None)
+        self.connection = sqlite3.connect(':memory:',
+                                          check_same_thread=False)
+        wanted = set(table.upper() for table in tables)
+        curs = self.connection.cursor()
+        for statement in standin.translateScript(
+                standin.readScript(scriptPath)):
+            create = standin.createFind.match(statement)
+            if create and create.group(1).upper() in wanted:
+                curs.execute(statement)
+        schema = loadSqliteCatalog(curs)
+        curs.close()
+        self.tables = dict((name.lower(), table)
+                           for name, table in schema.items())
+        self.keys = dict((name, table['primaryKey'][0]
+                          if len(table['primaryKey']) == 1 else None)
+                         for name, table in self.tables.items())
+        self.dateColumns = set(column.lower()
+                               for table in self.tables.values()
+                               for column, (dataType, nullable)
+                               in table['columns'].items()
+                               if dataType == 'DATE')
+        self.statementCache = StatementCache(self.connection)
+        self.highWater = {}
+        self.dirty = set()
+        self.refreshedAt = None
+        self.lock = threading.Lock()
+        self.refreshing = threading.Lock()
+        self.stats = {'local': 0, 'declined': 0, 'reloads': 0,
+                      'refreshes': 0, 'rowsCopied': 0}
+
+    # Replica loaded from the pool's database
+    @classmethod
+    def fromPool(cls, pool, tables=replicatedTables, refreshInterval=30):
+        replica = cls(pool, tables, refreshInterval)
+        replica.reload()
+        return replica
+
+    # Tables written through pool.statements() are copied again
+    # before the next local query
+    def watch(self):
+        self.pool.writeListeners.append(self.tableWritten)
+        return self
+
+    def tableWritten(self, table):
+        if table in self.tables:
+            with self.lock:
+                self.dirty.add(table)
+
+    def reload(self):
+        self.stats['reloads'] += 1
+        self.update(set(self.tables))
+
+    def refresh(self):
+        self.stats['refreshes'] += 1
+        with self.lock:
+            full = set(self.dirty)
+            self.dirty.clear()
+        full.update(table for table in self.tables
+                    if self.keys[table] is None)
+        self.update(full)
+
+    def isStale(self):
+        return bool(self.dirty) or (
+            self.refreshInterval is not None and
+            time.time() - self.refreshedAt > self.refreshInterval)
+    #
+    #               UPDATE
+    # Reads from the primary without holding the lock, so local
+    # queries carry on meanwhile, then applies the rows under it.
+    #
+    # @param full SET of tables to copy whole; the rest get their
+    #             changes since the last copy
+    #
+
+    def update(self, full):
+        changes = []
+        with instrumentation.timer('db.replicaRefresh'):
+            with self.pool.cursor() as curs:
+                for table in self.tables:
+                    changes.append(self.read(curs, table, table in full))
+        with self.lock:
+            for table, whole, columns, rows, highWater in changes:
+                self.apply(table, whole, columns, rows)
+                self.highWater[table] = highWater
+                self.stats['rowsCopied'] += len(rows)
+            self.connection.commit()
+            self.refreshedAt = time.time()
+
+    # @return table, whole, columns, rows, new high-water mark
+    def read(self, curs, table, whole):
+        key = self.keys[table]
+        after = self.highWater.get(table)
+        if self.rowVersion and key:
+            sql = 'SELECT %s, t.* FROM %s t' % (self.rowVersion, table)
+        else:
+            sql = 'SELECT * FROM %s' % table
+        if not whole and key and after is not None:
+            sql += ' WHERE %s > :after' % (self.rowVersion or key)
+            curs.execute(sql, {'after': after})
+        else:
+            whole = True
+            curs.execute(sql)
+        columns = [column[0] for column in curs.description]
+        rows = curs.fetchall()
+        if not key:
+            return table, whole, columns, rows, None
+        if self.rowVersion:
+            versions = [row[0] for row in rows]
+            columns = columns[1:]
+            rows = [row[1:] for row in rows]
+        else:
+            position = [column.upper() for column in columns].index(key)
+            versions = [row[position] for row in rows]
+        if not whole:
+            versions.append(after)
+        highWater = max(versions) if versions else None
+        return table, whole, columns, rows, highWater
+
+    # Caller holds the lock
+    def apply(self, table, whole, columns, rows):
+        curs = self.connection.cursor()
+        if whole:
+            curs.execute('DELETE FROM %s' % table)
+        curs.executemany('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+            table, ', '.join(columns), ', '.join('?' * len(columns))),
+            [[localValue(value) for value in row] for row in rows])
+        curs.close()
+    #
+    #               ACCEPTS
+    # @param sql STRING generated query
+    #
+    # @return BOOLEAN whether the replica can answer it
+    #
+
+    def accepts(self, sql):
+        words = set(word.lower() for word in wordFind.findall(sql))
+        tables = tablesRead(sql)
+        accepted = (sql.lstrip()[:6].upper() == 'SELECT' and tables and
+                    all(table in self.tables for table in tables) and
+                    not words & self.dateColumns)
+        self.stats['local' if accepted else 'declined'] += 1
+        instrumentation.count('replica.local' if accepted
+                              else 'replica.declined')
+        return accepted
+
+    # Checkout of the replica's statement cache, used in place of
+    # pool.statements(). A stale replica is refreshed first, by one
+    # caller; the others read the rows already there meanwhile.
+    @contextlib.contextmanager
+    def statements(self):
+        if self.isStale() and self.refreshing.acquire(False):
+            try:
+                self.refresh()
+            finally:
+                self.refreshing.release()
+        with self.lock:
+            yield self.statementCache
+
+    def report(self):
+        stats = dict(self.stats)
+        stats['tables'] = sorted(self.tables)
+        stats['highWater'] = dict(self.highWater)
+        stats['lag'] = time.time() - self.refreshedAt
+        return stats
+
+    def close(self):
+        self.statementCache.close()
+        self.connection.close()
@@ -0,0 +1,236 @@
+#
+# Natural Language Interface to Databases
+#       Result Cache
+#
+# Cache of query results in front of queryExec, keyed on the
+# final SQL text and its bind values. The HR tables change
+# rarely, so a repeated question ("highest salary", "average
+# salary by department") is answered from memory instead of
+# running the query again.
+#
+# Invalidation is per table. Every table has a version stamp;
+# an entry remembers the stamps of the tables its query reads,
+# and is dropped when any of them has moved on. Writes made
+# through a watched pool's statement caches bump the stamp of
+# the table written, so an UPDATE on Employees drops only the
+# entries that read Employees. Writes made by other clients are
+# not seen; they are covered by the time to live, and by calling
+# invalidate() from whatever made them.
+#
+# Only complete results of at most maxRows rows are stored, and
+# the whole cache is bounded by entry count and by approximate
+# bytes held, least recently used first out.
+import collections
+import re
+import sys
+import threading
+import time
+
+import instrumentation
+
+tableFind = re.compile(r'\b(?:from|join)\s+(\w+(?:\s*,\s*\w+)*)', re.I)
+
+
+# @return FROZENSET of lowercase table names a query reads
+def tablesRead(sql):
+    tables = set()
+    for names in tableFind.findall(sql):
+        tables.update(name.strip().lower() for name in names.split(','))
+    return frozenset(tables)
+#
+#                   CACHED RESULT
+# @param columns LIST column names
+# @param rows LIST of row tuples
+# @param stamps TUPLE of (table, version) the result depends on
+# @param storedAt FLOAT time.time() it was cached
+# @param size INT approximate bytes held
+#
+CachedResult = collections.namedtuple('CachedResult', ['columns', 'rows',
+                                                       'stamps', 'storedAt',
+                                                       'size'])
+#
+#                   CACHED CURSOR
+# Cursor stand-in over rows already in memory, so streamResult and
+# the writers handle cached and live results the same way.
+#
+# @param columns LIST column names
+# @param rows LIST of row tuples
+#
+
+
+class CachedCursor(object):
+
+    def __init__(self, columns, rows):
+        self.description = [(column,) for column in columns]
+        self.rows = rows
+        self.position = 0
+        self.arraysize = 1
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows) - self.position)
+#
+#                   RECORDING WRITER
+# Passes rows through to the real writer and keeps a copy of up
+# to limit rows for the cache.
+#
+# @param writer the writer the rows are meant for
+# @param limit INT rows kept before giving up on caching
+#
+
+
+class RecordingWriter(object):
+
+    def __init__(self, writer, limit):
+        self.writer = writer
+        self.limit = limit
+        self.columns = None
+        self.rows = []
+        self.overflowed = False
+
+    def begin(self, columns):
+        self.columns = columns
+        self.writer.begin(columns)
+
+    def writeRow(self, row):
+        if not self.overflowed:
+            if len(self.rows) < self.limit:
+                self.rows.append(tuple(row))
+            else:
+                self.overflowed = True
+                self.rows = []
+        self.writer.writeRow(row)
+
+    def end(self):
+        self.writer.end()
+
+    @property
+    def stopped(self):
+        return getattr(self.writer, 'stopped', False)
+
+    @property
+    def bytesWritten(self):
+        return self.writer.bytesWritten
+#
+#                   RESULT CACHE
+# @param maxEntries INT results kept
+# @param maxBytes INT approximate bytes kept
+# @param maxRows INT largest result stored
+# @param ttl NUMBER seconds a result is trusted, None for no limit
+#
+
+
+class ResultCache(object):
+
+    def __init__(self, maxEntries=1000, maxBytes=16 * 1024 * 1024,
+                 maxRows=1000, ttl=300):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.maxRows = maxRows
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.versions = {}
+        self.bytesHeld = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0,
+                      'invalidated': 0, 'evictions': 0, 'tooLarge': 0}
+
+    # Invalidate on writes made through pool.statements()
+    def watch(self, pool):
+        pool.writeListeners.append(self.invalidate)
+        return self
+
+    def key(self, sql, binds):
+        return sql, tuple(sorted((binds or {}).items()))
+
+    def stamps(self, tables):
+        return tuple((table, self.versions.get(table, 0))
+                     for table in sorted(tables))
+    #
+    #               GET
+    # @return CachedResult, or None if missing, expired or stale
+    #
+
+    def get(self, sql, binds):
+        key = self.key(sql, binds)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                if self.ttl is not None and \
+                        time.time() - result.storedAt > self.ttl:
+                    self.stats['expired'] += 1
+                    self.drop(key)
+                    result = None
+                elif any(self.versions.get(table, 0) != version
+                         for table, version in result.stamps):
+                    self.stats['invalidated'] += 1
+                    self.drop(key)
+                    result = None
+                else:
+                    self.entries.move_to_end(key)
+            if result is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+        instrumentation.count('resultCache.miss' if result is None
+                              else 'resultCache.hit')
+        return result
+
+    # Stamps are taken before the query runs, so a write that lands
+    # while it runs leaves the entry already stale
+    def put(self, sql, binds, columns, rows, stamps):
+        if len(rows) > self.maxRows:
+            with self.lock:
+                self.stats['tooLarge'] += 1
+            return
+        size = (sys.getsizeof(sql) + sys.getsizeof(rows) +
+                sum(sys.getsizeof(row) + sum(sys.getsizeof(value)
+                                             for value in row)
+                    for row in rows))
+        key = self.key(sql, binds)
+        result = CachedResult(list(columns), [tuple(row) for row in rows],
+                              stamps, time.time(), size)
+        with self.lock:
+            self.drop(key)
+            self.entries[key] = result
+            self.bytesHeld += size
+            self.stats['stores'] += 1
+            while self.entries and (len(self.entries) > self.maxEntries or
+                                    self.bytesHeld > self.maxBytes):
+                self.drop(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    # Caller holds the lock
+    def drop(self, key):
+        result = self.entries.pop(key, None)
+        if result is not None:
+            self.bytesHeld -= result.size
+
+    def invalidate(self, *tables):
+        with self.lock:
+            for table in tables:
+                table = table.lower()
+                self.versions[table] = self.versions.get(table, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytesHeld = 0
+    # @return the stamps to store a result of sql under
+    def snapshot(self, sql):
+        with self.lock:
+            return self.stamps(tablesRead(sql))
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.bytesHeld
+        lookups = stats['hits'] + stats['misses']
+        stats['hitRate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,195 @@
+#
+# Natural Language Interface to Databases
+#       Result Streaming
+#
+# Moves query results out of the cursor in fetchmany batches of
+# a configurable size, so memory use stays constant however many
+# rows a query returns. Rows go to a writer:
+#
+#   PagedWriter   terminal output a page at a time
+#   CsvWriter     CSV file
+#   JsonlWriter   one JSON object per row
+#
+# streamResult reports rows, bytes written, elapsed time and rows
+# per second for every result.
+import csv
+import json
+import sys
+import time
+
+defaultFetchSize = 500
+#
+#                   FETCHING
+# @param curs executed cursor
+# @param fetchSize INT rows per round trip
+# @param maxRows INT stop after this many rows, None for all
+# @param paused function returning a context manager each batch is
+#               handed out under, so a time limit only counts the
+#               fetches; None for none
+#
+
+
+def streamRows(curs, fetchSize=defaultFetchSize, maxRows=None, paused=None):
+    curs.arraysize = fetchSize
+    remaining = maxRows
+    while remaining is None or remaining > 0:
+        size = fetchSize if remaining is None else min(fetchSize, remaining)
+        rows = curs.fetchmany(size)
+        if not rows:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        if paused is None:
+            for row in rows:
+                yield row
+        else:
+            with paused():
+                for row in rows:
+                    yield row
+#
+#                   WRITERS
+# Each writer takes the column names once, then rows, and keeps
+# a count of the bytes it has written.
+#
+
+
+class CountingFile(object):
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.bytesWritten = 0
+
+    def write(self, text):
+        self.bytesWritten += len(text.encode('utf-8'))
+        return self.handle.write(text)
+
+    def flush(self):
+        self.handle.flush()
+
+
+class CsvWriter(object):
+
+    def __init__(self, handle):
+        self.output = CountingFile(handle)
+        self.writer = csv.writer(self.output)
+
+    def begin(self, columns):
+        self.writer.writerow(columns)
+
+    def writeRow(self, row):
+        self.writer.writerow(row)
+
+    def end(self):
+        self.output.flush()
+
+    @property
+    def bytesWritten(self):
+        return self.output.bytesWritten
+
+
+class JsonlWriter(object):
+
+    def __init__(self, handle):
+        self.output = CountingFile(handle)
+        self.columns = None
+
+    def begin(self, columns):
+        self.columns = columns
+
+    def writeRow(self, row):
+        self.output.write(json.dumps(dict(zip(self.columns, row)),
+                                     default=str))
+        self.output.write('\n')
+
+    def end(self):
+        self.output.flush()
+
+    @property
+    def bytesWritten(self):
+        return self.output.bytesWritten
+#
+#                   PAGED WRITER
+# Prints rows to the terminal pageSize at a time and asks before
+# showing the next page. pageSize=None prints without pausing.
+#
+# @param pageSize INT rows per page, or None
+# @param handle file object, stdout by default
+# @param ask function returning the user's answer at a page break
+#
+
+
+class PagedWriter(object):
+
+    def __init__(self, pageSize=20, handle=None, ask=input):
+        self.output = CountingFile(handle or sys.stdout)
+        self.pageSize = pageSize
+        self.ask = ask
+        self.shown = 0
+        self.stopped = False
+
+    def begin(self, columns):
+        self.output.write('    '.join(columns) + '\n')
+
+    def writeRow(self, row):
+        if self.pageSize and self.shown and self.shown % self.pageSize == 0:
+            answer = self.ask('-- %d rows shown, Enter for more, '
+                              'q to stop -- ' % self.shown)
+            if answer.strip().lower().startswith('q'):
+                self.stopped = True
+                return
+        self.output.write('%s\n' % (tuple(row),))
+        self.shown += 1
+
+    def end(self):
+        self.output.flush()
+
+    @property
+    def bytesWritten(self):
+        return self.output.bytesWritten
+#
+#                   FILE WRITER
+# Opened once per session; every result is appended after the
+# previous one, with its own header.
+#
+# @param path STRING .csv for CSV, anything else for JSON lines
+#
+# @return writer, and the file handle the caller closes
+#
+
+
+def writerFor(path):
+    handle = open(path, 'w', newline='')
+    if path.lower().endswith('.csv'):
+        return CsvWriter(handle), handle
+    return JsonlWriter(handle), handle
+#
+#                   STREAM RESULT
+# Streams an executed cursor into a writer.
+#
+# @param curs executed cursor
+# @param writer CsvWriter, JsonlWriter or PagedWriter
+# @param fetchSize INT rows per fetchmany
+# @param maxRows INT first-N-rows limit, None for all rows
+# @param paused see streamRows
+#
+# @return stats DICT rows, bytes, seconds, rowsPerSecond
+#
+
+
+def streamResult(curs, writer, fetchSize=defaultFetchSize, maxRows=None,
+                 paused=None):
+    start = time.perf_counter()
+    # A session's file writer has counted the earlier results too
+    startBytes = writer.bytesWritten
+    writer.begin([column[0] for column in curs.description])
+    rowCount = 0
+    for row in streamRows(curs, fetchSize, maxRows, paused):
+        writer.writeRow(row)
+        if getattr(writer, 'stopped', False):
+            break
+        rowCount += 1
+    writer.end()
+    seconds = time.perf_counter() - start
+    return {'rows': rowCount, 'bytes': writer.bytesWritten - startBytes,
+            'seconds': seconds,
+            'rowsPerSecond': rowCount / seconds if seconds else 0.0}
@@ -0,0 +1,431 @@
+#
+# Natural Language Interface to Databases
+#       Adaptive Rollups
+#
+# Precomputed aggregates for the aggregate questions asked most.
+#
+# The Log table is read to find the hot aggregate shapes. Log
+# keeps one row per question and counts its repeats in Hits; the
+# logged queries are grouped by their text with the literals
+# taken out, so "average salary in London" and "average salary in
+# Leeds" are one shape, avg(salary) over Employees, Departments
+# and Locations filtered on locations.city. A shape asked at least
+# minCount times gets a rollup: count(*), count, sum, min and max
+# of the measured column grouped by every filtered and grouped
+# column. One rollup answers avg, sum, min, max and count, with
+# any equality filter or GROUP BY on a subset of its columns, by
+# combining the matching groups in memory instead of scanning the
+# tables.
+#
+# Refresh:
+#   every refreshInterval   rows of the driving table (the first
+#                           in the FROM clause) with a primary key
+#                           above the last one seen are aggregated
+#                           and merged in
+#   every rebuildInterval   rollups are rebuilt, to take in updates
+#                           and deletes made by other clients; this
+#                           is the only refresh of a rollup whose
+#                           driving table has no primary key
+#   on a watched write      rollups reading the written table stop
+#                           answering until they are rebuilt
+# Refreshing happens in maintain(), never in answer(), so a lookup
+# never waits on the database.
+#
+# QueryRan holds the whole query as it ran, literals written in,
+# so the shapes are read from it without translating again.
+#
+# Only the query forms queryGeneration produces are recognised:
+# one aggregate, equality predicates joined by AND, an optional
+# GROUP BY and no ORDER BY.
+import collections
+import re
+import threading
+import time
+
+import instrumentation
+from resultcache import tablesRead
+
+shapeFind = re.compile(r'^SELECT (avg|sum|min|max|count)\(([\w.*]+)\)'
+                       r'((?:, [\w.]+)*) FROM (.+?)(?: WHERE (.+?))?'
+                       r'(?: GROUP BY ([\w., ]+))?$', re.I)
+predicateFind = re.compile(r'^([\w.]+) = :(\w+)$')
+literalFind = re.compile(r"(= )('(?:[^']|'')*'|-?\d+(?:\.\d+)?)")
+logQuery = "SELECT QueryRan, SUM(Hits) FROM Log GROUP BY QueryRan"
+#
+#                   SHAPE
+# Aggregate query taken apart.
+#
+# @param aggregate STRING avg, sum, min, max or count
+# @param measure STRING aggregated column, None for count(*)
+# @param source STRING FROM clause, joins included
+# @param filters TUPLE of (column, bind name) equality predicates
+# @param groups TUPLE of grouped columns, in select list order
+# @param select LIST select list items, for the column names
+#
+Shape = collections.namedtuple('Shape', ['aggregate', 'measure', 'source',
+                                         'filters', 'groups', 'select'])
+
+
+# @return Shape, or None if the query is not one a rollup can answer
+def parseShape(sql):
+    if ' ORDER BY ' in sql.upper():
+        return None
+    match = shapeFind.match(sql.strip())
+    if not match:
+        return None
+    aggregate, measure, columns, source, where, groupBy = match.groups()
+    groups = tuple(column.strip() for column in columns.split(',')
+                   if column.strip())
+    grouped = tuple(column.strip() for column in (groupBy or '').split(',')
+                    if column.strip())
+    if sorted(column.lower() for column in groups) != \
+            sorted(column.lower() for column in grouped):
+        return None
+    filters = []
+    for predicate in (where.split(' AND ') if where else ()):
+        equality = predicateFind.match(predicate.strip())
+        if not equality:
+            return None
+        filters.append(equality.groups())
+    select = ['%s(%s)' % (aggregate, measure)] + list(groups)
+    return Shape(aggregate.lower(), None if measure == '*' else measure,
+                 source, tuple(filters), groups, select)
+
+
+# Logged queries have their literals written in; they become binds
+# again so questions differing only in literals share a shape
+def parameterize(sql):
+    binds = {}
+
+    def bind(match):
+        name = 'v%d' % len(binds)
+        literal = match.group(2)
+        binds[name] = (literal[1:-1].replace("''", "'")
+                       if literal.startswith("'") else literal)
+        return '%s:%s' % (match.group(1), name)
+    return literalFind.sub(bind, sql), binds
+#
+#                   ROLLUP
+# Per group of dimension values: count(*) and the count, sum, min
+# and max of the measure.
+#
+# @param source STRING FROM clause
+# @param dimensions TUPLE of columns grouped on
+# @param measure STRING measured column, None for counts only
+# @param keyColumn STRING qualified primary key of the driving
+#                  table, None if the rollup is only ever rebuilt
+#
+
+
+class Rollup(object):
+
+    def __init__(self, source, dimensions, measure, keyColumn):
+        self.source = source
+        self.dimensions = dimensions
+        self.measure = measure
+        self.keyColumn = keyColumn
+        self.tables = tablesRead('FROM ' + source)
+        self.groups = {}
+        self.highWater = None
+        self.dirty = True
+        self.writes = 0
+        self.builtAt = None
+        self.refreshedAt = None
+        self.hits = 0
+
+    # Bounded by the key read just before, so a row inserted while
+    # the query runs is left for the next refresh, not counted twice
+    def query(self, incremental, bounded):
+        measure = self.measure or 'NULL'
+        sql = 'SELECT %s FROM %s' % (', '.join(
+            list(self.dimensions) + ['count(*)', 'count(%s)' % measure,
+                                     'sum(%s)' % measure, 'min(%s)' % measure,
+                                     'max(%s)' % measure]), self.source)
+        if incremental:
+            sql += ' WHERE %s > :after AND %s <= :upto' % (self.keyColumn,
+                                                           self.keyColumn)
+        elif bounded:
+            sql += ' WHERE %s <= :upto' % self.keyColumn
+        if self.dimensions:
+            sql += ' GROUP BY %s' % ', '.join(self.dimensions)
+        return sql
+
+    # @return new groups DICT and high-water mark, read outside the
+    #         manager's lock
+    def read(self, curs, incremental):
+        upto = None
+        if self.keyColumn is not None:
+            table, column = self.keyColumn.split('.')
+            curs.execute('SELECT max(%s) FROM %s' % (column, table))
+            upto = curs.fetchone()[0]
+        if incremental:
+            if upto is None or upto == self.highWater:
+                return {}, self.highWater
+            # Built on an empty table, so every row is new
+            if self.highWater is None:
+                curs.execute(self.query(False, True), {'upto': upto})
+            else:
+                curs.execute(self.query(True, True),
+                             {'after': self.highWater, 'upto': upto})
+        elif upto is not None:
+            curs.execute(self.query(False, True), {'upto': upto})
+        else:
+            curs.execute(self.query(False, False))
+        groups = {}
+        width = len(self.dimensions)
+        for row in curs.fetchall():
+            if row[width]:
+                groups[tuple(row[:width])] = list(row[width:])
+        return groups, upto
+
+    # Caller holds the manager's lock
+    def merge(self, groups):
+        for key, stats in groups.items():
+            current = self.groups.get(key)
+            if current is None:
+                self.groups[key] = list(stats)
+            else:
+                self.combine(current, stats)
+
+    def covers(self, shape):
+        if shape.source.lower() != self.source.lower():
+            return False
+        if shape.measure is not None and \
+                shape.measure.lower() != (self.measure or '').lower():
+            return False
+        dimensions = set(column.lower() for column in self.dimensions)
+        return all(column.lower() in dimensions for column, name
+                   in shape.filters) and \
+            all(column.lower() in dimensions for column in shape.groups)
+    #
+    #               ANSWER
+    # Combines the groups matching the filters into the groups the
+    # query asks for.
+    #
+    # @return rows LIST in the select list's column order
+    #
+
+    def answer(self, shape, binds):
+        positions = dict((column.lower(), position) for position, column
+                         in enumerate(self.dimensions))
+        filters = [(positions[column.lower()], binds.get(name))
+                   for column, name in shape.filters]
+        grouped = [positions[column.lower()] for column in shape.groups]
+        combined = collections.OrderedDict()
+        for key, stats in self.groups.items():
+            if all(key[position] == value for position, value in filters):
+                target = tuple(key[position] for position in grouped)
+                current = combined.get(target)
+                if current is None:
+                    combined[target] = list(stats)
+                else:
+                    self.combine(current, stats)
+        if not combined and not grouped:
+            combined[()] = [0, 0, None, None, None]
+        return [(self.finish(shape, stats),) + target
+                for target, stats in combined.items()]
+
+    def combine(self, current, stats):
+        current[0] += stats[0]
+        current[1] += stats[1]
+        if stats[2] is not None:
+            current[2] = stats[2] if current[2] is None \
+                else current[2] + stats[2]
+        if stats[3] is not None and (current[3] is None or
+                                     stats[3] < current[3]):
+            current[3] = stats[3]
+        if stats[4] is not None and (current[4] is None or
+                                     stats[4] > current[4]):
+            current[4] = stats[4]
+
+    def finish(self, shape, stats):
+        rows, count, total, low, high = stats
+        if shape.aggregate == 'count':
+            return rows if shape.measure is None else count
+        if shape.aggregate == 'sum':
+            return total
+        if shape.aggregate == 'avg':
+            return total / float(count) if count else None
+        return low if shape.aggregate == 'min' else high
+#
+#                   ROLLUP MANAGER
+# @param pool ConnectionPool the Log and the tables are read from
+# @param catalog SchemaCatalog, for the driving tables' keys
+# @param minCount INT times a shape is logged before it gets a rollup
+# @param maxRollups INT rollups kept, hottest first
+# @param maxGroups INT largest rollup kept
+# @param refreshInterval NUMBER seconds between incremental refreshes
+# @param rebuildInterval NUMBER seconds between rebuilds
+# @param analyzeInterval NUMBER seconds between reads of the Log
+#
+
+
+class RollupManager(object):
+
+    def __init__(self, pool, catalog, minCount=5, maxRollups=10,
+                 maxGroups=10000, refreshInterval=30, rebuildInterval=600,
+                 analyzeInterval=600):
+        self.pool = pool
+        self.catalog = catalog
+        self.minCount = minCount
+        self.maxRollups = maxRollups
+        self.maxGroups = maxGroups
+        self.refreshInterval = refreshInterval
+        self.rebuildInterval = rebuildInterval
+        self.analyzeInterval = analyzeInterval
+        self.rollups = []
+        self.analyzedAt = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'builds': 0, 'refreshes': 0,
+                      'tooLarge': 0, 'analyses': 0}
+
+    @classmethod
+    def fromPool(cls, pool, catalog, **options):
+        manager = cls(pool, catalog, **options)
+        manager.maintain()
+        return manager
+
+    # Rollups over tables written through pool.statements() stop
+    # answering until they are rebuilt
+    def watch(self):
+        self.pool.writeListeners.append(self.tableWritten)
+        return self
+
+    def tableWritten(self, table):
+        with self.lock:
+            for rollup in self.rollups:
+                if table in rollup.tables:
+                    rollup.dirty = True
+                    rollup.writes += 1
+    #
+    #               ANALYZE
+    # @return LIST of (count, source, dimensions, measure) for the
+    #         shapes logged at least minCount times, hottest first
+    #
+
+    def hotShapes(self):
+        counts = collections.Counter()
+        with self.pool.cursor() as curs:
+            curs.execute(logQuery)
+            logged = curs.fetchall()
+        for queryRan, asked in logged:
+            shape = parseShape(parameterize(queryRan)[0]) if queryRan \
+                else None
+            if shape is None:
+                continue
+            dimensions = tuple(sorted(set(
+                [column.lower() for column, name in shape.filters] +
+                [column.lower() for column in shape.groups])))
+            counts[(shape.source, dimensions, shape.measure)] += asked
+        # Any rollup over the same rows answers count(*), so counting
+        # shapes are added to a measured one when there is one
+        for source, dimensions, measure in list(counts):
+            if measure is not None:
+                continue
+            measured = [key for key in counts if key[:2] == (source,
+                                                             dimensions)
+                        and key[2] is not None]
+            if measured:
+                target = max(measured, key=counts.get)
+                counts[target] += counts.pop((source, dimensions, None))
+        return [(asked, source, dimensions, measure)
+                for (source, dimensions, measure), asked
+                in counts.most_common() if asked >= self.minCount]
+
+    def analyze(self):
+        self.stats['analyses'] += 1
+        wanted = []
+        for asked, source, dimensions, measure in self.hotShapes():
+            if len(wanted) >= self.maxRollups:
+                break
+            wanted.append((source, dimensions, measure))
+        with self.lock:
+            kept = dict(((rollup.source, rollup.dimensions, rollup.measure),
+                         rollup) for rollup in self.rollups)
+            self.rollups = [kept.get(definition) or
+                            self.newRollup(*definition)
+                            for definition in wanted]
+        self.analyzedAt = time.time()
+
+    def newRollup(self, source, dimensions, measure):
+        table = source.split()[0]
+        key = self.catalog.primaryKey(table)
+        return Rollup(source, dimensions, measure,
+                      '%s.%s' % (table, key.lower()) if key else None)
+    #
+    #               MAINTAIN
+    # Re-reads the Log and refreshes or rebuilds the rollups that
+    # are due. Called between questions, or on a timer.
+    #
+
+    def maintain(self):
+        now = time.time()
+        if self.analyzedAt is None or \
+                now - self.analyzedAt > self.analyzeInterval:
+            self.analyze()
+        with self.lock:
+            rollups = list(self.rollups)
+        for rollup in rollups:
+            rebuild = (rollup.dirty or
+                       now - rollup.builtAt > self.rebuildInterval)
+            if not rebuild and (rollup.keyColumn is None or
+                                now - rollup.refreshedAt <
+                                self.refreshInterval):
+                continue
+            # A write landing during the read leaves the rollup dirty
+            writes = rollup.writes
+            with instrumentation.timer('db.rollupRefresh'):
+                with self.pool.cursor() as curs:
+                    groups, highWater = rollup.read(curs, not rebuild)
+            with self.lock:
+                if rebuild:
+                    self.stats['builds'] += 1
+                    rollup.groups = {}
+                    rollup.dirty = rollup.writes != writes
+                    rollup.builtAt = now
+                else:
+                    self.stats['refreshes'] += 1
+                rollup.merge(groups)
+                rollup.highWater = highWater
+                rollup.refreshedAt = now
+                if len(rollup.groups) > self.maxGroups and \
+                        rollup in self.rollups:
+                    self.stats['tooLarge'] += 1
+                    self.rollups.remove(rollup)
+    #
+    #               ANSWER
+    # @param sql STRING generated query
+    # @param binds DICT its bind values
+    #
+    # @return columns LIST and rows LIST, or None if no rollup can
+    #         answer the query
+    #
+
+    def answer(self, sql, binds):
+        shape = parseShape(sql)
+        rows = None
+        if shape is not None:
+            with self.lock:
+                for rollup in self.rollups:
+                    if not rollup.dirty and rollup.covers(shape):
+                        rollup.hits += 1
+                        rows = rollup.answer(shape, binds or {})
+                        break
+        if rows is None:
+            self.stats['misses'] += 1
+            instrumentation.count('rollups.miss')
+            return None
+        self.stats['hits'] += 1
+        instrumentation.count('rollups.hit')
+        return shape.select, rows
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['rollups'] = [{'source': rollup.source,
+                                 'dimensions': list(rollup.dimensions),
+                                 'measure': rollup.measure,
+                                 'groups': len(rollup.groups),
+                                 'hits': rollup.hits, 'dirty': rollup.dirty}
+                                for rollup in self.rollups]
+        return stats
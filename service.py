@@ -0,0 +1,731 @@
+#
+# Natural Language Interface to Databases
+#       Service Mode
+#
+# asyncio server answering questions from many clients at once,
+# over a local line protocol or plain HTTP.
+#
+# Line protocol: one request per line, either a JSON object or a
+# bare question, and one JSON response line back per request.
+#
+# HTTP: POST /translate (or /complete, for partial questions) with
+# a JSON request body, GET /stats.
+#
+# Request fields:
+#   question   STRING the question to translate (required)
+#   resolve    DICT left over word -> first_name, last_name,
+#              location, department or ignore (or menu number)
+#   execute    BOOLEAN run the query and return its rows
+#   maxRows    INT rows returned with execute
+#   confirmed  STRING Y or N, logs the question to the Log table
+#   schema     STRING schema to translate for, one of --schemas;
+#              the question is translated with that schema's
+#              catalog and compiled lexicon, and neither executed
+#              nor logged, the sessions being on their own schema
+#   partial    STRING question as typed so far, instead of question
+#   preview    BOOLEAN with partial, add the query made so far
+#
+# A partial request is answered with status "partial": the words
+# detected so far, whether a FROM clause is possible yet and
+# completions for the text. On the line protocol each connection
+# keeps its incremental translator, so a request per keystroke
+# only reprocesses the words that changed.
+#
+# Left over words are looked up in the value index first. A word
+# neither the index nor the request resolves is never asked
+# about: the response has status "needs_clarification", lists the
+# words and the choices, and the client sends the question again
+# with a "resolve" entry for each word. A query the cost guard
+# stops has status "rejected" and the guard's reasons.
+#
+# Translation runs on a thread pool and database calls on a
+# second pool sized to the session pool, so the event loop only
+# moves bytes. Translation threads never query the database: the
+# value index is refreshed on a timer through the session pool,
+# the catalog of a named schema is loaded through it before the
+# request is translated, and the default catalog is opened
+# without a ttl. The log writer's thread and the completer's
+# start-up load take pool sessions directly; ConnectionPool still
+# caps the total at --sessions.
+#
+# Requests go through a bounded queue drained by a
+# fixed number of workers; when the queue is full the request is
+# answered "busy" at once instead of queueing without limit, and
+# each connection has at most one request in flight, so a client
+# that sends faster than it is answered is held back by TCP.
+#
+# Usage: python service.py [--sqlite] [--port N] [--http]
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+
+import implementation
+import instrumentation
+from guard import CostGuard, QueryRejected
+from incremental import Completer, IncrementalTranslator
+from lexiconstore import LexiconStore, SchemaRegistry, UnknownSchema
+from logwriter import LogWriter
+from pool import SqliteBackend
+from replica import LocalReplica
+from rollups import RollupManager
+from resultcache import ResultCache
+from statementcache import inlineBinds
+from translationcache import TranslationCache
+from valueindex import ValueIndex
+
+resolveChoices = {'first_name': 1, 'last_name': 2, 'location': 3,
+                  'department': 4, 'ignore': 5}
+httpReasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               503: 'Service Unavailable'}
+#
+#                   CLARIFICATION
+# Raised by the resolver when a left over word has no answer in
+# the request.
+#
+# @param words LIST every unresolved word in the question
+#
+
+
+class NeedsClarification(Exception):
+
+    def __init__(self, words):
+        Exception.__init__(self, words)
+        self.words = words
+#
+#                   ASYNC SESSION POOL
+# Wraps the thread-safe ConnectionPool for use from coroutines.
+#
+# A semaphore sized to the pool's session limit is taken on the
+# event loop before a thread is used, so waiting for a session
+# never ties up an executor thread. Results still valid in the
+# result cache are answered on the event loop without a session,
+# and queries the local replica accepts are run on it instead.
+# Aggregates a rollup covers are answered on the event loop too.
+# Queries run on the pool's sessions go through the cost guard.
+#
+# @param pool ConnectionPool
+# @param resultCache ResultCache, or None
+# @param replica LocalReplica, or None
+# @param rollups RollupManager, or None
+# @param guard CostGuard, or None
+#
+
+
+class AsyncSessionPool(object):
+
+    def __init__(self, pool, resultCache=None, replica=None, rollups=None,
+                 guard=None):
+        self.pool = pool
+        self.resultCache = resultCache
+        self.replica = replica
+        self.rollups = rollups
+        self.guard = guard
+        self.sessions = asyncio.Semaphore(pool.maxSessions)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            pool.maxSessions, thread_name_prefix='nli-db')
+
+    async def run(self, function, *args):
+        async with self.sessions:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, function,
+                                              *args)
+
+    # @return columns LIST, rows LIST of the first maxRows rows
+    async def fetch(self, sql, binds, maxRows):
+        if self.resultCache is not None:
+            cached = self.resultCache.get(sql, binds)
+            if cached is not None:
+                return cached.columns, [list(row) for row
+                                        in cached.rows[:maxRows]]
+        if self.rollups is not None:
+            answer = self.rollups.answer(sql, binds)
+            if answer is not None:
+                columns, rows = answer
+                return columns, [list(row) for row in rows[:maxRows]]
+        return await self.run(self.fetchRows, sql, binds, maxRows)
+
+    # One row past the cache's limit is read to know whether the
+    # whole result fits in it; a result cut short by the guard's row
+    # limit is not cached.
+    #
+    # @exception guard.QueryRejected
+    def fetchRows(self, sql, binds, maxRows):
+        resultCache = self.resultCache
+        if resultCache is not None:
+            stamps = resultCache.snapshot(sql)
+            limit = max(maxRows, resultCache.maxRows + 1)
+        else:
+            limit = maxRows
+        source = self.pool
+        if self.replica is not None and self.replica.accepts(sql):
+            source = self.replica
+        complete = True
+        with source.statements() as statements:
+            if source is self.pool and self.guard is not None:
+                verdict = self.guard.check(statements, sql, binds)
+                with self.guard.timeLimit(statements, verdict):
+                    columns, rows = self.readRows(
+                        statements, verdict.sql, binds,
+                        min(limit, verdict.maxRows))
+                complete = len(rows) < verdict.maxRows
+            else:
+                columns, rows = self.readRows(statements, sql, binds, limit)
+        if resultCache is not None and complete:
+            resultCache.put(sql, binds, columns, rows, stamps)
+        return columns, [list(row) for row in rows[:maxRows]]
+
+    def readRows(self, statements, sql, binds, limit):
+        curs = statements.execute(sql, binds)
+        columns = [column[0] for column in curs.description]
+        with instrumentation.timer('db.fetch'):
+            return columns, curs.fetchmany(limit)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+#
+#                   SERVICE
+# @param pool ConnectionPool
+# @param catalog SchemaCatalog
+# @param cache TranslationCache shared by every request
+# @param logWriter LogWriter for confirmed questions, or None
+# @param valueIndex ValueIndex consulted for left over words, or None;
+#                   built with refreshInterval=None and refreshed
+#                   through refreshValueIndex(), so lookups on the
+#                   translation threads never query the database
+# @param maxQueued INT requests waiting for a worker before "busy"
+# @param workers INT requests processed at the same time
+# @param translateThreads INT threads running the pipeline
+# @param maxRows INT row limit for executed queries
+# @param resultCache ResultCache for executed queries, or None
+# @param replica LocalReplica executed queries may run on, or None
+# @param rollups RollupManager answering hot aggregates, or None
+# @param guard CostGuard checking queries before they run, or None
+# @param schemas SchemaRegistry of the other schemas served, or None
+# @param completer Completer for partial questions, or None
+#
+
+
+class Service(object):
+
+    def __init__(self, pool, catalog, cache, logWriter=None,
+                 valueIndex=None, maxQueued=256, workers=64,
+                 translateThreads=4, maxRows=100, resultCache=None,
+                 replica=None, rollups=None, guard=None, schemas=None,
+                 completer=None):
+        self.catalog = catalog
+        self.cache = cache
+        self.logWriter = logWriter
+        self.valueIndex = valueIndex
+        self.maxQueued = maxQueued
+        self.workerCount = workers
+        self.maxRows = maxRows
+        self.resultCache = resultCache
+        self.replica = replica
+        self.rollups = rollups
+        self.guard = guard
+        self.schemas = schemas
+        self.schemaCaches = {}
+        self.completer = completer
+        self.schemaCompleters = {}
+        self.sessions = AsyncSessionPool(pool, resultCache, replica,
+                                         rollups, guard)
+        self.translator = concurrent.futures.ThreadPoolExecutor(
+            translateThreads, thread_name_prefix='nli-translate')
+        self.queue = None
+        self.workers = []
+        self.stats = {'requests': 0, 'translated': 0, 'clarifications': 0,
+                      'failed': 0, 'errors': 0, 'busy': 0, 'executed': 0,
+                      'rejected': 0, 'partial': 0, 'connections': 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.maxQueued)
+        self.workers = [asyncio.ensure_future(self.work())
+                        for i in range(self.workerCount)]
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.translator.shutdown(wait=True)
+        self.sessions.close()
+    #
+    #               SUBMIT
+    # Queues a request without waiting for room.
+    #
+    # @param request DICT decoded request
+    # @param translators DICT incremental translators of the
+    #                    connection, by schema, or None
+    #
+    # @return response DICT
+    #
+
+    async def submit(self, request, translators=None):
+        self.stats['requests'] += 1
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((request, translators, future))
+        except asyncio.QueueFull:
+            self.stats['busy'] += 1
+            return {'status': 'busy', 'error': 'request queue is full'}
+        return await future
+
+    async def work(self):
+        while True:
+            request, translators, future = await self.queue.get()
+            try:
+                await self.loadSchema(request.get('schema'))
+                if 'partial' in request:
+                    response = await asyncio.get_event_loop(
+                    ).run_in_executor(self.translator, self.draft, request,
+                                      {} if translators is None
+                                      else translators)
+                else:
+                    response = await self.handle(request)
+            except UnknownSchema as unknown:
+                response = {'status': 'error', 'error': str(unknown)}
+            except Exception as exception:
+                self.stats['errors'] += 1
+                response = {'status': 'error', 'error': '%s: %s' % (
+                    type(exception).__name__, exception)}
+            if not future.cancelled():
+                future.set_result(response)
+
+    # A schema's catalog is read from the database on first use, so
+    # that happens on a session thread, not a translation thread
+    async def loadSchema(self, schema):
+        if schema is not None and self.schemas is not None:
+            await self.sessions.run(self.schemas.catalog, schema)
+
+    async def handle(self, request):
+        question = request.get('question')
+        if not isinstance(question, str) or not question.strip():
+            return {'status': 'error', 'error': 'question is required'}
+        schema = request.get('schema')
+        loop = asyncio.get_event_loop()
+        try:
+            (templateQuery, binds,
+             corrections) = await loop.run_in_executor(
+                self.translator, self.translate, question,
+                request.get('resolve') or {}, schema)
+        except UnknownSchema as unknown:
+            return {'status': 'error', 'error': str(unknown)}
+        except NeedsClarification as clarification:
+            self.stats['clarifications'] += 1
+            return {'status': 'needs_clarification', 'question': question,
+                    'words': clarification.words,
+                    'choices': sorted(resolveChoices,
+                                      key=resolveChoices.get)}
+        if templateQuery is None:
+            self.stats['failed'] += 1
+            return {'status': 'failed', 'question': question,
+                    'error': 'no query could be constructed'}
+        self.stats['translated'] += 1
+        response = {'status': 'ok', 'question': question,
+                    'sql': templateQuery, 'binds': binds}
+        if corrections:
+            response['corrections'] = corrections
+        if schema is not None:
+            response['schema'] = schema
+            return response
+        if request.get('execute'):
+            maxRows = min(int(request.get('maxRows') or self.maxRows),
+                          self.maxRows)
+            try:
+                response['columns'], response['rows'] = \
+                    await self.sessions.fetch(templateQuery, binds, maxRows)
+            except QueryRejected as rejected:
+                self.stats['rejected'] += 1
+                return {'status': 'rejected', 'question': question,
+                        'sql': templateQuery, 'binds': binds,
+                        'reasons': rejected.reasons}
+            self.stats['executed'] += 1
+        confirmed = request.get('confirmed')
+        if self.logWriter is not None and confirmed:
+            self.logWriter.submit(question, inlineBinds(templateQuery, binds),
+                                  str(confirmed).lower()[:5])
+        return response
+    #
+    #               TRANSLATE
+    # Runs on the translation threads. Every left over word is
+    # looked up in the request's answers, then in the value index;
+    # the rest are collected and reported together.
+    #
+
+    def translate(self, question, answers, schema=None):
+        unresolved = []
+        catalog, lexicon, cache, valueIndex = (self.catalog, None,
+                                               self.cache, self.valueIndex)
+        if schema is not None:
+            if self.schemas is None:
+                raise UnknownSchema('only the default schema is served')
+            catalog, lexicon = self.schemas.get(schema)
+            cache = self.schemaCache(schema, lexicon)
+            valueIndex = None
+
+        answers = dict((str(word).lower(), resolveChoices.get(choice, choice))
+                       for word, choice in answers.items())
+
+        def resolveWord(word):
+            choice = answers.get(word.lower())
+            columns = ()
+            if valueIndex is not None:
+                columns = valueIndex.resolve(word)
+            if choice in resolveChoices.values():
+                # Use the stored spelling when the index has one
+                for number, value in columns:
+                    if number == choice:
+                        return number, value
+                return choice
+            if len(columns) == 1:
+                return columns[0]
+            unresolved.append(word)
+            return resolveChoices['ignore']
+        corrections = []
+        query = implementation.translateQuery(question, catalog,
+                                              resolveWord, cache,
+                                              corrections, lexicon,
+                                              valueIndex)
+        if unresolved:
+            raise NeedsClarification(unresolved)
+        if query is None:
+            return None, None, None
+        templateQuery, binds = query.render()
+        return templateQuery, binds, [
+            {'token': token, 'word': match.word,
+             'confidence': round(match.confidence, 3)}
+            for token, match in corrections]
+
+    #
+    #               DRAFT
+    # Runs on the translation threads, one request at a time per
+    # connection.
+    #
+    # @param request DICT with the partial question
+    # @param translators DICT schema -> IncrementalTranslator
+    #
+
+    def draft(self, request, translators):
+        text = request.get('partial')
+        if not isinstance(text, str):
+            return {'status': 'error', 'error': 'partial must be a string'}
+        schema = request.get('schema')
+        try:
+            valueIndex = None
+            if schema is None:
+                catalog, lexicon = self.catalog, None
+                completer, valueIndex = self.completer, self.valueIndex
+            else:
+                if self.schemas is None:
+                    raise UnknownSchema('only the default schema is served')
+                catalog, lexicon = self.schemas.get(schema)
+                completer = self.schemaCompleter(schema, lexicon)
+        except UnknownSchema as unknown:
+            return {'status': 'error', 'error': str(unknown)}
+        key = schema.upper() if schema else None
+        translator = translators.get(key)
+        if translator is None or translator.catalog is not catalog or \
+                (lexicon is not None and translator.lexicon is not lexicon):
+            translator = IncrementalTranslator(catalog, lexicon, completer,
+                                               valueIndex)
+            translators[key] = translator
+        draft = translator.update(text)
+        self.stats['partial'] += 1
+        response = {'status': 'partial', 'partial': text,
+                    'hasSource': draft.hasSource,
+                    'attributes': draft.attributes,
+                    'entities': draft.entities,
+                    'aggregates': draft.aggregates,
+                    'leftOver': draft.leftOver,
+                    'completions': draft.completions}
+        if draft.corrections:
+            response['corrections'] = [
+                {'token': token, 'word': match.word,
+                 'confidence': round(match.confidence, 3)}
+                for token, match in draft.corrections]
+        if request.get('preview'):
+            response['sql'], response['binds'] = translator.preview()
+        return response
+
+    # Lexicon words only; the Log holds questions on the default
+    # schema
+    def schemaCompleter(self, schema, lexicon):
+        cached = self.schemaCompleters.get(schema.upper())
+        if cached is None or cached[0] is not lexicon:
+            cached = (lexicon, Completer(lexicon))
+            self.schemaCompleters[schema.upper()] = cached
+        return cached[1]
+
+    # Translation cache of a schema, emptied when its lexicon is
+    # recompiled
+    def schemaCache(self, schema, lexicon):
+        cached = self.schemaCaches.get(schema.upper())
+        if cached is None or cached[0] is not lexicon:
+            cached = (lexicon, TranslationCache())
+            self.schemaCaches[schema.upper()] = cached
+        return cached[1]
+
+    def report(self):
+        stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize() if self.queue else 0
+        stats['cache'] = self.cache.stats()
+        stats['pool'] = dict(self.sessions.pool.stats)
+        if self.valueIndex is not None:
+            stats['valueIndex'] = self.valueIndex.report()
+        if self.resultCache is not None:
+            stats['resultCache'] = self.resultCache.report()
+        if self.replica is not None:
+            stats['replica'] = self.replica.report()
+        if self.rollups is not None:
+            stats['rollups'] = self.rollups.report()
+        if self.guard is not None:
+            stats['guard'] = self.guard.report()
+        if self.schemas is not None:
+            stats['schemas'] = dict(
+                (schema, dict(cache.stats(),
+                              lexicon=lexicon.meta.get('compiledAt')))
+                for schema, (lexicon, cache)
+                in list(self.schemaCaches.items()))
+        if instrumentation.recorder.enabled:
+            stats['metrics'] = instrumentation.recorder.snapshot()
+        return stats
+    #
+    #               LINE PROTOCOL
+    # One request in flight per connection: the next line is only
+    # read once the previous response has been written.
+    #
+
+    async def serveLines(self, reader, writer):
+        self.stats['connections'] += 1
+        translators = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                response = await self.submit(parseRequest(line),
+                                             translators)
+                writer.write(json.dumps(response, default=str).encode() +
+                             b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    #
+    #               HTTP
+    # Minimal HTTP/1.1 with keep-alive, enough for local clients.
+    #
+
+    async def serveHttp(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                parts = requestLine.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    body = await reader.readexactly(length)
+                status, response = await self.routeHttp(parts, body)
+                payload = json.dumps(response, default=str).encode()
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: '
+                              'application/json\r\nContent-Length: %d\r\n'
+                              '\r\n' % (status, httpReasons[status],
+                                        len(payload))).encode() + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def routeHttp(self, parts, body):
+        if len(parts) < 2:
+            return 400, {'status': 'error', 'error': 'bad request line'}
+        method, path = parts[0].upper(), parts[1]
+        if method == 'GET' and path == '/stats':
+            return 200, self.report()
+        if method != 'POST' or path not in ('/translate', '/complete'):
+            return 404, {'status': 'error', 'error': 'not found'}
+        response = await self.submit(parseRequest(
+            body.decode('utf-8', 'replace')))
+        return (503 if response['status'] == 'busy' else 200), response
+
+
+def parseRequest(text):
+    text = text.strip()
+    if text.startswith('{'):
+        try:
+            request = json.loads(text)
+        except ValueError:
+            return {}
+        return request if isinstance(request, dict) else {}
+    return {'question': text}
+#
+#                   SERVE
+# @param host STRING interface to listen on
+# @param port INT
+# @param http BOOLEAN HTTP instead of the line protocol
+#
+
+
+async def serve(service, host, port, http=False):
+    await service.start()
+    handler = service.serveHttp if http else service.serveLines
+    server = await asyncio.start_server(handler, host, port,
+                                        limit=64 * 1024)
+    print("Listening on %s:%d (%s)" % (host, port,
+                                        'http' if http else 'lines'),
+          file=sys.stderr)
+    return server
+
+
+# Writes the metrics file every interval seconds
+async def exportMetrics(interval):
+    while True:
+        await asyncio.sleep(interval)
+        instrumentation.export()
+
+
+# Reads the values added since the last refresh every interval
+# seconds, on a database thread
+async def refreshValueIndex(service, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await service.sessions.run(service.valueIndex.refresh)
+        except Exception as exception:
+            print("Value index refresh failed: %s" % exception,
+                  file=sys.stderr)
+
+
+# Re-reads the Log and refreshes the rollups every interval seconds,
+# on a database thread
+async def maintainRollups(service, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await service.sessions.run(service.rollups.maintain)
+        except Exception as exception:
+            print("Rollup refresh failed: %s" % exception, file=sys.stderr)
+
+
+async def shutdown(service, server):
+    server.close()
+    await server.wait_closed()
+    await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve translations to '
+                                     'concurrent clients')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--http', action='store_true',
+                        help='speak HTTP instead of the line protocol')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='use the SQLite stand-in instead of Oracle')
+    parser.add_argument('--sessions', type=int, default=8,
+                        help='database sessions in the pool')
+    parser.add_argument('--queue', type=int, default=256,
+                        help='requests queued before answering busy')
+    parser.add_argument('--workers', type=int, default=64,
+                        help='requests processed concurrently')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='translation threads')
+    parser.add_argument('--max-rows', type=int, default=100)
+    parser.add_argument('--value-refresh', type=float, default=60,
+                        help='seconds between value index refreshes')
+    parser.add_argument('--result-ttl', type=float, default=300,
+                        help='seconds executed results are cached, '
+                             '0 to disable the result cache')
+    parser.add_argument('--replica', action='store_true',
+                        help='run queries on a local in-memory copy of '
+                             'the HR tables')
+    parser.add_argument('--rollups', action='store_true',
+                        help='precompute the aggregates asked most often')
+    parser.add_argument('--guard-log', metavar='FILE',
+                        help='append the cost guard\'s decisions to a '
+                             'JSON lines file')
+    parser.add_argument('--schemas', metavar='NAME,..',
+                        help='other schemas requests may name, each with '
+                             'a compiled lexicon')
+    parser.add_argument('--lexicons', metavar='DIR',
+                        help='lexicon store directory, lexicons/ by '
+                             'default')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='export timings and counters to a .prom '
+                             'or JSON lines file')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='seconds between metrics exports')
+    args = parser.parse_args()
+    instrumentation.configure(args.metrics)
+
+    # Pipeline progress messages are meant for the REPL
+    sys.stdout = open(os.devnull, 'w')
+    backend = SqliteBackend() if args.sqlite else None
+    pool, catalog = implementation.databaseConnection(backend, args.sessions)
+    # Loads while the rest starts up
+    completer = Completer.loading(pool, catalog)
+    cache = TranslationCache(path='translation_cache.json')
+    logWriter = LogWriter(pool)
+    resultCache = None
+    if args.result_ttl > 0:
+        resultCache = ResultCache(ttl=args.result_ttl).watch(pool)
+    replica = LocalReplica.fromPool(pool).watch() if args.replica else None
+    valueIndex = ValueIndex.fromPool(pool, refreshInterval=None)
+    schemas = None
+    if args.schemas:
+        store = (LexiconStore(args.lexicons) if args.lexicons
+                 else LexiconStore())
+        schemas = SchemaRegistry(pool, store, args.schemas.split(','))
+    rollups = None
+    if args.rollups:
+        rollups = RollupManager.fromPool(pool, catalog).watch()
+    service = Service(pool, catalog, cache, logWriter,
+                      valueIndex, args.queue, args.workers,
+                      args.threads, args.max_rows, resultCache, replica,
+                      rollups, CostGuard(pool.backend, catalog,
+                                         logPath=args.guard_log), schemas,
+                      completer)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(serve(service, args.host, args.port,
+                                           args.http))
+    if instrumentation.recorder.enabled:
+        asyncio.ensure_future(exportMetrics(args.metrics_interval))
+    asyncio.ensure_future(refreshValueIndex(service, args.value_refresh))
+    if rollups is not None:
+        asyncio.ensure_future(maintainRollups(service,
+                                              rollups.refreshInterval))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(shutdown(service, server))
+        instrumentation.export()
+        logWriter.close()
+        cache.save()
+        if replica is not None:
+            replica.close()
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
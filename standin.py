@@ -0,0 +1,137 @@
+#
+# Natural Language Interface to Databases
+#       SQLite Stand-in
+#
+# Loads "ORACLE SCRIPT.SQL" into SQLite so the pipeline, the
+# connection pool and the benchmarks can run without an Oracle
+# instance. Only the handful of Oracle-isms used by the script
+# are rewritten:
+#   DROP TABLE              skipped, the database starts empty
+#   DEFAULT sysdate         becomes DEFAULT CURRENT_DATE
+#   CREATE SEQUENCE         skipped, SQLite has no sequences
+#   ALTER TABLE .. ADD CONSTRAINT .. FOREIGN KEY
+#                           folded into the CREATE TABLE
+#   table constraints mixed between columns
+#                           moved after the column definitions
+#
+# DATE values keep the script's DD-MON-YYYY text.
+import os
+import re
+
+defaultScriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'ORACLE SCRIPT.SQL')
+
+commentFind = re.compile(r'/\*.*?\*/', re.S)
+createFind = re.compile(r'^CREATE\s+TABLE\s+(\w+)\s*\((.*)\)$', re.S | re.I)
+alterFind = re.compile(r'^ALTER\s+TABLE\s+(\w+)\s+ADD\s+(CONSTRAINT\s.*)$',
+                       re.S | re.I)
+tableConstraintFind = re.compile(r'^CONSTRAINT\s+\w+\s+'
+                                 r'(PRIMARY|FOREIGN|UNIQUE|CHECK)\b', re.I)
+#
+#                   SCRIPT PARSER
+# Splits the script into statements, dropping comments.
+#
+# @param scriptPath STRING path to the Oracle script
+#
+# @return statements LIST of SQL statements without semicolons
+#
+
+
+def readScript(scriptPath=defaultScriptPath):
+    with open(scriptPath) as scriptFile:
+        script = commentFind.sub('', scriptFile.read())
+    statements = []
+    current = []
+    inString = False
+    for char in script:
+        if char == "'":
+            inString = not inString
+        if char == ';' and not inString:
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+# Splits a CREATE TABLE body on commas outside parentheses
+def splitDefinitions(body):
+    definitions = []
+    depth = 0
+    current = []
+    for char in body:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            definitions.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        definitions.append(''.join(current).strip())
+    return definitions
+#
+#                   TRANSLATION
+# Rewrites the Oracle statements into SQLite statements.
+#
+# @param statements LIST of Oracle statements
+#
+# @return translated LIST of SQLite statements
+#
+
+
+def translateScript(statements):
+    laterConstraints = {}
+    for statement in statements:
+        alter = alterFind.match(statement)
+        if alter:
+            laterConstraints.setdefault(alter.group(1).upper(), []).append(
+                alter.group(2).strip())
+
+    translated = []
+    for statement in statements:
+        keyword = statement.split(None, 2)[:2]
+        keyword = ' '.join(keyword).upper()
+        if keyword.startswith('DROP') or keyword == 'CREATE SEQUENCE':
+            continue
+        if keyword.startswith('ALTER'):
+            continue
+        create = createFind.match(statement)
+        if create:
+            tableName = create.group(1)
+            columns = []
+            constraints = []
+            for definition in splitDefinitions(create.group(2)):
+                if tableConstraintFind.match(definition):
+                    constraints.append(definition)
+                else:
+                    columns.append(re.sub(r'DEFAULT\s+sysdate',
+                                          'DEFAULT CURRENT_DATE',
+                                          definition, flags=re.I))
+            constraints += laterConstraints.get(tableName.upper(), [])
+            statement = 'CREATE TABLE %s(\n%s\n)' % (
+                tableName, ',\n'.join(columns + constraints))
+        translated.append(statement)
+    return translated
+#
+#                   LOADER
+# Creates and populates the HR schema in a SQLite connection.
+#
+# @param connection sqlite3 connection
+# @param scriptPath STRING path to the Oracle script
+#
+
+
+def loadOracleScript(connection, scriptPath=defaultScriptPath):
+    curs = connection.cursor()
+    for statement in translateScript(readScript(scriptPath)):
+        curs.execute(statement)
+    connection.commit()
+    curs.close()
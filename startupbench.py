@@ -0,0 +1,82 @@
+#
+# Natural Language Interface to Databases
+#       Start-up Benchmark
+#
+# Measures, in fresh interpreters, how long it takes to import
+# implementation.py and how long until the first question has
+# been translated (connection, catalog, lexicon compile and one
+# pass through the pipeline) against the SQLite stand-in.
+#
+# Each stop word source is measured separately: the bundled
+# snapshot, and the live NLTK corpus when NLTK is installed.
+#
+# Usage: python startupbench.py [--runs N] [--json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+probe = r"""
+import contextlib, io, json, time
+start = time.perf_counter()
+import implementation
+imported = time.perf_counter()
+from pool import SqliteBackend
+with contextlib.redirect_stdout(io.StringIO()):
+    pool, catalog = implementation.databaseConnection(SqliteBackend())
+    implementation.translate('show the average salary', catalog,
+                             lambda word: 5)
+translated = time.perf_counter()
+print(json.dumps({'import': imported - start,
+                  'firstTranslation': translated - start}))
+"""
+
+
+def measure(stopWordSource, runs):
+    environment = dict(os.environ, NLI_STOPWORDS=stopWordSource)
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', probe],
+                                         cwd=here, env=environment)
+        samples.append(json.loads(output.decode().splitlines()[-1]))
+    return dict((key, statistics.median(sample[key] for sample in samples))
+                for key in ('import', 'firstTranslation'))
+
+
+def nltkInstalled():
+    try:
+        import nltk.corpus
+        nltk.corpus.stopwords.words('english')
+        return True
+    except Exception:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    sources = ['snapshot']
+    if nltkInstalled():
+        sources.append('nltk')
+    results = dict((source, measure(source, args.runs))
+                   for source in sources)
+
+    if args.json:
+        print(json.dumps(results, indent=1, sort_keys=True))
+        return
+    print("median of %d runs    import     first translation" % args.runs)
+    for source in sources:
+        print("%-19s %7.1f ms   %7.1f ms"
+              % (source, results[source]['import'] * 1000,
+                 results[source]['firstTranslation'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#
+# Natural Language Interface to Databases
+#       Statement Cache
+#
+# Client-side cache of prepared cursors, one cache per pooled
+# connection. Generated queries carry their literals as bind
+# variables, so every question of the same shape produces the
+# same SQL text and reuses the cursor prepared for it: Oracle
+# parses the statement once instead of hard parsing every
+# question.
+#
+# With cx_Oracle the cursor is prepared once and re-executed
+# with execute(None, binds). Drivers without prepare() (sqlite3)
+# re-execute the same text on the same cursor, which hits their
+# own compiled statement cache.
+#
+# Statements that write a table are reported to onWrite, which
+# the pool uses to tell its result caches.
+import collections
+import re
+
+import instrumentation
+
+bindFind = re.compile(r':(\w+)')
+writeFind = re.compile(r'^\s*(?:insert\s+into|update|delete\s+from|'
+                       r'merge\s+into|truncate\s+table)\s+(\w+)', re.I)
+
+
+# @return STRING lowercase table a statement writes, or None
+def tableWritten(sql):
+    match = writeFind.match(sql)
+    return match.group(1).lower() if match else None
+#
+#                   STATEMENT CACHE
+# @param connection DB-API connection the cursors belong to
+# @param maxStatements INT prepared cursors kept open
+# @param onWrite function table name -> None, or None
+#
+
+
+class StatementCache(object):
+
+    def __init__(self, connection, maxStatements=50, onWrite=None):
+        self.connection = connection
+        self.onWrite = onWrite
+        self.maxStatements = maxStatements
+        self.cursors = collections.OrderedDict()
+        self.stats = {'executions': 0, 'prepares': 0, 'evictions': 0}
+
+    def cursor(self, sql):
+        curs = self.cursors.get(sql)
+        if curs is not None:
+            self.cursors.move_to_end(sql)
+            return curs
+        curs = self.connection.cursor()
+        if hasattr(curs, 'prepare'):
+            curs.prepare(sql)
+        self.stats['prepares'] += 1
+        self.cursors[sql] = curs
+        while len(self.cursors) > self.maxStatements:
+            oldSql, oldCursor = self.cursors.popitem(last=False)
+            oldCursor.close()
+            self.stats['evictions'] += 1
+        return curs
+
+    # @return the executed cursor, ready for fetching
+    def execute(self, sql, binds=None):
+        curs = self.cursor(sql)
+        self.stats['executions'] += 1
+        with instrumentation.timer('db.execute'):
+            if hasattr(curs, 'prepare'):
+                curs.execute(None, binds or {})
+            else:
+                curs.execute(sql, binds or {})
+        if self.onWrite is not None:
+            table = tableWritten(sql)
+            if table is not None:
+                self.onWrite(table)
+        return curs
+
+    def close(self):
+        for curs in self.cursors.values():
+            try:
+                curs.close()
+            except Exception:
+                pass
+        self.cursors.clear()
+#
+#                   INLINE BINDS
+# Renders a parameterised query with its literals written in,
+# for display and for the QueryRan column of the Log table.
+#
+# @param sql STRING query with :name bind variables
+# @param binds DICT bind name -> value
+#
+# @return STRING query text with literal values
+#
+
+
+def inlineBinds(sql, binds):
+    if not binds:
+        return sql
+
+    def literal(match):
+        name = match.group(1)
+        if name not in binds:
+            return match.group(0)
+        value = binds[name]
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'%s'" % str(value).replace("'", "''")
+    return bindFind.sub(literal, sql)
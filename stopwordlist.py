@@ -0,0 +1,71 @@
+#
+# Natural Language Interface to Databases
+#       Stop Word Snapshot
+#
+# Frozen copy of the NLTK english stop word corpus, so the
+# pipeline starts without importing NLTK or needing the NLTK
+# data directory on the host. Bump stopWordVersion whenever the
+# list is regenerated.
+#
+# Regenerate from the installed corpus with:
+#   python stopwordlist.py > stopwordlist.new
+# and review the diff before replacing this file.
+stopWordVersion = 'nltk-3.4-english-179'
+
+stopWordList = (
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you',
+    "you're", "you've", "you'll", "you'd", 'your', 'yours', 'yourself',
+    'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her',
+    'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them',
+    'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom',
+    'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was',
+    'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do',
+    'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or',
+    'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with',
+    'about', 'against', 'between', 'into', 'through', 'during', 'before',
+    'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out',
+    'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once',
+    'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both',
+    'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor',
+    'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't',
+    'can', 'will', 'just', 'don', "don't", 'should', "should've", 'now',
+    'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't",
+    'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn',
+    "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't", 'ma',
+    'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan',
+    "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't",
+    'won', "won't", 'wouldn', "wouldn't",
+)
+#
+#                   REGENERATE
+# Prints this module with the word list taken from NLTK.
+#
+
+
+def freezeStopWords():
+    from nltk.corpus import stopwords
+    words = stopwords.words('english')
+    with open(__file__) as moduleFile:
+        source = moduleFile.read()
+    header = source[:source.index('stopWordVersion = ')]
+    footer = source[source.index(')\n#\n#                   REGENERATE'):]
+    body = ["stopWordVersion = 'nltk-%s-english-%d'\n\n"
+            % (nltkVersion(), len(words)), "stopWordList = (\n"]
+    line = '   '
+    for word in words:
+        item = ' %r,' % word
+        if len(line) + len(item) > 79:
+            body.append(line + '\n')
+            line = '   '
+        line += item
+    body.append(line + '\n')
+    return header + ''.join(body) + footer
+
+
+def nltkVersion():
+    import nltk
+    return nltk.__version__
+
+
+if __name__ == '__main__':
+    print(freezeStopWords(), end='')
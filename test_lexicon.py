@@ -0,0 +1,66 @@
+#
+# Natural Language Interface to Databases
+#       Lexicon Correction Tests
+#
+# Typo correction must not rewrite real values: a name the value
+# index holds stays a left over word even when it is one edit
+# from a lexicon word ("rose" and "role").
+#
+# Usage:
+#   python -m unittest test_lexicon
+import unittest
+
+import implementation
+from lexicon import defaultLexicon
+from pool import SqliteBackend
+from valueindex import ValueIndex, ignoreWord
+
+
+class ValueCorrectionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = SqliteBackend()
+        cls.pool, cls.catalog = implementation.databaseConnection(
+            cls.backend)
+        with cls.pool.cursor() as curs:
+            curs.execute("INSERT INTO Employees (EmpID, First_Name, "
+                         "Last_Name, Email, Phone, Hire_Date, Salary, "
+                         "ManagerID, JobID, DepartmentID) VALUES (900, "
+                         "'Rose', 'Cole', 'rose@email.com', 7529392500, "
+                         "'01-JAN-2020', 30000, 1, 1, 1)")
+            curs.connection.commit()
+        cls.valueIndex = ValueIndex.fromPool(cls.pool, refreshInterval=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.backend.close()
+
+    def translate(self, question):
+        query = implementation.translateQuery(
+            question, self.catalog,
+            self.valueIndex.resolver(lambda word: ignoreWord),
+            valueIndex=self.valueIndex)
+        return query.render()
+
+    def testIndexedNameIsNotCorrected(self):
+        sql, binds = self.translate('show salary of rose')
+        self.assertIn('WHERE first_name = :v0', sql)
+        self.assertNotIn('job_title', sql)
+        self.assertEqual(binds, {'v0': 'Rose'})
+
+    def testIndexedLastNameIsNotCorrected(self):
+        sql, binds = self.translate('show salary of cole')
+        self.assertIn('WHERE last_name = :v0', sql)
+        self.assertEqual(binds, {'v0': 'Cole'})
+
+    # Without a value index one edit in four letters is not enough
+    def testShortTokenNeedsMoreThanThreshold(self):
+        lexicon = defaultLexicon()
+        self.assertEqual(lexicon.classify(['rose'], [])[5], ['rose'])
+        self.assertEqual(lexicon.classify(['salry'], [])[0], ['salary'])
+
+
+if __name__ == '__main__':
+    unittest.main()
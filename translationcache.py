@@ -0,0 +1,217 @@
+#
+# Natural Language Interface to Databases
+#       Translation Cache
+#
+# Two-level cache of Query IR in front of buildQuery.
+#
+#   exact   keyed on the normalised tokens left after stop word
+#           removal (plus the dates and operators found in the
+#           input), so "show the average salary" and "please show
+#           average salary" share one entry.
+#   shape   keyed on the category signature from keyword detection
+#           (attributes, entities, aggregates, order, operators and
+#           how many numbers and dates there are). The stored Query
+#           has numbered slots in its bind variables, which are
+#           filled with each question's literals.
+#
+# Questions with left over words are never cached: what those
+# words mean is decided by the resolver, not by the tokens.
+import collections
+import json
+import os
+import threading
+
+import instrumentation
+from queryir import Query
+
+cacheVersion = 3
+#
+#                   LRU CACHE
+# Size bounded, thread-safe least recently used cache with hit
+# and miss counters.
+#
+# @param maxSize INT entries kept before the oldest is evicted
+#
+
+
+class LRUCache(object):
+
+    missing = object()
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, self.missing)
+            if value is self.missing:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxSize': self.maxSize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+#
+#                   TRANSLATION CACHE
+# @param exactSize INT entries in the exact level
+# @param shapeSize INT entries in the shape level
+# @param path STRING JSON file the cache is persisted to, or None
+#
+
+
+class TranslationCache(object):
+
+    failed = 'FAILED'
+
+    def __init__(self, exactSize=10000, shapeSize=2000, path=None):
+        self.exact = LRUCache(exactSize)
+        self.shapes = LRUCache(shapeSize)
+        self.path = path
+        if path and os.path.exists(path):
+            self.load()
+
+    def exactKey(self, tokenStop, detectedDates, detectedOps):
+        return (tuple(tokenStop), tuple(detectedDates), tuple(detectedOps))
+
+    def shapeKey(self, detectedAtts, detectedEnts, detectedAggs,
+                 detectedNums, detectedOrder, detectedDates, detectedOps):
+        return (tuple(detectedAtts), tuple(detectedEnts),
+                tuple(detectedAggs), len(detectedNums),
+                tuple(detectedOrder), len(detectedDates),
+                tuple(detectedOps))
+    #
+    #               CACHED GENERATION
+    # Looks the question up in both levels and falls back to the
+    # generator on a miss, storing the result in both.
+    #
+    # On a shape miss the generator is run with slot markers in
+    # place of the numbers and dates, giving a template that any
+    # question of the same shape can fill.
+    #
+    # @param generate function(detectedNums, detectedDates) returning
+    #                 a Query, or None when no query can be built
+    #
+    # @return query Query IR, or None
+    #
+
+    def generate(self, generate, tokenStop, detectedAtts, detectedEnts,
+                 detectedAggs, detectedNums, detectedOrder, leftOverWords,
+                 detectedDates, detectedOps):
+        if leftOverWords:
+            instrumentation.count('translationCache.bypass')
+            return generate(detectedNums, detectedDates)
+
+        exactKey = self.exactKey(tokenStop, detectedDates, detectedOps)
+        cached = self.exact.get(exactKey)
+        if cached is not None:
+            instrumentation.count('translationCache.exactHit')
+            return None if cached == self.failed else cached
+
+        shapeKey = self.shapeKey(detectedAtts, detectedEnts, detectedAggs,
+                                 detectedNums, detectedOrder, detectedDates,
+                                 detectedOps)
+        template = self.shapes.get(shapeKey)
+        if template is None:
+            instrumentation.count('translationCache.miss')
+            template = generate(
+                ['{num%d}' % i for i in range(len(detectedNums))],
+                ['{date%d}' % i for i in range(len(detectedDates))])
+            if template is None:
+                template = self.failed
+            self.shapes.put(shapeKey, template)
+
+        else:
+            instrumentation.count('translationCache.shapeHit')
+        if template == self.failed:
+            self.exact.put(exactKey, self.failed)
+            return None
+        slots = {}
+        for i, value in enumerate(detectedNums):
+            slots['{num%d}' % i] = int(value)
+        for i, value in enumerate(detectedDates):
+            slots['{date%d}' % i] = value
+        binds = dict((name, slots.get(value, value) if isinstance(value, str)
+                      else value)
+                     for name, value in template.binds.items())
+        query = template.withBinds(binds)
+        self.exact.put(exactKey, query)
+        return query
+
+    def clear(self):
+        self.exact.clear()
+        self.shapes.clear()
+
+    def stats(self):
+        return {'exact': self.exact.stats(), 'shape': self.shapes.stats()}
+    #
+    #               PERSISTENCE
+    # Keys are nested tuples, stored as nested lists in JSON.
+    # Queries are stored in their dict form.
+    #
+
+    def save(self):
+        if not self.path:
+            return
+        snapshot = {'version': cacheVersion,
+                    'exact': [[key, flatten(value)] for key, value
+                              in self.exact.items()],
+                    'shape': [[key, flatten(value)] for key, value
+                              in self.shapes.items()]}
+        tempPath = self.path + '.tmp'
+        with open(tempPath, 'w') as cacheFile:
+            json.dump(snapshot, cacheFile)
+        os.replace(tempPath, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as cacheFile:
+                snapshot = json.load(cacheFile)
+        except (OSError, ValueError):
+            return
+        if snapshot.get('version') != cacheVersion:
+            return
+        for key, value in snapshot.get('exact', []):
+            self.exact.put(freeze(key), thaw(value))
+        for key, value in snapshot.get('shape', []):
+            self.shapes.put(freeze(key), thaw(value))
+
+
+# Cached values are Query objects or the failed marker
+def flatten(value):
+    return value.toDict() if isinstance(value, Query) else value
+
+
+def thaw(value):
+    return Query.fromDict(value) if isinstance(value, dict) else value
+
+
+def freeze(value):
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
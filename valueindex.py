@@ -0,0 +1,199 @@
+#
+# Natural Language Interface to Databases
+#       Value Index
+#
+# In-memory inverted index from the distinct values of the
+# columns a left over word can refer to (first name, last name,
+# city, department name) to the columns holding them, so most
+# left over words are resolved with one dictionary lookup instead
+# of a prompt.
+#
+# Every column is read in one bulk UNION ALL query. A refresh
+# only reads the rows whose key is above the highest key already
+# indexed, so new employees, locations and departments are picked
+# up cheaply; reload() rebuilds from scratch to drop values that
+# were updated or deleted.
+#
+# The index holds at most maxValues distinct words. Values past
+# the limit are counted and left to the fallback resolver.
+#
+# Lookups are case-insensitive and return the value as stored,
+# so the predicate matches the column's own spelling. A word that
+# is not indexed is looked up again in a fuzzy index over the
+# same words, so a misspelt name still resolves when the match is
+# confident enough.
+import sys
+import threading
+import time
+
+import instrumentation
+from fuzzy import FuzzyIndex
+#
+#                   VALUE SOURCES
+# Menu number (as in leftOverPrompt), column, table and the
+# increasing key used for incremental refresh.
+#
+valueSources = ((1, 'First_Name', 'Employees', 'EmpID'),
+                (2, 'Last_Name', 'Employees', 'EmpID'),
+                (3, 'City', 'Locations', 'LocationID'),
+                (4, 'Dept_Name', 'Departments', 'DepartmentID'))
+ignoreWord = 5
+
+
+def valueQuery(sources=valueSources):
+    return ' UNION ALL '.join(
+        'SELECT %d, %s, %s FROM %s WHERE %s > :after%d AND %s IS NOT NULL'
+        % (number, column, key, table, key, number, column)
+        for number, column, table, key in sources)
+#
+#                   VALUE INDEX
+# @param loader CALLABLE (sql, binds) -> rows of (source, value, key)
+# @param maxValues INT distinct words held in memory
+# @param refreshInterval NUMBER seconds between incremental
+#                        refreshes on lookup, None to disable
+#
+
+
+class ValueIndex(object):
+
+    fuzzyThreshold = 0.75
+
+    def __init__(self, loader, maxValues=100000, refreshInterval=60):
+        self.loader = loader
+        self.maxValues = maxValues
+        self.refreshInterval = refreshInterval
+        self.values = {}
+        self.fuzzy = FuzzyIndex()
+        self.highWater = dict((source[0], -1) for source in valueSources)
+        self.refreshedAt = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'ambiguous': 0,
+                      'corrected': 0, 'overflow': 0, 'loads': 0,
+                      'refreshes': 0, 'rowsRead': 0}
+
+    # Index over a pool, read through pooled cursors
+    @classmethod
+    def fromPool(cls, pool, maxValues=100000, refreshInterval=60):
+        def loader(sql, binds):
+            with pool.cursor() as curs:
+                curs.execute(sql, binds)
+                return curs.fetchall()
+        index = cls(loader, maxValues, refreshInterval)
+        index.reload()
+        return index
+
+    def reload(self):
+        with self.lock:
+            self.values = {}
+            self.fuzzy = FuzzyIndex()
+            self.highWater = dict((source[0], -1) for source in valueSources)
+            self.stats['loads'] += 1
+            self.load()
+
+    def refresh(self):
+        with self.lock:
+            self.stats['refreshes'] += 1
+            self.load()
+
+    # Caller holds the lock
+    def load(self):
+        binds = dict(('after%d' % number, self.highWater[number])
+                     for number in self.highWater)
+        with instrumentation.timer('db.valueIndexLoad'):
+            rows = self.loader(valueQuery(), binds)
+        for number, value, key in rows:
+            self.stats['rowsRead'] += 1
+            self.add(number, str(value))
+            if key > self.highWater[number]:
+                self.highWater[number] = key
+        self.refreshedAt = time.time()
+
+    def add(self, number, value):
+        word = value.lower()
+        columns = self.values.get(word)
+        if columns is None:
+            if len(self.values) >= self.maxValues:
+                self.stats['overflow'] += 1
+                return
+            self.values[word] = ((number, value),)
+            self.fuzzy.add(word)
+        elif all(column != number for column, stored in columns):
+            self.values[word] = columns + ((number, value),)
+
+    def isStale(self):
+        return (self.refreshInterval is not None and
+                time.time() - self.refreshedAt > self.refreshInterval)
+    #
+    #               LOOKUP
+    # @param word STRING left over word
+    #
+    # @return TUPLE of (menu number, stored value), empty if unknown
+    #
+
+    def lookup(self, word):
+        if self.isStale():
+            self.refresh()
+        columns = self.values.get(word.lower(), ())
+        if not columns:
+            self.stats['misses'] += 1
+            instrumentation.count('valueIndex.miss')
+        elif len(columns) > 1:
+            self.stats['ambiguous'] += 1
+            instrumentation.count('valueIndex.ambiguous')
+        else:
+            self.stats['hits'] += 1
+            instrumentation.count('valueIndex.hit')
+        return columns
+    #
+    #               RESOLVE
+    # Exact lookup, then a fuzzy one for words not indexed.
+    #
+    # @return TUPLE of (menu number, stored value), empty if unknown
+    #              or the closest value is not a confident match
+    #
+
+    def resolve(self, word):
+        columns = self.lookup(word)
+        if columns:
+            return columns
+        match = self.fuzzy.best(word)
+        if match is None or match.confidence < self.fuzzyThreshold:
+            return ()
+        self.stats['corrected'] += 1
+        instrumentation.count('valueIndex.corrected')
+        return self.values.get(match.word, ())
+    #
+    #               RESOLVER
+    # Resolver for queryGeneration. A word resolved to exactly one
+    # column is answered from the index; unknown and ambiguous
+    # words go to the fallback.
+    #
+    # @param fallback function word -> menu number
+    #
+    # @return function word -> menu number, or (number, value)
+    #
+
+    def resolver(self, fallback):
+        def resolveWord(word):
+            columns = self.resolve(word)
+            if len(columns) == 1:
+                return columns[0]
+            return fallback(word)
+        return resolveWord
+
+    # Approximate bytes held by the words and stored values
+    def memoryUsed(self):
+        total = sys.getsizeof(self.values)
+        for word, columns in self.values.items():
+            total += sys.getsizeof(word) + sys.getsizeof(columns)
+            total += sum(sys.getsizeof(value) for number, value in columns)
+        return total
+
+    def report(self):
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses'] + stats['ambiguous']
+        stats['hitRate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['values'] = len(self.values)
+        stats['fuzzyKeys'] = len(self.fuzzy.deletes)
+        stats['bytes'] = self.memoryUsed()
+        return stats